@@ -0,0 +1,101 @@
+"""
+Benchmark the msprime simulation models over a grid of problem sizes, and
+report the thresholds used by the 'auto' engine that follow from the results.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/auto_engine.py
+"""
+import argparse
+import time
+
+import stdpopsim
+
+
+def get_configurations(dtwf_generations):
+    """
+    Returns a list of (label, simulate kwargs) tuples to benchmark. The exact
+    Hudson coalescent is first, as it is the baseline for comparison.
+    """
+    return [
+        ("hudson", {"msprime_model": "hudson"}),
+        ("smc_prime", {"msprime_model": "smc_prime"}),
+        ("hybrid", {
+            "msprime_model": "dtwf",
+            "msprime_change_model": [(dtwf_generations, "hudson")]}),
+    ]
+
+
+def time_simulation(engine, model, contig, samples, seed, replicates, **kwargs):
+    """
+    Returns the mean wall clock time taken to run the specified simulation.
+    """
+    total = 0
+    for j in range(replicates):
+        before = time.perf_counter()
+        engine.simulate(
+            model=model, contig=contig, samples=samples, seed=seed + j, **kwargs)
+        total += time.perf_counter() - before
+    return total / replicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--length-multipliers", type=float, nargs="+", default=[0.01, 0.1, 0.3],
+        help="Fractions of human chromosome 22 to simulate.")
+    parser.add_argument(
+        "--samples", type=int, nargs="+", default=[10, 1000, 10000],
+        help="Numbers of samples to simulate.")
+    parser.add_argument(
+        "--replicates", type=int, default=1,
+        help="Number of replicates to average over for each configuration.")
+    parser.add_argument(
+        "--dtwf-generations", type=float,
+        default=stdpopsim.AutoEngine().dtwf_generations,
+        help="Time at which the DTWF hybrid switches to the Hudson model.")
+    parser.add_argument(
+        "--speedup", type=float, default=1.1,
+        help=(
+            "The factor by which the SMC' model must be faster than the "
+            "Hudson coalescent for it to be selected."))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    engine = stdpopsim.get_engine("msprime")
+    species = stdpopsim.get_species("homsap")
+    model = stdpopsim.PiecewiseConstantSize(species.population_size)
+    configurations = get_configurations(args.dtwf_generations)
+    print("\t".join(["rho", "samples"] + [label for label, _ in configurations]))
+    smc_rho = []
+    hybrid_overhead = []
+    for length_multiplier in args.length_multipliers:
+        contig = species.get_contig("chr22", length_multiplier=length_multiplier)
+        genetic_length = contig.recombination_map.get_total_recombination_rate()
+        rho = 4 * species.population_size * genetic_length
+        for num_samples in args.samples:
+            samples = model.get_samples(num_samples)
+            times = {}
+            for label, kwargs in configurations:
+                times[label] = time_simulation(
+                    engine, model, contig, samples, args.seed, args.replicates,
+                    **kwargs)
+            row = [f"{rho:.0f}", str(num_samples)]
+            row += [f"{times[label]:.3f}s" for label, _ in configurations]
+            print("\t".join(row), flush=True)
+            if times["hudson"] > args.speedup * times["smc_prime"]:
+                smc_rho.append(rho)
+            hybrid_overhead.append(times["hybrid"] / times["hudson"])
+
+    print()
+    print(f"Maximum DTWF hybrid overhead: {max(hybrid_overhead):.2f}x")
+    if len(smc_rho) == 0:
+        print(
+            "SMC' was never faster than Hudson: "
+            "smc_min_scaled_recombination=None")
+    else:
+        print(f"Suggested smc_min_scaled_recombination={min(smc_rho):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark the time taken to build the command line parser and parse the
+arguments for a simulation, comparing the full parser, which has a
+subparser for every species, with the parser built by stdpopsim_main, which
+only has a full subparser for the species being simulated. The catalog is
+grown by registering copies of the existing species.
+
+Also benchmark the cold start latency of commands that do not run
+simulations, each in a new Python interpreter, and report which of the
+heavy dependencies they import.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/cli_startup.py
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+import attr
+
+import stdpopsim
+import stdpopsim.cli as cli
+
+
+def grow_catalog(num_species):
+    """
+    Registers copies of the species in the catalog until it contains at
+    least the specified number of species.
+    """
+    species_list = list(stdpopsim.all_species())
+    j = 0
+    while len(list(stdpopsim.all_species())) < num_species:
+        species = species_list[j % len(species_list)]
+        stdpopsim.register_species(attr.evolve(species, id=f"{species.id}_copy{j}"))
+        j += 1
+
+
+def time_full(arg_list):
+    parser = cli.stdpopsim_cli_parser()
+    parser.parse_args(arg_list)
+
+
+def time_lazy(arg_list):
+    species_id = cli.get_species_id(arg_list)
+    parser = cli.stdpopsim_cli_parser(
+        species_ids=[] if species_id is None else [species_id])
+    parser.parse_args(arg_list)
+
+
+def mean_time(func, arg_list, replicates):
+    before = time.perf_counter()
+    for _ in range(replicates):
+        func(arg_list)
+    return (time.perf_counter() - before) / replicates
+
+
+# Commands that do not run simulations, which should start quickly.
+COLD_START_COMMANDS = [
+    ["--version"],
+    ["--help"],
+    ["homsap", "--help"],
+    ["homsap", "--help-models"],
+    ["download-genetic-maps", "--help"],
+]
+
+# Run in a new interpreter with the command line arguments; prints the heavy
+# dependencies that were imported.
+COLD_START_SCRIPT = """
+import sys
+import stdpopsim.cli
+try:
+    stdpopsim.cli.stdpopsim_main(sys.argv[1:])
+except SystemExit:
+    pass
+modules = ["msprime", "tskit", "numpy", "humanize"]
+print("imports:", *[m for m in modules if m in sys.modules], file=sys.stderr)
+"""
+
+
+def time_cold_start(command):
+    """
+    Returns the wall clock time taken to run the specified command in a new
+    interpreter, and the heavy dependencies it imported.
+    """
+    before = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START_SCRIPT] + command, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - before
+    # Help is written to stderr by some options, so find the last line.
+    imports = result.stderr.splitlines()[-1][len("imports:"):].strip()
+    return elapsed, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--num-species", type=int, nargs="+", default=[5, 20, 50, 100, 200],
+        help="Catalog sizes to benchmark.")
+    parser.add_argument(
+        "--replicates", type=int, default=10,
+        help=(
+            "Number of times to build the parser for each catalog size, and "
+            "to run each command from a cold start."))
+    args = parser.parse_args()
+
+    print("\t".join(["command", "median", "min", "imports"]))
+    for command in COLD_START_COMMANDS:
+        results = [time_cold_start(command) for _ in range(args.replicates)]
+        times = [t for t, _ in results]
+        row = [
+            " ".join(command), f"{1000 * statistics.median(times):.1f}ms",
+            f"{1000 * min(times):.1f}ms", results[0][1] or "-"]
+        print("\t".join(row), flush=True)
+    print()
+
+    arg_list = ["homsap", "-c", "chr22", "-o", "out.trees", "10"]
+    print("\t".join(["species", "full", "lazy", "speedup"]))
+    for num_species in sorted(args.num_species):
+        grow_catalog(num_species)
+        full = mean_time(time_full, arg_list, args.replicates)
+        lazy = mean_time(time_lazy, arg_list, args.replicates)
+        row = [
+            str(len(list(stdpopsim.all_species()))),
+            f"{1000 * full:.1f}ms", f"{1000 * lazy:.1f}ms", f"{full / lazy:.1f}x"]
+        print("\t".join(row), flush=True)
+
+
+if __name__ == "__main__":
+    main()
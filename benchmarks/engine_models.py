@@ -0,0 +1,99 @@
+"""
+Benchmark the msprime simulation models available through the msprime
+engine, comparing the runtime of each against the exact Hudson coalescent
+for every model in the catalog.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/engine_models.py --samples 100
+"""
+import argparse
+import time
+
+import stdpopsim
+
+
+def get_configurations(msprime_models, dtwf_generations):
+    """
+    Returns a list of (label, simulate kwargs) tuples to benchmark. The exact
+    Hudson coalescent is always first, as it is the baseline for comparison.
+    """
+    msprime_models = ["hudson"] + [m for m in msprime_models if m != "hudson"]
+    configurations = [
+        (msprime_model, {"msprime_model": msprime_model})
+        for msprime_model in msprime_models]
+    configurations.append((
+        f"dtwf+hudson@{dtwf_generations}", {
+            "msprime_model": "dtwf",
+            "msprime_change_model": [(dtwf_generations, "hudson")]}))
+    return configurations
+
+
+def time_simulation(engine, model, contig, samples, seed, replicates, **kwargs):
+    """
+    Returns the mean wall clock time taken to run the specified simulation.
+    """
+    total = 0
+    for j in range(replicates):
+        before = time.perf_counter()
+        engine.simulate(
+            model=model, contig=contig, samples=samples, seed=seed + j, **kwargs)
+        total += time.perf_counter() - before
+    return total / replicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--length-multiplier", type=float, default=0.01,
+        help="Fraction of the first chromosome of each species to simulate.")
+    parser.add_argument(
+        "--samples", type=int, default=100,
+        help="Number of samples to draw from each sampling population.")
+    parser.add_argument(
+        "--replicates", type=int, default=3,
+        help="Number of replicates to average over for each configuration.")
+    parser.add_argument(
+        "--dtwf-generations", type=float, default=100,
+        help="Time at which the DTWF hybrid switches to the Hudson model.")
+    parser.add_argument(
+        "--msprime-models", nargs="*", default=["smc", "smc_prime"],
+        help=(
+            "The msprime models to compare against Hudson. Running the "
+            "DTWF model over the full history of large populations is slow, "
+            "so it is only included in the DTWF hybrid by default."))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    engine = stdpopsim.get_engine("msprime")
+    for msprime_model in args.msprime_models:
+        if msprime_model not in engine.supported_models:
+            parser.error(f"Unsupported msprime model '{msprime_model}'")
+    configurations = get_configurations(args.msprime_models, args.dtwf_generations)
+    header = ["species", "model"] + [label for label, _ in configurations]
+    print("\t".join(header))
+    for species in stdpopsim.all_species():
+        chrom = species.genome.chromosomes[0]
+        length_multiplier = args.length_multiplier
+        if chrom.length * length_multiplier < 1:
+            length_multiplier = 1
+        contig = species.get_contig(chrom.id, length_multiplier=length_multiplier)
+        for model in species.models:
+            samples = model.get_samples(
+                *([args.samples] * model.num_sampling_populations))
+            row = [species.id, model.id]
+            hudson_time = None
+            for label, kwargs in configurations:
+                t = time_simulation(
+                    engine, model, contig, samples, args.seed, args.replicates,
+                    **kwargs)
+                if hudson_time is None:
+                    hudson_time = t
+                    row.append(f"{t:.3f}s")
+                else:
+                    row.append(f"{t:.3f}s ({hudson_time / t:.2f}x)")
+            print("\t".join(row), flush=True)
+
+
+if __name__ == "__main__":
+    main()
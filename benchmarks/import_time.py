@@ -0,0 +1,68 @@
+"""
+Benchmark the time taken to import stdpopsim and to load species from the
+catalog, in new Python interpreters. Importing stdpopsim and then loading
+all species corresponds to importing stdpopsim when the catalog was
+imported eagerly.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/import_time.py
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Run in a new interpreter; prints the time taken by each step as JSON.
+SCRIPT = """
+import json, time
+times = {}
+before = time.perf_counter()
+import stdpopsim
+times["import"] = time.perf_counter() - before
+before = time.perf_counter()
+stdpopsim.get_species("homsap")
+times["one species"] = time.perf_counter() - before
+before = time.perf_counter()
+list(stdpopsim.all_species())
+times["all species"] = time.perf_counter() - before
+print(json.dumps(times))
+"""
+
+
+def run_interpreter():
+    """
+    Returns a dictionary of the times taken by each step of SCRIPT, and the
+    wall clock time taken to run it, including interpreter startup.
+    """
+    before = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT], check=True, stdout=subprocess.PIPE)
+    total = time.perf_counter() - before
+    times = json.loads(result.stdout)
+    times["total"] = total
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--replicates", type=int, default=10,
+        help="Number of interpreters to start.")
+    args = parser.parse_args()
+
+    results = [run_interpreter() for _ in range(args.replicates)]
+    print("\t".join(["step", "median", "min"]))
+    for step in results[0].keys():
+        times = [result[step] for result in results]
+        row = [
+            step, f"{1000 * statistics.median(times):.1f}ms",
+            f"{1000 * min(times):.1f}ms"]
+        print("\t".join(row))
+
+
+if __name__ == "__main__":
+    main()
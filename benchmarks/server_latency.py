@@ -0,0 +1,90 @@
+"""
+Benchmark the latency of small simulations run by the simulation server,
+compared with running the same simulation with the command line interface
+in a new Python interpreter. The server is started in this process, on a
+free port of localhost.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/server_latency.py
+"""
+import argparse
+import http.client
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from stdpopsim import server
+
+
+def time_request(address, document):
+    connection = http.client.HTTPConnection(*address)
+    before = time.perf_counter()
+    connection.request("POST", "/simulate", body=json.dumps(document).encode())
+    response = connection.getresponse()
+    response.read()
+    elapsed = time.perf_counter() - before
+    connection.close()
+    if response.status != 200:
+        raise ValueError(f"Request failed with status {response.status}")
+    return elapsed
+
+
+def time_cli(document):
+    with tempfile.NamedTemporaryFile(suffix=".trees") as f:
+        command = [
+            sys.executable, "-m", "stdpopsim", document["species"], "-q",
+            "-m", document["model"], "-c", document["chromosome"],
+            "-l", str(document["length_multiplier"]), "-s", str(document["seed"]),
+            "-o", f.name] + [str(n) for n in document["samples"]]
+        before = time.perf_counter()
+        subprocess.run(command, check=True)
+        return time.perf_counter() - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--replicates", type=int, default=10,
+        help="Number of times to run each simulation.")
+    args = parser.parse_args()
+
+    service = server.SimulationService(num_workers=1)
+    service.warm_up()
+    httpd = server.SimulationServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    address = httpd.server_address[:2]
+
+    document = {
+        "species": "homsap", "model": "ooa_3", "chromosome": "chr22",
+        "length_multiplier": 0.1, "samples": [10, 10, 10], "seed": 1}
+    rows = []
+    try:
+        times = [time_cli(document) for _ in range(args.replicates)]
+        rows.append(["cli", times])
+        first = time_request(address, document)
+        rows.append(["server (first request)", [first]])
+        for output in ["trees", "stats"]:
+            document["output"] = output
+            times = [
+                time_request(address, document) for _ in range(args.replicates)]
+            rows.append([f"server ({output})", times])
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        service.shutdown()
+
+    print("\t".join(["method", "median", "min"]))
+    for name, times in rows:
+        print("\t".join([
+            name, f"{1000 * statistics.median(times):.1f}ms",
+            f"{1000 * min(times):.1f}ms"]))
+
+
+if __name__ == "__main__":
+    main()
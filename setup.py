@@ -19,10 +19,10 @@ setup(
         'Topic :: Scientific/Engineering :: Bio-Informatics',
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.11',
     ],
+    # The versions of tskit, kastore and msprime below require Python 3.11.
+    python_requires='>=3.11',
     keywords='simulations, recombination map, models',
     packages=['stdpopsim'],
     include_package_data=True,
@@ -32,7 +32,14 @@ setup(
         ]
     },
     # NOTE: make sure this is the 'attrs' package, not 'attr'!
-    install_requires=["msprime", "attrs", "appdirs", "humanize"],
+    # The upper bounds on tskit and kastore are because stdpopsim.storage
+    # writes the tskit file format using the internals of kastore.store;
+    # the lower bounds are the versions it has been tested with. The
+    # kastore range must match stdpopsim.storage.KASTORE_VERSIONS, and the
+    # requirements/ files.
+    install_requires=[
+        "msprime>=1.4,<2", "attrs", "appdirs", "humanize", "numpy",
+        "tskit>=1.0,<2", "kastore>=0.3.6,<0.4"],
     url='https://github.com/popgensims/stdpopsim',
     project_urls={
         'Bug Reports': 'https://github.com/popgensims/stdpopsim/issues',
@@ -14,12 +14,16 @@ from . species import *  # NOQA
 from . genomes import *  # NOQA
 from . cache import *  # NOQA
 from . citations import *  # NOQA
+from . observers import *  # NOQA
 from . engines import * # NOQA
 
-# We import these here to build the catalog, but the internal classes
-# defined are not part of the external API.
-from .catalog import homo_sapiens  # NOQA
-from .catalog import pongo  # NOQA
-from .catalog import arabidopsis_thaliana  # NOQA
-from .catalog import e_coli  # NOQA
-from .catalog import drosophila_melanogaster  # NOQA
+# The species in the catalog are imported when they are first used; see
+# species.catalog_index. The catalog modules can still be accessed as
+# attributes of the package, e.g. stdpopsim.homo_sapiens.
+
+
+def __getattr__(name):
+    if name in [module_name for module_name, _ in catalog_index.values()]:  # NOQA
+        import importlib
+        return importlib.import_module(f".catalog.{name}", __name__)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -3,20 +3,27 @@ The command line interface for stdpopsim. Provides standard simulations
 at the command line and methods to manage resources used by stdpopsim.
 """
 import argparse
+import concurrent.futures
+import contextlib
+import csv
+import hashlib
+import io
 import json
 import logging
+import os
 import platform
 import sys
 import textwrap
 import tempfile
 import pathlib
-import shutil
 import functools
+import multiprocessing
+import random
+import time
 
-import msprime
-import tskit
-import humanize
-
+# msprime, tskit, humanize and the stdpopsim.storage module are imported in
+# the functions that use them, so that the --version and --help options and
+# the subcommands that do not run simulations start quickly.
 import stdpopsim
 
 # resource is from the standard library, but it's not available on
@@ -42,6 +49,13 @@ def exit(message):
 
 LOG_FORMAT = "%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s"
 
+OUTPUT_FORMATS = ["trees", "vcf", "npz"]
+
+# The compression codecs that may be used with each output format.
+OUTPUT_COMPRESSION = {"trees": ["lzma", "zlib"], "vcf": ["bgzip"], "npz": ["zlib"]}
+
+PROFILE_MODES = ["cpu", "mem", "both"]
+
 
 def setup_logging(args):
     log_level = "WARN"
@@ -52,6 +66,26 @@ def setup_logging(args):
     logging.basicConfig(format=LOG_FORMAT, level=log_level)
 
 
+def memory_size(value):
+    """
+    Converts a memory size string with an optional K, M, G or T suffix
+    (e.g., "512M" or "4G") to a number of bytes.
+    """
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    number = value
+    multiplier = 1
+    if len(value) > 0 and value[-1].upper() in units:
+        multiplier = units[value[-1].upper()]
+        number = value[:-1]
+    try:
+        size = int(float(number) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid memory size '{value}'")
+    if size <= 0:
+        raise argparse.ArgumentTypeError("Memory size must be positive")
+    return size
+
+
 def get_species_wrapper(species_id):
     try:
         return stdpopsim.get_species(species_id)
@@ -171,6 +205,9 @@ def get_environment():
     Returns a dictionary describing the environment in which stdpopsim
     is currently running.
     """
+    import msprime
+    import tskit
+
     env = {
         "os": {
             "system": platform.system(),
@@ -191,10 +228,16 @@ def get_environment():
     return env
 
 
-def get_provenance_dict():
+def get_provenance_dict(replicate=None, batch_job=None, engine_selection=None):
     """
     Returns a dictionary encoding an execution of stdpopsim conforming to the
-    tskit provenance schema.
+    tskit provenance schema. If replicate is specified, it is a dictionary
+    describing the replicate (its index and random seed) within a run of
+    multiple replicates, which is recorded in the parameters. Similarly, if
+    batch_job is specified, it is a dictionary describing the job (its
+    index and command line arguments) within a batch, and if
+    engine_selection is specified, it is the selection made by the "auto"
+    engine (see :meth:`.AutoEngine.get_selection`).
     """
     document = {
         "schema_version": "1.0.0",
@@ -208,30 +251,471 @@ def get_provenance_dict():
         },
         "environment": get_environment()
     }
+    if replicate is not None:
+        document["parameters"]["replicate"] = replicate
+    if batch_job is not None:
+        document["parameters"]["batch_job"] = batch_job
+    if engine_selection is not None:
+        document["parameters"]["engine_selection"] = engine_selection
     return document
 
 
-def write_output(ts, args):
+def write_output(
+        ts, args, output=None, observer=None, replicate=None, atomic=False,
+        model=None):
     """
     Adds provenance information to the specified tree sequence (ensuring that the
     output is reproducible) and write the resulting tree sequence to output.
+    If output is None, write to the file specified in args. If atomic is True,
+    the output file is written using :func:`dump_atomic`. The provenance
+    record is added as the file is written, without copying the tables.
+
+    If args.format is "vcf", the variants are streamed to the output in VCF
+    format instead (see :func:`stdpopsim.storage.write_vcf`), which has no
+    provenance record. Similarly, if args.format is "npz", the genotypes are
+    written in chunks (see :func:`stdpopsim.storage.write_genotypes`), with
+    the names of the populations of the specified model.
     """
-    tables = ts.dump_tables()
-    logger.debug("Updating provenance")
-    provenance = get_provenance_dict()
-    tables.provenances.add_row(json.dumps(provenance))
-    ts = tables.tree_sequence()
-    if args.output is None:
-        # There's no way to get tskit to write directly to stdout, so we write
-        # to a tempfile first.
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpfile = pathlib.Path(tmpdir) / "tmp.trees"
-            ts.dump(tmpfile)
-            with open(tmpfile, "rb") as f:
-                shutil.copyfileobj(f, sys.stdout.buffer)
+    from stdpopsim import storage
+
+    if output is None:
+        output = args.output
+    if args.format == "vcf":
+        contig_id = "1" if args.chromosome is None else args.chromosome
+
+        def write(file):
+            storage.write_vcf(ts, file, args.compression, contig_id)
+    elif args.format == "npz":
+        population_names = get_population_names(ts, model)
+
+        def write(file):
+            storage.write_genotypes(
+                ts, file, args.compression, args.chunk_size, population_names)
     else:
-        logger.info(f"Writing to {args.output}")
-        ts.dump(args.output)
+        with stdpopsim.observe_phase(
+                observer, stdpopsim.observers.PHASE_PROVENANCE):
+            logger.debug("Updating provenance")
+            provenance = get_provenance_dict(
+                replicate, args.batch_job, args.engine_selection)
+
+        def write(file):
+            storage.dump(ts, file, provenance, args.compression)
+    with stdpopsim.observe_phase(observer, stdpopsim.observers.PHASE_WRITE):
+        if output is None:
+            # The file is written sequentially, so we can stream it directly
+            # to stdout, even if this is a pipe.
+            write(sys.stdout.buffer)
+        else:
+            logger.info(f"Writing to {output}")
+            if atomic:
+                write_atomic(output, write)
+            else:
+                write(output)
+
+
+def get_population_names(ts, model=None):
+    """
+    Returns the names of the populations of the specified model, or None
+    if the model is not specified or does not have one population for each
+    population of the tree sequence, so that the default names are used.
+    """
+    if model is None or len(model.populations) != ts.num_populations:
+        return None
+    return [population.name for population in model.populations]
+
+
+def write_stats(ts, args, output, observer=None, model=None):
+    """
+    Computes the windowed summary statistics of the specified tree sequence
+    (see :func:`stdpopsim.stats.get_window_stats`), with the populations
+    named as in the specified model, and writes them to output, or to
+    stdout if output is "-".
+    """
+    from stdpopsim import stats
+
+    with stdpopsim.observe_phase(observer, stdpopsim.observers.PHASE_STATS):
+        population_names = get_population_names(ts, model)
+        windows = stats.get_windows(ts.sequence_length, args.windows)
+        window_stats = stats.get_window_stats(
+            ts, windows, population_names, args.stats_threads)
+        if output == "-":
+            stats.write_window_stats(window_stats, sys.stdout)
+        else:
+            logger.info(f"Writing statistics to {output}")
+            with open(output, "w") as f:
+                stats.write_window_stats(window_stats, f)
+
+
+def dump_atomic(ts, output, provenance=None, compression=None):
+    """
+    Writes the specified tree sequence to a temporary file in the same
+    directory as the output file, and then renames it to the output path, so
+    that the output file either does not exist or is complete, even if the
+    process is interrupted. The provenance and compression are as for
+    :func:`stdpopsim.storage.dump`.
+    """
+    from stdpopsim import storage
+
+    write_atomic(
+        output, lambda file: storage.dump(ts, file, provenance, compression))
+
+
+def write_atomic(output, write):
+    """
+    Calls write with the path of a temporary file in the same directory as
+    the output file, and then renames it to the output path (see
+    :func:`dump_atomic`).
+    """
+    path = pathlib.Path(output)
+    fd, tmpfile = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmpfile)
+        # mkstemp creates the file readable only by its owner; give it the
+        # permissions of a file created with open().
+        os.chmod(tmpfile, 0o666 & ~get_umask())
+        os.replace(tmpfile, path)
+    except BaseException:
+        os.unlink(tmpfile)
+        raise
+
+
+def get_umask():
+    """
+    Returns the file mode creation mask of the process.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def split_output(output):
+    """
+    Returns the output path split into the part before the file extension
+    and the file extension, which includes a compression suffix, e.g.
+    out.vcf.gz -> (out, .vcf.gz) and out.trees.sz -> (out, .trees.sz).
+    """
+    path = pathlib.Path(output)
+    suffix = path.suffix
+    if suffix in [".gz", ".sz"] and pathlib.Path(path.stem).suffix != "":
+        suffix = pathlib.Path(path.stem).suffix + suffix
+    return path.with_name(path.name[:len(path.name) - len(suffix)]), suffix
+
+
+def get_compressed_output(output):
+    """
+    Returns the path of a compressed tree sequence output file, to which
+    the suffix :data:`stdpopsim.storage.COMPRESSED_SUFFIX` is added if
+    necessary, e.g. out.trees -> out.trees.sz, as these files cannot be
+    read by tskit.load. Returns None if the output is stdout.
+    """
+    from stdpopsim import storage
+
+    if output is None:
+        return None
+    output = str(output)
+    if not output.endswith(storage.COMPRESSED_SUFFIX):
+        output += storage.COMPRESSED_SUFFIX
+        logger.info(
+            f"Writing the compressed tree sequence to {output}, which must "
+            "be read with stdpopsim.storage.load rather than tskit.load")
+    return output
+
+
+def get_subsample_output(output, sample_sizes):
+    """
+    Returns the path of the output file for the specified subsample, which
+    is derived from the main output path, e.g. out.trees -> out_10_5.trees.
+    """
+    base, suffix = split_output(output)
+    label = "_".join(str(n) for n in sample_sizes)
+    return f"{base}_{label}{suffix}"
+
+
+def get_replicate_output(output, replicate, num_replicates):
+    """
+    Returns the path of the output file for the specified replicate, which
+    is derived from the main output path by appending the replicate index,
+    zero-padded to the width of the largest index, e.g. out.trees ->
+    out_007.trees for replicate 7 of 1000.
+    """
+    base, suffix = split_output(output)
+    width = len(str(num_replicates - 1))
+    return f"{base}_{replicate:0{width}d}{suffix}"
+
+
+def get_replicate_seed(seed, replicate):
+    """
+    Returns the random seed for the specified replicate, derived from the
+    master seed. The seed for a given replicate depends only on the master
+    seed and the replicate index, so it does not change with the number of
+    replicates or how they are partitioned into tasks. Seeds are in the
+    range accepted by msprime (0 < seed < 2^32).
+    """
+    digest = hashlib.sha256(f"{seed}:{replicate}".encode()).digest()
+    return 1 + int.from_bytes(digest[:8], "little") % (2**32 - 2)
+
+
+def get_task_replicates(num_replicates, task_index, num_tasks):
+    """
+    Returns the range of replicate indexes to be run by the specified task
+    when num_replicates replicates are partitioned into num_tasks tasks.
+    Each task gets a contiguous block of replicates, and the block sizes
+    differ by at most one.
+    """
+    start = task_index * num_replicates // num_tasks
+    stop = (task_index + 1) * num_replicates // num_tasks
+    return range(start, stop)
+
+
+def get_journal_path(output, task_index=0, num_tasks=1):
+    """
+    Returns the path of the progress journal for the specified task, which
+    is stored next to the output files, e.g. out.trees -> out.journal, or
+    out.task3.journal when the replicates are partitioned into tasks.
+    """
+    path = pathlib.Path(output)
+    if num_tasks == 1:
+        return str(path.with_name(f"{path.stem}.journal"))
+    return str(path.with_name(f"{path.stem}.task{task_index}.journal"))
+
+
+# Arguments which do not change the outputs of a run, and so may differ
+# when it is resumed. The number of replicates is not one of them, as it
+# sets the width of the replicate indexes in the output file names.
+RESUME_IGNORED_ARGUMENTS = {
+    "batch_job", "bibtex_file", "cache_dir", "calibration", "dry_run",
+    "engine_selection", "estimate", "help_genetic_maps", "help_models",
+    "jobs", "jobs_file", "max_memory", "max_time", "metrics", "metrics_json",
+    "num_tasks", "output", "profile", "profile_output", "profiler",
+    "progress_interval", "progress_json", "quiet", "resume", "runner", "seed",
+    "stats_threads", "subcommand", "summary", "task_index", "verbosity"}
+
+
+def get_arguments_hash(args):
+    """
+    Returns a hash of the arguments which determine the outputs of a run,
+    which is recorded in its progress journal, so that a run is only
+    resumed with the same arguments. The random seeds are recorded
+    separately.
+    """
+    arguments = {
+        key: value for key, value in vars(args).items()
+        if key not in RESUME_IGNORED_ARGUMENTS and not callable(value)}
+    encoded = json.dumps(arguments, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def check_arguments_hash(records, arguments_hash):
+    """
+    Exits with an error if any of the specified journal records was written
+    by a run with arguments whose hash differs from the specified hash.
+    """
+    hashes = {
+        record["arguments_hash"] for record in records
+        if "arguments_hash" in record}
+    if len(hashes - {arguments_hash}) > 0:
+        exit(
+            "The progress journals were written by a run with different "
+            "arguments; cannot resume. Please use a different output file, "
+            "or remove the journals to start again")
+
+
+class ProgressJournal(object):
+    """
+    An append-only journal recording the progress of a run of multiple
+    replicates or batch jobs, written as one JSON object per line. Each
+    record has an ``event`` key, which is "started", "completed" or (for
+    batch jobs) "failed", and a ``timestamp``.
+    If arguments_hash is specified (see :func:`get_arguments_hash`), it is
+    recorded in each record. Records are flushed to disk as they are
+    written, so that the journal reflects the outputs that were complete
+    when a run was interrupted.
+    """
+    def __init__(self, path, arguments_hash=None):
+        self.path = path
+        self.arguments_hash = arguments_hash
+
+    def write(self, event, **kwargs):
+        record = {"event": event, "timestamp": time.time()}
+        if self.arguments_hash is not None:
+            record["arguments_hash"] = self.arguments_hash
+        record.update(kwargs)
+        with open(self.path, "a") as f:
+            print(json.dumps(record), file=f, flush=True)
+            os.fsync(f.fileno())
+
+    def started(self, replicate):
+        self.write("started", **replicate)
+
+    def completed(self, replicate, outputs):
+        self.write("completed", outputs=outputs, **replicate)
+
+
+class RunMetrics(stdpopsim.SimulationObserver):
+    """
+    Records the metrics of a run for the --metrics-json option: the total
+    wall and CPU time of each phase, the peak resident set size, and the
+    tree sequences that were written. The other keys of the JSON record
+    (such as the engine and model IDs) are set in the ``record`` dictionary
+    by the command that is run.
+
+    The peak RSS of simulations run in a separate process (e.g. with
+    --max-time or --max-memory) is recorded from their progress reports.
+    While such a simulation is running, its peak RSS is read from ``/proc``
+    (on Linux) by a background thread every ``progress_interval`` seconds,
+    which is negligible next to the cost of the simulation; the final peak
+    RSS is always reported when it finishes.
+    """
+    progress_interval = 10
+
+    def __init__(self):
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.phases = {}
+        self.simulation_peak_rss = None
+        self.record = {}
+        self.outputs = []
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        metrics = self.phases.setdefault(
+            phase, {"count": 0, "wall_time": 0, "cpu_time": 0})
+        metrics["count"] += 1
+        metrics["wall_time"] += wall_time
+        metrics["cpu_time"] += cpu_time
+
+    def progress(self, phase, elapsed_time, peak_rss=None, **kwargs):
+        # Simulations run in a separate process report its peak RSS.
+        if peak_rss is not None:
+            self.simulation_peak_rss = max(self.simulation_peak_rss or 0, peak_rss)
+
+    def add_output(self, ts, output, seed=None, replicate=None):
+        """
+        Records the size of the specified tree sequence, written to output
+        (None for stdout), and the random seed used to simulate it.
+        """
+        if seed is None:
+            seed = get_random_seed(ts)
+        file_size = None
+        if output is not None and os.path.exists(output):
+            file_size = os.path.getsize(output)
+        self.outputs.append({
+            "output": output,
+            "replicate": None if replicate is None else replicate["index"],
+            "seed": seed,
+            "num_samples": ts.num_samples,
+            "num_nodes": ts.num_nodes,
+            "num_edges": ts.num_edges,
+            "num_sites": ts.num_sites,
+            "num_mutations": ts.num_mutations,
+            "num_trees": ts.num_trees,
+            "nbytes": ts.nbytes,
+            "file_size": file_size,
+        })
+
+    def as_dict(self, error=None):
+        """
+        Returns the JSON record of the metrics, for a run which failed with
+        the specified error message if it is not None.
+        """
+        record = {
+            "timestamp": time.time(),
+            "version": stdpopsim.__version__,
+            "status": "ok" if error is None else "failed",
+            "error": error,
+        }
+        record.update(self.record)
+        peak_rss = None
+        peak_rss_children = None
+        if _resource_module_available:
+            scale = 1 if sys.platform == "darwin" else 1024
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+            peak_rss_children = (
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+        if self.simulation_peak_rss is not None:
+            peak_rss_children = max(peak_rss_children or 0, self.simulation_peak_rss)
+        record.update(
+            wall_time=time.perf_counter() - self.start_wall_time,
+            cpu_time=time.process_time() - self.start_cpu_time,
+            peak_rss=peak_rss, peak_rss_children=peak_rss_children,
+            phases=self.phases, outputs=self.outputs)
+        return record
+
+    def write(self, path, error=None):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(error), f, indent=2)
+            print(file=f)
+
+
+def get_random_seed(ts):
+    """
+    Returns the random seed recorded in the provenance of the specified tree
+    sequence by the simulator (e.g. msprime), or None if there is none.
+    """
+    for provenance in reversed(list(ts.provenances())):
+        try:
+            record = json.loads(provenance.record)
+            seed = record["parameters"]["random_seed"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        if isinstance(seed, int):
+            return seed
+    return None
+
+
+def get_journal_output(args):
+    """
+    Returns the output path next to which the progress journals of a run
+    are stored: the tree sequence output file or, if only statistics are
+    written, the statistics file.
+    """
+    return args.output if args.output is not None else args.stats
+
+
+def read_journals(output):
+    """
+    Returns the list of records in all of the progress journals for the
+    specified output file, i.e., those written by any task. Incomplete
+    lines, e.g. from a process killed while writing, are skipped.
+    """
+    path = pathlib.Path(output)
+    paths = list(path.parent.glob(f"{path.stem}.task*.journal"))
+    paths.append(pathlib.Path(get_journal_path(output)))
+    records = []
+    for journal_path in paths:
+        records.extend(read_journal(journal_path))
+    return records
+
+
+def read_journal(path):
+    """
+    Returns the list of records in the specified progress journal, which is
+    empty if the journal does not exist. Incomplete lines are skipped.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping incomplete record in {path}")
+    return records
+
+
+def get_completed_replicates(records):
+    """
+    Returns the set of (index, seed) tuples for the replicates recorded as
+    completed in the specified journal records whose output files all exist.
+    """
+    completed = set()
+    for record in records:
+        if record["event"] == "completed" and all(
+                os.path.exists(output) for output in record["outputs"]):
+            completed.add((record["index"], record["seed"]))
+    return completed
 
 
 def write_bibtex(engine, model, contig, bibtex_file):
@@ -271,6 +755,8 @@ def write_citations(engine, model, contig):
 def summarise_usage():
     # Don't report usage on Windows as the resource module is not available.
     #  We could do this using the psutil external library, if demand exists.
+    import humanize
+
     if _resource_module_available:
         rusage = resource.getrusage(resource.RUSAGE_SELF)
         user_time = humanize.naturaldelta(rusage.ru_utime)
@@ -283,6 +769,140 @@ def summarise_usage():
             user_time, sys_time, max_mem_str))
 
 
+def get_observer(args):
+    """
+    Returns a tuple (observer, file) for the simulation observer writing
+    phase timings and progress information as JSON to the file specified by
+    the --progress-json option, combined with the observers set up for the
+    --profile and --metrics-json options. If none of these options are set,
+    returns (None, None); if --progress-json is not set, the file is None.
+    """
+    observers = [
+        observer for observer in [args.profiler, args.metrics]
+        if observer is not None]
+    if args.metrics is not None:
+        # Poll the peak RSS at the same interval as the progress reports, so
+        # that combining the two does not report progress more often.
+        args.metrics.progress_interval = args.progress_interval
+    progress_file = None
+    if args.progress_json is not None:
+        if args.progress_json == "-":
+            progress_file = sys.stderr
+        else:
+            progress_file = open(args.progress_json, "w")
+        observers.append(stdpopsim.JsonObserver(
+            progress_file, progress_interval=args.progress_interval))
+    if len(observers) == 0:
+        return None, None
+    if len(observers) == 1:
+        return observers[0], progress_file
+    return stdpopsim.ObserverGroup(observers), progress_file
+
+
+def get_replicates(args):
+    """
+    Returns the list of replicates to be run for the specified arguments.
+    Each replicate is a dictionary with the keys "index", "seed" and
+    "master_seed". If --replicates is not specified, a single simulation is
+    run with the seed given by --seed and the list [None] is returned.
+    """
+    if args.replicates is None:
+        if args.task_index is not None or args.num_tasks is not None:
+            exit("The --task-index and --num-tasks options require --replicates")
+        if args.resume:
+            exit("The --resume option requires --replicates")
+        return [None]
+    if args.replicates < 1:
+        exit("The number of replicates must be at least 1")
+    if args.output is None and args.stats is None:
+        exit("The --replicates option requires an output file (--output or --stats)")
+    num_tasks = 1 if args.num_tasks is None else args.num_tasks
+    task_index = 0 if args.task_index is None else args.task_index
+    if num_tasks < 1:
+        exit("The number of tasks must be at least 1")
+    if not 0 <= task_index < num_tasks:
+        exit(f"The task index must be between 0 and {num_tasks - 1}")
+    seed = args.seed
+    if seed is None and args.resume:
+        master_seeds = {
+            record["master_seed"]
+            for record in read_journals(get_journal_output(args))}
+        if len(master_seeds) > 1:
+            exit(
+                "The progress journals contain replicates for different "
+                "master seeds; please specify the seed using --seed")
+        if len(master_seeds) == 1:
+            seed = master_seeds.pop()
+            logger.info(f"Resuming with master seed {seed}")
+    if seed is None:
+        if num_tasks > 1:
+            exit(
+                "The --seed option is required when the replicates are "
+                "partitioned into multiple tasks")
+        seed = random.SystemRandom().randint(1, 2**32 - 1)
+        logger.info(f"Using master seed {seed}")
+    indexes = get_task_replicates(args.replicates, task_index, num_tasks)
+    if len(indexes) == 0:
+        logger.warning(f"No replicates to run for task {task_index}")
+    return [
+        {"index": j, "seed": get_replicate_seed(seed, j), "master_seed": seed}
+        for j in indexes]
+
+
+def write_estimate(engine, model, contig, samples, args, num_simulations=1):
+    """
+    Writes the predicted running time and peak memory of the specified
+    simulation to stdout as JSON. The running time is the total for the
+    specified number of simulations (e.g., the replicates run by a task).
+    """
+    import humanize
+    from stdpopsim import estimator
+
+    if args.calibration is None:
+        resource_estimator = estimator.get_default_estimator()
+    else:
+        resource_estimator = estimator.ResourceEstimator.load(args.calibration)
+    if engine.id not in (resource_estimator.engine, "auto") or getattr(
+            args, "msprime_model", None) not in (None, "hudson"):
+        logger.warning(
+            f"The estimator was calibrated using {resource_estimator.engine} "
+            "with the Hudson model; the estimate may be inaccurate")
+    estimate = resource_estimator.estimate(model, contig, samples)
+    output = estimate.asdict()
+    output.update(
+        runtime=estimate.runtime * num_simulations,
+        runtime_upper=estimate.runtime_upper * num_simulations,
+        num_simulations=num_simulations,
+        features=estimator.get_features(model, contig, samples))
+    print(json.dumps(output, indent=2))
+    logger.info(
+        "Estimated runtime: {}; peak memory: {}".format(
+            humanize.naturaldelta(output["runtime"]),
+            humanize.naturalsize(estimate.peak_memory, binary=True)))
+
+
+def run_calibrate_estimator(args):
+    import humanize
+    from stdpopsim import estimator
+
+    output = args.output
+    if output is None:
+        output = estimator.get_user_calibration_path()
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+    def report(simulation, measurement):
+        logger.info(
+            f"{simulation}: wall_time={measurement['wall_time']:.2f}s; "
+            f"memory={humanize.naturalsize(measurement['memory'], binary=True)}")
+
+    simulations = estimator.get_calibration_simulations(quick=args.quick)
+    resource_estimator = estimator.calibrate(
+        engine=stdpopsim.get_engine(args.engine), simulations=simulations,
+        callback=report)
+    resource_estimator.dump(output)
+    print(f"Wrote estimator calibration to {output}", file=sys.stderr)
+
+
 def add_simulate_species_parser(parser, species):
     header = (
         f"Run simulations for {species.name} using up-to-date genome information, "
@@ -371,6 +991,139 @@ def add_simulate_species_parser(parser, species):
         help=(
             "Where to write the output tree sequence file. Defaults to "
             "stdout if not specified"))
+    species_parser.add_argument(
+        "--format", default="trees", choices=OUTPUT_FORMATS,
+        help=(
+            "The format of the output. With 'vcf', the variants are written "
+            "while the trees are traversed, without writing a tree sequence "
+            "file first. Each sample is a haploid individual. With 'npz', "
+            "the positions of the sites, the genotype matrix in chunks of "
+            "--chunk-size sites and the population of each sample are "
+            "written in NumPy's npz format. Default=trees."))
+    species_parser.add_argument(
+        "--chunk-size", type=int, default=10000, metavar="SITES",
+        help=(
+            "The number of sites in each chunk of the genotype matrix "
+            "written with --format npz. Default=10000."))
+    species_parser.add_argument(
+        "--stats", default=None, metavar="FILE",
+        help=(
+            "Compute summary statistics for each sampled population in "
+            "windows along the chromosome (diversity, Tajima's D, the site "
+            "frequency spectrum, and Fst between each pair of populations) "
+            "and write them to FILE as a tab-separated table, with one row "
+            "per window. Use '-' to write to stdout. The tree sequence is "
+            "then only written if --output is specified."))
+    species_parser.add_argument(
+        "--windows", type=int, default=1, metavar="N",
+        help=(
+            "The number of windows of equal length in which --stats are "
+            "computed. Default=1."))
+    species_parser.add_argument(
+        "--stats-threads", type=int, default=1, metavar="N",
+        help=(
+            "The number of threads used to compute --stats. Default=1."))
+    species_parser.add_argument(
+        "--compression", default=None,
+        choices=["lzma", "zlib", "bgzip"],
+        help=(
+            "Compress the output with the specified codec. For tree "
+            "sequences, use lzma or zlib: each table column is compressed "
+            "separately, and the output is still streamed, so it may be "
+            "written to stdout. zlib is fast and typically reduces the file "
+            "size by 2-3 times; lzma is several times slower but gives "
+            "smaller files. Compressed tree sequence files are given the "
+            "suffix .sz (e.g. out.trees.sz), and must be read with "
+            "stdpopsim.storage.load rather than tskit.load. For VCF, use "
+            "bgzip, which writes a file that can be indexed with tabix. For "
+            "npz, use zlib."))
+
+    species_parser.add_argument(
+        "--max-time", type=float, default=None, metavar="SECONDS",
+        help=(
+            "Stop the simulation with an error if it runs for longer than "
+            "the specified number of seconds."))
+    species_parser.add_argument(
+        "--max-memory", type=memory_size, default=None, metavar="SIZE",
+        help=(
+            "Stop the simulation with an error if it tries to use more than "
+            "the specified amount of memory, e.g. 512M or 4G. This limits "
+            "the size of the address space, which includes the memory "
+            "used by the stdpopsim process itself."))
+    species_parser.add_argument(
+        "--progress-json", default=None, metavar="FILE",
+        help=(
+            "Write the time taken by each phase of the simulation and "
+            "periodic progress reports to FILE, as one JSON object per "
+            "line. Use '-' to write to stderr."))
+    species_parser.add_argument(
+        "--progress-interval", type=float, default=10, metavar="SECONDS",
+        help="The interval between progress reports. Default=10.")
+    species_parser.add_argument(
+        "--subsample", type=int, nargs="+", action="append", default=None,
+        metavar="N",
+        help=(
+            "Also output the tree sequence for a smaller sample configuration, "
+            "given as the number of samples from each population. The "
+            "subsample is obtained by simplifying the simulation of the full "
+            "samples, so the sample sets are nested and no additional "
+            "simulations are run. This option may be provided multiple "
+            "times. Each subsample is written to a file named after the "
+            "output file, e.g. --subsample 10 5 -o out.trees writes "
+            "out_10_5.trees. Requires the --output option."))
+
+    species_parser.add_argument(
+        "--replicates", type=int, default=None, metavar="N",
+        help=(
+            "Run N replicate simulations. The seed for each replicate is "
+            "derived from the master seed given by --seed, and each "
+            "replicate is written to a file named after the output file "
+            "with the replicate index appended, e.g. out_007.trees, and "
+            "likewise for the statistics file. Requires the --output or "
+            "--stats option."))
+    species_parser.add_argument(
+        "--task-index", type=int, default=None, metavar="I",
+        help=(
+            "Run only the share of the replicates belonging to task I "
+            "(0 <= I < --num-tasks), e.g. from a job array. Requires the "
+            "--replicates and --seed options."))
+    species_parser.add_argument(
+        "--num-tasks", type=int, default=None, metavar="K",
+        help=(
+            "The number of tasks the replicates are partitioned into. "
+            "Default=1."))
+    species_parser.add_argument(
+        "--resume", action="store_true",
+        help=(
+            "Skip the replicates that were completed by a previous run with "
+            "the same output file. Progress is recorded in a journal next "
+            "to the output files (e.g., out.journal), and each output file "
+            "is only written to its final path once it is complete. If "
+            "--seed is not specified, the master seed of the previous run "
+            "is used. The run cannot be resumed if any other options that "
+            "change the outputs, including --replicates, differ from those "
+            "of the previous run."))
+
+    species_parser.add_argument(
+        "--dry-run", action="store_true",
+        help=(
+            "Check the arguments and set up the model and contig, but do "
+            "not run the simulation."))
+    species_parser.add_argument(
+        "--estimate", action="store_true",
+        help=(
+            "With --dry-run, write the predicted running time and peak memory "
+            "of the simulation to stdout as JSON. The prediction is based "
+            "on the number of samples, the genetic length of the contig, the "
+            "population sizes and the number of epochs in the model, using a "
+            "calibration from benchmark simulations. Run "
+            "'stdpopsim calibrate-estimator' to calibrate the estimator on "
+            "this machine."))
+    species_parser.add_argument(
+        "--calibration", default=None, metavar="FILE",
+        help=(
+            "Use the estimator calibration in FILE, as written by "
+            "'stdpopsim calibrate-estimator'."))
 
     species_parser.add_argument(
         "samples", type=int, nargs="+",
@@ -384,32 +1137,155 @@ def add_simulate_species_parser(parser, species):
             "populations; those that are omitted are set to zero."))
 
     def run_simulation(args):
-        if args.model is None:
-            model = stdpopsim.PiecewiseConstantSize(species.population_size)
-            model.generation_time = species.generation_time
-            model.citations.extend(species.population_size_citations)
-            model.citations.extend(species.generation_time_citations)
-        else:
-            model = get_model_wrapper(species, args.model)
-        if len(args.samples) > model.num_sampling_populations:
+        observer, progress_file = get_observer(args)
+        # Close the progress file on errors too, so that the last events
+        # are not lost.
+        try:
+            simulate(args, observer)
+        finally:
+            if progress_file is not None and progress_file is not sys.stderr:
+                progress_file.close()
+
+    def simulate(args, observer):
+        with stdpopsim.observe_phase(observer, stdpopsim.observers.PHASE_MODEL):
+            if args.model is None:
+                model = stdpopsim.PiecewiseConstantSize(species.population_size)
+                model.generation_time = species.generation_time
+                model.citations.extend(species.population_size_citations)
+                model.citations.extend(species.generation_time_citations)
+            else:
+                model = get_model_wrapper(species, args.model)
+            if len(args.samples) > model.num_sampling_populations:
+                exit(
+                    f"Cannot sample from more than {model.num_sampling_populations} "
+                    "populations")
+            samples = model.get_samples(*args.samples)
+        if (args.compression is not None
+                and args.compression not in OUTPUT_COMPRESSION[args.format]):
             exit(
-                f"Cannot sample from more than {model.num_sampling_populations} "
-                "populations")
-        samples = model.get_samples(*args.samples)
-
-        contig = species.get_contig(
-            args.chromosome, genetic_map=args.genetic_map,
-            length_multiplier=args.length_multiplier)
+                f"Cannot use {args.compression} compression with the "
+                f"{args.format} format")
+        if args.chunk_size < 1:
+            exit("The chunk size must be at least 1")
+        subsamples = [] if args.subsample is None else args.subsample
+        if len(subsamples) > 0 and args.output is None:
+            exit("The --subsample option requires an output file (--output)")
+        for sizes in subsamples:
+            padded_samples = args.samples + [0] * (len(sizes) - len(args.samples))
+            if any(n > m for n, m in zip(sizes, padded_samples)):
+                exit(
+                    f"Subsample {sizes} cannot contain more samples than "
+                    f"{args.samples} in any population")
+        replicates = get_replicates(args)
+        if args.stats is not None:
+            if args.windows < 1:
+                exit("The number of windows must be at least 1")
+            if args.stats_threads < 1:
+                exit("The number of threads must be at least 1")
+            if args.stats == "-" and (replicates != [None] or len(subsamples) > 0):
+                exit(
+                    "Statistics for multiple replicates or subsamples must be "
+                    "written to a file (--stats)")
+
+        with stdpopsim.observe_phase(observer, stdpopsim.observers.PHASE_CONTIG):
+            contig = species.get_contig(
+                args.chromosome, genetic_map=args.genetic_map,
+                length_multiplier=args.length_multiplier)
         engine = stdpopsim.get_engine(args.engine)
+        if args.metrics is not None:
+            args.metrics.record.update(
+                species=species.id, engine=engine.id,
+                engine_version=engine.get_version(),
+                model=model.id, chromosome=args.chromosome,
+                genetic_map=args.genetic_map,
+                length_multiplier=args.length_multiplier,
+                samples=args.samples, seed=args.seed)
+        if args.estimate and not args.dry_run:
+            exit("The --estimate option requires --dry-run")
+        if args.dry_run:
+            logger.info(
+                f"Dry run of simulation model {model.name} for {species.name} on "
+                f"{contig} with {len(samples)} samples using {engine.name}.")
+            if args.estimate:
+                write_estimate(engine, model, contig, samples, args, len(replicates))
+            return
         logger.info(
             f"Running simulation model {model.name} for {species.name} on "
             f"{contig} with {len(samples)} samples using {engine.name}.")
 
-        kwargs = vars(args)
-        kwargs.update(model=model, contig=contig, samples=samples)
-        ts = engine.simulate(**kwargs)
-        summarise_usage()
-        write_output(ts, args)
+        kwargs = dict(vars(args))
+        kwargs.update(
+            model=model, contig=contig, samples=samples, observer=observer)
+        if engine.id == "auto":
+            args.engine_selection = engine.get_selection(**kwargs)
+        journal = None
+        if replicates != [None]:
+            num_tasks = 1 if args.num_tasks is None else args.num_tasks
+            task_index = 0 if args.task_index is None else args.task_index
+            arguments_hash = get_arguments_hash(args)
+            journal_output = get_journal_output(args)
+            journal = ProgressJournal(
+                get_journal_path(journal_output, task_index, num_tasks),
+                arguments_hash)
+            if args.resume:
+                records = read_journals(journal_output)
+                check_arguments_hash(records, arguments_hash)
+                completed = get_completed_replicates(records)
+                remaining = [
+                    replicate for replicate in replicates
+                    if (replicate["index"], replicate["seed"]) not in completed]
+                logger.info(
+                    f"Skipping {len(replicates) - len(remaining)} completed "
+                    "replicates")
+                replicates = remaining
+        for replicate in replicates:
+            output = args.output
+            if replicate is not None:
+                logger.info(
+                    f"Running replicate {replicate['index']} with seed "
+                    f"{replicate['seed']}")
+                journal.started(replicate)
+                kwargs["seed"] = replicate["seed"]
+                if args.output is not None:
+                    output = get_replicate_output(
+                        args.output, replicate["index"], args.replicates)
+            try:
+                if len(subsamples) == 0:
+                    tree_sequences = [engine.simulate(**kwargs)]
+                else:
+                    nested_kwargs = dict(kwargs)
+                    del nested_kwargs["samples"]
+                    tree_sequences = engine.simulate_nested(
+                        sample_sizes=[args.samples] + subsamples, **nested_kwargs)
+            except (ValueError, stdpopsim.SimulationError) as e:
+                exit(str(e))
+            summarise_usage()
+            atomic = journal is not None or args.batch_job is not None
+            if args.format == "trees" and args.compression is not None:
+                output = get_compressed_output(output)
+            outputs = [output] + [
+                get_subsample_output(output, sizes) for sizes in subsamples]
+            if args.stats is None or output is not None:
+                for path, ts in zip(outputs, tree_sequences):
+                    write_output(ts, args, path, observer, replicate, atomic, model)
+            stats_outputs = []
+            if args.stats is not None:
+                stats_output = args.stats
+                if replicate is not None:
+                    stats_output = get_replicate_output(
+                        args.stats, replicate["index"], args.replicates)
+                stats_outputs = [stats_output] + [
+                    get_subsample_output(stats_output, sizes) for sizes in subsamples]
+                for path, ts in zip(stats_outputs, tree_sequences):
+                    write_stats(ts, args, path, observer, model)
+            if args.metrics is not None:
+                for path, ts in zip(outputs, tree_sequences):
+                    args.metrics.add_output(ts, path, kwargs["seed"], replicate)
+            if journal is not None:
+                written = [path for path in outputs if path is not None]
+                journal.completed(
+                    replicate,
+                    [os.path.abspath(path) for path in written + stats_outputs])
         if not args.quiet:
             write_citations(engine, model, contig)
         if args.bibtex_file is not None:
@@ -433,12 +1309,334 @@ def run_download_genetic_maps(args):
             genetic_map.download()
 
 
-def stdpopsim_cli_parser():
+# The columns of a batch job file. The species, samples and output are
+# required, and the others correspond to the options of the species
+# subcommands.
+BATCH_COLUMNS = [
+    "species", "model", "chromosome", "genetic_map", "length_multiplier",
+    "samples", "seed", "output"]
+
+BATCH_OPTIONS = {
+    "model": "--model",
+    "chromosome": "--chromosome",
+    "genetic_map": "--genetic-map",
+    "length_multiplier": "--length-multiplier",
+    "seed": "--seed",
+}
+
+
+def read_batch_jobs(path):
+    """
+    Returns the list of jobs in the specified batch job file, as
+    dictionaries mapping column names to values. Files with a '.json'
+    extension contain a list of objects; otherwise, the file is tab
+    separated with a header line giving the column names, and blank lines
+    and lines starting with '#' are ignored.
+    """
+    with open(path) as f:
+        if pathlib.Path(path).suffix == ".json":
+            jobs = json.load(f)
+            if not isinstance(jobs, list) or not all(
+                    isinstance(job, dict) for job in jobs):
+                raise ValueError("A JSON batch file must contain a list of objects")
+            return jobs
+        lines = [
+            line for line in f
+            if len(line.strip()) > 0 and not line.startswith("#")]
+    reader = csv.DictReader(lines, delimiter="\t")
+    jobs = []
+    for row in reader:
+        if None in row or None in row.values():
+            raise ValueError(
+                f"Wrong number of columns in line {reader.line_num} of {path}")
+        jobs.append({
+            key: value.strip() for key, value in row.items()
+            if len(value.strip()) > 0})
+    return jobs
+
+
+def get_batch_job_arg_list(job):
+    """
+    Returns the command line arguments of the species subcommand which runs
+    the specified batch job.
+    """
+    unknown = set(job.keys()) - set(BATCH_COLUMNS)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown batch job columns: {sorted(unknown)}")
+    for column in ["species", "samples", "output"]:
+        if job.get(column) is None:
+            raise ValueError(f"The '{column}' column is required")
+    arg_list = [str(job["species"]), "--quiet", "--output", str(job["output"])]
+    for column, option in BATCH_OPTIONS.items():
+        if job.get(column) is not None:
+            arg_list.extend([option, str(job[column])])
+    samples = job["samples"]
+    if isinstance(samples, str):
+        samples = samples.replace(",", " ").split()
+    elif not isinstance(samples, list):
+        samples = [samples]
+    return arg_list + [str(n) for n in samples]
+
+
+def parse_batch_job(arg_list, args, index=None):
+    """
+    Returns the parsed arguments for the species subcommand with the
+    specified command line arguments, with the top-level options (e.g., the
+    engine) taken from the arguments of the batch subcommand. Raises a
+    ValueError if the arguments are invalid.
+    """
+    parser = stdpopsim_cli_parser(species_ids=[arg_list[0]])
+    # Values already in the namespace are kept by the top-level parser,
+    # while the species subparser sets all of its own options.
+    namespace = argparse.Namespace(**vars(args))
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            job_args = parser.parse_args(arg_list, namespace=namespace)
+    except SystemExit:
+        message = stderr.getvalue().strip().splitlines()
+        raise ValueError(message[-1] if len(message) > 0 else "Invalid arguments")
+    job_args.batch_job = {"index": index, "args": arg_list}
+    return job_args
+
+
+def get_batch_journal_path(jobs_file):
+    """
+    Returns the path of the progress journal for the specified batch job
+    file, which is stored next to it, e.g. jobs.tsv -> jobs.batch.journal.
+    """
+    path = pathlib.Path(jobs_file)
+    return str(path.with_name(f"{path.stem}.batch.journal"))
+
+
+def get_batch_job_key(job_args):
+    """
+    Returns a dictionary identifying the specified parsed batch job in the
+    batch journal: the hash of its arguments (see
+    :func:`get_arguments_hash`), its seed and its output path. A job is
+    only skipped by --resume if a completed job had the same key.
+    """
+    return {
+        "arguments_hash": get_arguments_hash(job_args),
+        "seed": job_args.seed,
+        "output": os.path.abspath(job_args.output),
+    }
+
+
+def get_completed_batch_jobs(records):
+    """
+    Returns the set of (arguments_hash, seed, output) tuples for the batch
+    jobs recorded as completed in the specified journal records whose
+    output files exist.
+    """
+    completed = set()
+    for record in records:
+        if record["event"] == "completed" and os.path.exists(record["output"]):
+            completed.add(
+                (record["arguments_hash"], record["seed"], record["output"]))
+    return completed
+
+
+def run_batch_job(index, arg_list, args):
+    """
+    Runs the specified job of a batch, returning a tuple (wall_time, error),
+    where error is None if the job succeeded.
+    """
+    before = time.perf_counter()
+    error = None
+    try:
+        job_args = parse_batch_job(arg_list, args, index)
+        job_args.runner(job_args)
+    except SystemExit as e:
+        error = str(e.code)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return time.perf_counter() - before, error
+
+
+def load_batch_resources(jobs):
+    """
+    Loads the species and downloads the genetic maps used by the specified
+    batch jobs, so that they are shared by the worker processes rather than
+    loaded or downloaded by each of them.
+    """
+    for species_id in sorted({str(job["species"]) for job in jobs}):
+        try:
+            species = stdpopsim.get_species(species_id)
+        except ValueError:
+            continue
+        genetic_maps = {
+            str(job["genetic_map"]) for job in jobs
+            if str(job["species"]) == species_id and
+            job.get("genetic_map") is not None}
+        for genetic_map_id in sorted(genetic_maps):
+            try:
+                genetic_map = species.get_genetic_map(genetic_map_id)
+                if not genetic_map.is_cached():
+                    genetic_map.download()
+            except Exception as e:
+                logger.warning(f"Cannot load genetic map {genetic_map_id}: {e}")
+
+
+def write_batch_summary(jobs, results, output, skipped=()):
+    """
+    Writes a tab separated summary of the batch jobs and the results
+    returned by :func:`run_batch_job` to the specified file object. The
+    jobs whose indexes are in skipped were completed by a previous run.
+    """
+    print("job", "species", "output", "status", "wall_time", "error",
+          sep="\t", file=output)
+    for index, (job, (wall_time, error)) in enumerate(zip(jobs, results)):
+        status = "ok" if error is None else "failed"
+        if index in skipped:
+            status = "skipped"
+        error = "" if error is None else " ".join(error.split())
+        print(
+            index, job.get("species", ""), job.get("output", ""), status,
+            f"{wall_time:.3f}", error, sep="\t", file=output)
+
+
+def run_batch(args):
+    try:
+        jobs = read_batch_jobs(args.jobs_file)
+    except (OSError, ValueError) as e:
+        exit(f"Cannot read batch file {args.jobs_file}: {e}")
+    if args.jobs < 1:
+        exit("The number of worker processes must be at least 1")
+    journal_path = get_batch_journal_path(args.jobs_file)
+    completed = set()
+    if args.resume:
+        completed = get_completed_batch_jobs(read_journal(journal_path))
+    journal = ProgressJournal(journal_path)
+    results = [None for _ in jobs]
+    pending = []
+    keys = {}
+    skipped = set()
+    for index, job in enumerate(jobs):
+        try:
+            arg_list = get_batch_job_arg_list(job)
+            job_args = parse_batch_job(arg_list, args, index)
+        except ValueError as e:
+            results[index] = (0, str(e))
+            continue
+        keys[index] = get_batch_job_key(job_args)
+        if tuple(keys[index].values()) in completed:
+            results[index] = (0, None)
+            skipped.add(index)
+        else:
+            pending.append((index, arg_list))
+    if len(skipped) > 0:
+        logger.info(f"Skipping {len(skipped)} completed batch jobs")
+    logger.info(
+        f"Running {len(pending)} of {len(jobs)} batch jobs with {args.jobs} "
+        "worker processes")
+    load_batch_resources([jobs[index] for index, _ in pending])
+
+    def record(index):
+        wall_time, error = results[index]
+        if error is None:
+            journal.completed(dict(job=index, **keys[index]), [keys[index]["output"]])
+        else:
+            journal.write("failed", job=index, error=error, **keys[index])
+
+    before = time.perf_counter()
+    if args.jobs == 1:
+        for index, arg_list in pending:
+            results[index] = run_batch_job(index, arg_list, args)
+            record(index)
+    else:
+        # Forked workers share the catalog loaded in this process.
+        context = None
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        # The profiler and metrics only cover this process, and cannot be
+        # pickled.
+        worker_args = argparse.Namespace(**vars(args))
+        worker_args.profiler = None
+        worker_args.metrics = None
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.jobs, mp_context=context) as executor:
+            futures = {
+                executor.submit(run_batch_job, index, arg_list, worker_args): index
+                for index, arg_list in pending}
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    # The worker process died, e.g. it was killed when
+                    # running out of memory.
+                    results[index] = (0, f"{type(e).__name__}: {e}")
+                record(index)
+                if results[index][1] is not None:
+                    logger.warning(f"Batch job {index} failed: {results[index][1]}")
+    logger.info(f"Ran batch jobs in {time.perf_counter() - before:.2f}s")
+
+    if args.summary is None:
+        write_batch_summary(jobs, results, sys.stderr, skipped)
+    else:
+        with open(args.summary, "w") as f:
+            write_batch_summary(jobs, results, f, skipped)
+    num_failed = sum(error is not None for _, error in results)
+    if num_failed > 0:
+        exit(f"{num_failed} of {len(jobs)} batch jobs failed")
+
+
+def run_serve(args):
+    from . import server
+
+    try:
+        service = server.SimulationService(
+            num_workers=args.workers, max_queue=args.max_queue,
+            cache_size=args.cache_size)
+    except ValueError as e:
+        exit(str(e))
+    service.default_engine = args.engine
+    service.warm_up()
+    try:
+        if args.socket is None:
+            httpd = server.SimulationServer((args.host, args.port), service)
+            address = "http://{}:{}".format(*httpd.server_address[:2])
+        else:
+            httpd = server.UnixSimulationServer(args.socket, service)
+            address = args.socket
+    except OSError as e:
+        exit(f"Cannot start the server: {e}")
+    logger.warning(f"Serving simulations at {address}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.shutdown()
+
+
+def add_species_placeholder_parser(parser, species_id, name):
+    """
+    Adds a subparser for the specified species that defines no arguments,
+    without the cost of building the full simulation parser. The placeholder
+    is only used to list the species in the top-level help and to find the
+    species requested on the command line.
+    """
+    parser.add_parser(
+        f"{species_id}", add_help=False, help=f"Run simulations for {name}.")
+
+
+def stdpopsim_cli_parser(species_ids=None):
+    """
+    Returns the argument parser for the command line interface. If
+    species_ids is specified, the full simulation subparsers are only built
+    for the species in this list, and the other species are placeholders
+    which do not accept their arguments (see :func:`get_species_id`).
+    """
 
     # TODO the CLI defined by this hierarchical and clumsy, but it's the best
     # I could figure out. It can definitely be improved!
     top_parser = argparse.ArgumentParser(
         description="Command line interface for stdpopsim.")
+    top_parser.set_defaults(
+        batch_job=None, profiler=None, metrics=None, engine_selection=None)
     top_parser.add_argument(
         "-V", "--version", action='version',
         version='%(prog)s {}'.format(stdpopsim.__version__))
@@ -457,10 +1655,34 @@ def stdpopsim_cli_parser():
     top_parser.add_argument(
         "-e", "--engine",
         default=stdpopsim.get_default_engine().id,
-        choices=[e.id for e in stdpopsim.all_engines()],
+        choices=stdpopsim.all_engine_ids(),
         help="Specify a simulation engine.")
 
-    for engine in stdpopsim.all_engines():
+    top_parser.add_argument(
+        "--profile", choices=PROFILE_MODES, default=None,
+        help=(
+            "Profile the functions called (cpu) and/or the memory allocated "
+            "by Python code (mem) in each phase of the run, from building the "
+            "command line parser to writing the output, and write a report "
+            "to the file given by --profile-output. Profiling slows down the "
+            "run, particularly for memory."))
+    top_parser.add_argument(
+        "--profile-output", default="-", metavar="FILE",
+        help="Write the profiling report to FILE. Default=stderr.")
+    top_parser.add_argument(
+        "--metrics-json", default=None, metavar="FILE",
+        help=(
+            "Write a JSON record of the metrics of the run to FILE, "
+            "including the wall and CPU time of each phase, the peak memory "
+            "usage, the engine, model and random seed, and the size of each "
+            "tree sequence written. The record is also written if the run "
+            "fails."))
+
+    # Only engines which have been imported define their specific parameters
+    # here, so that we do not import all available engines on startup.
+    # The engine selected on the command line is imported before the parser
+    # is built by stdpopsim_main.
+    for engine in stdpopsim.all_engines(load=False):
         group = top_parser.add_argument_group(
                 f"{engine.name} specific parameters")
         engine.add_arguments(group)
@@ -468,8 +1690,12 @@ def stdpopsim_cli_parser():
     subparsers = top_parser.add_subparsers(dest="subcommand")
     subparsers.required = True
 
-    for species in stdpopsim.all_species():
-        add_simulate_species_parser(subparsers, species)
+    # The names of the species are available without loading the catalog.
+    for species_id, name in stdpopsim.all_species_names().items():
+        if species_ids is None or species_id in species_ids:
+            add_simulate_species_parser(subparsers, stdpopsim.get_species(species_id))
+        else:
+            add_species_placeholder_parser(subparsers, species_id, name)
 
     download_maps_parser = subparsers.add_parser(
         "download-genetic-maps",
@@ -492,6 +1718,104 @@ def stdpopsim_cli_parser():
 
     download_maps_parser.set_defaults(runner=run_download_genetic_maps)
 
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Run many simulations listed in a file",
+        description=(
+            "Run the simulations listed in a batch job file in a pool of "
+            "worker processes, which share the species catalog and genetic "
+            "maps loaded by this process. Each job is equivalent to running "
+            "a species subcommand with the --quiet option, using the top-level "
+            "options (such as --engine) given before 'batch'. Each output "
+            "file is only written to its final path once it is complete, and "
+            "the completed and failed jobs are recorded in a journal next to "
+            "the batch job file (e.g., jobs.batch.journal). A tab "
+            "separated summary of the timings and failures of the jobs is "
+            "written at the end."))
+    batch_parser.add_argument(
+        "jobs_file", metavar="JOBS",
+        help=(
+            "The batch job file. A '.json' file contains a list of objects; "
+            "any other file is tab separated, with a header line. The "
+            "columns are species, model, chromosome, genetic_map, "
+            "length_multiplier, samples, seed and output, of which only "
+            "species, samples and output are required. The samples are "
+            "the numbers of samples from each population, separated by "
+            "commas or spaces (or a list, in JSON)."))
+    batch_parser.add_argument(
+        "-j", "--jobs", type=int, default=1, metavar="N",
+        help="Run N jobs at the same time. Default=1.")
+    batch_parser.add_argument(
+        "--summary", default=None, metavar="FILE",
+        help="Write the summary to FILE instead of stderr.")
+    batch_parser.add_argument(
+        "--resume", action="store_true",
+        help=(
+            "Skip the jobs that were completed by a previous run of the same "
+            "batch job file, according to its journal, if their output files "
+            "exist. A job is only skipped if its arguments, seed and output "
+            "are the same as those of the completed job."))
+    batch_parser.set_defaults(runner=run_batch)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Run simulations requested over HTTP",
+        description=(
+            "Start a local HTTP server which runs simulations requested as "
+            "JSON documents, keeping the species catalog, the contigs built "
+            "from genetic maps and the prepared models in memory between "
+            "requests. POST a JSON object with the keys species, model, "
+            "chromosome, genetic_map, length_multiplier, samples (a list), "
+            "seed, engine, output ('trees' or 'stats') and compression to "
+            "/simulate; the response is a tree sequence or a JSON object of "
+            "summary statistics. GET /status returns the state of the "
+            "server. Requests are rejected with status 503 when the queue "
+            "is full. The server should only be exposed to trusted clients."))
+    serve_parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="Listen on this address. Default=127.0.0.1.")
+    serve_parser.add_argument(
+        "--port", type=int, default=8000,
+        help="Listen on this port. Use 0 to pick a free port. Default=8000.")
+    serve_parser.add_argument(
+        "--socket", default=None, metavar="PATH",
+        help="Listen on a Unix domain socket at PATH instead of a TCP port.")
+    serve_parser.add_argument(
+        "--workers", type=int, default=1, metavar="N",
+        help="Run up to N simulations at the same time. Default=1.")
+    serve_parser.add_argument(
+        "--max-queue", type=int, default=16, metavar="N",
+        help=(
+            "Queue up to N requests while all workers are busy, and reject "
+            "further requests. Default=16."))
+    serve_parser.add_argument(
+        "--cache-size", type=int, default=64, metavar="N",
+        help=(
+            "Keep up to N contigs and N prepared simulations in memory. "
+            "Default=64."))
+    serve_parser.set_defaults(runner=run_serve)
+
+    calibrate_parser = subparsers.add_parser(
+        "calibrate-estimator",
+        help="Calibrate the runtime and memory estimator on this machine",
+        description=(
+            "Run a set of benchmark simulations and fit the model used by "
+            "the --dry-run --estimate options to predict the running time "
+            "and peak memory of simulations. By default, the calibration "
+            "is stored in the cache directory and used in place of the "
+            "calibration shipped with stdpopsim."))
+    calibrate_parser.add_argument(
+        "-o", "--output", default=None,
+        help=(
+            "Write the calibration to this file instead of the cache "
+            "directory. Use it with the --calibration option."))
+    calibrate_parser.add_argument(
+        "--quick", action="store_true",
+        help=(
+            "Only run the smallest benchmark simulations, which take a few "
+            "seconds. Estimates for large simulations will be less accurate."))
+    calibrate_parser.set_defaults(runner=run_calibrate_estimator)
+
     return top_parser
 
 
@@ -501,10 +1825,117 @@ def run(args):
     args.runner(args)
 
 
+def get_engine_id(arg_list=None):
+    """
+    Returns the ID of the simulation engine specified in the arguments,
+    without building the full argument parser.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-e", "--engine", default=stdpopsim.get_default_engine().id)
+    args, _ = parser.parse_known_args(arg_list)
+    return args.engine
+
+
+def get_profiler(arg_list=None):
+    """
+    Returns the :class:`.ProfilingObserver` for the --profile option in the
+    arguments, or None if it is not specified, without building the full
+    argument parser, so that the profile can cover building the parser.
+    Invalid values are reported by the main parser.
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--profile", default=None)
+    args, _ = parser.parse_known_args(arg_list)
+    if args.profile not in PROFILE_MODES:
+        return None
+    return stdpopsim.ProfilingObserver(
+        cpu=args.profile in ["cpu", "both"], memory=args.profile in ["mem", "both"])
+
+
+def get_metrics(arg_list=None):
+    """
+    Returns the :class:`RunMetrics` for the --metrics-json option in the
+    arguments, or None if it is not specified, without building the full
+    argument parser, so that the metrics include building the parser.
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--metrics-json", default=None)
+    args, _ = parser.parse_known_args(arg_list)
+    if args.metrics_json is None:
+        return None
+    return RunMetrics()
+
+
+def write_profile(profiler, path):
+    if path == "-":
+        profiler.write_report(sys.stderr)
+    else:
+        with open(path, "w") as f:
+            profiler.write_report(f)
+
+
+def get_species_id(arg_list=None):
+    """
+    Returns the ID of the species subcommand specified in the arguments, or
+    None if the subcommand is not a species, using a parser in which all
+    species are placeholders. Errors in the top-level arguments, and the
+    top-level help, are handled by this parser.
+    """
+    parser = stdpopsim_cli_parser(species_ids=[])
+    args, _ = parser.parse_known_args(arg_list)
+    if args.subcommand in stdpopsim.all_species_names():
+        return args.subcommand
+    return None
+
+
 def stdpopsim_main(arg_list=None):
-    parser = stdpopsim_cli_parser()
-    args = parser.parse_args(arg_list)
-    setup_logging(args)
-    if args.cache_dir is not None:
-        stdpopsim.set_cache_dir(args.cache_dir)
-    run(args)
+    profiler = get_profiler(arg_list)
+    metrics = get_metrics(arg_list)
+    observer = None
+    if profiler is not None and metrics is not None:
+        observer = stdpopsim.ObserverGroup([profiler, metrics])
+    elif profiler is not None or metrics is not None:
+        observer = profiler if metrics is None else metrics
+    if profiler is not None:
+        profiler.start()
+    args = None
+    error = None
+    try:
+        with stdpopsim.observe_phase(observer, stdpopsim.observers.PHASE_PARSE):
+            # Import the selected engine so that its specific parameters are
+            # defined. Unknown engine IDs are reported by the main parser.
+            engine_id = get_engine_id(arg_list)
+            if engine_id in stdpopsim.all_engine_ids():
+                stdpopsim.get_engine(engine_id)
+            # Only build the subparser for the species being simulated, as
+            # this includes the descriptions of all its models.
+            species_id = get_species_id(arg_list)
+            parser = stdpopsim_cli_parser(
+                species_ids=[] if species_id is None else [species_id])
+            args = parser.parse_args(arg_list)
+        args.profiler = profiler
+        args.metrics = metrics
+        setup_logging(args)
+        if args.cache_dir is not None:
+            stdpopsim.set_cache_dir(args.cache_dir)
+        run(args)
+    except SystemExit as e:
+        error = str(e.code)
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        # Parsing the arguments fails or exits (e.g. for --help) before the
+        # profile and metrics files are known. Otherwise, they are written
+        # for failed runs too.
+        if profiler is not None and args is not None:
+            write_profile(profiler, args.profile_output)
+        if metrics is not None and args is not None:
+            metrics.record.update(
+                command=sys.argv[0],
+                args=sys.argv[1:] if arg_list is None else list(arg_list))
+            metrics.write(args.metrics_json, error)
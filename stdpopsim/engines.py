@@ -1,13 +1,102 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import json
 import logging
+import multiprocessing
+import os
+import random
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 import attr
-import msprime
 import stdpopsim
+from . import observers
+
+# resource is from the standard library, but it's not available on
+# Windows. We break from the usual import grouping conventions here
+# to avoid lots of pep8 complaints about mixing imports and code.
+_resource_module_available = False
+try:
+    import resource
+    _resource_module_available = True
+except ImportError:
+    pass
 
 logger = logging.getLogger(__name__)
 
 _registered_engines = {}
 
+# Engines provided by other packages are advertised under this entry point
+# group, using the engine ID as the entry point name. For example, a package
+# providing an engine would include the following in its setup.py:
+#
+#    entry_points={
+#        "stdpopsim.engines": ["myengine = mypackage.engine:MyEngine"]
+#    }
+#
+# The module defining the engine is only imported when the engine is first
+# requested with get_engine(), so that users do not pay the import cost of
+# simulators that they do not use.
+ENGINE_ENTRY_POINT_GROUP = "stdpopsim.engines"
+
+# Maps engine IDs to entry points which have been discovered but not loaded.
+# This is None until the installed entry points are first scanned.
+_engine_entry_points = None
+
+
+def _iter_entry_points(group):
+    """
+    Returns a list of the installed entry points in the specified group.
+    """
+    try:
+        import importlib.metadata as importlib_metadata
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, []))
+
+
+def _get_engine_entry_points():
+    global _engine_entry_points
+    if _engine_entry_points is None:
+        _engine_entry_points = {}
+        for entry_point in _iter_entry_points(ENGINE_ENTRY_POINT_GROUP):
+            logger.debug(f"Found simulation engine '{entry_point.name}'")
+            _engine_entry_points[entry_point.name] = entry_point
+    return _engine_entry_points
+
+
+def _load_engine(entry_point):
+    """
+    Imports the engine defined by the specified entry point and registers it.
+    The entry point may refer to an :class:`.Engine` subclass, which is
+    instantiated, or to an instance.
+    """
+    logger.debug(f"Loading simulation engine '{entry_point.name}'")
+    engine = entry_point.load()
+    if isinstance(engine, type):
+        engine = engine()
+    if not isinstance(engine, Engine):
+        raise ValueError(
+            f"Entry point '{entry_point.name}' does not define a simulation engine")
+    if engine.id != entry_point.name:
+        raise ValueError(
+            f"Engine ID '{engine.id}' does not match entry point "
+            f"name '{entry_point.name}'")
+    register_engine(engine)
+    return engine
+
 
 def register_engine(engine):
     """
@@ -19,19 +108,39 @@ def register_engine(engine):
 
 def get_engine(id):
     """
-    Returns the simulation engine with the specified id.
+    Returns the simulation engine with the specified id. Engines provided
+    by other packages through the ``stdpopsim.engines`` entry point group
+    are imported the first time they are requested.
     """
     if id not in _registered_engines:
-        raise ValueError(f"Simulation engine '{id}' not registered")
+        entry_points = _get_engine_entry_points()
+        if id not in entry_points:
+            raise ValueError(f"Simulation engine '{id}' not registered")
+        _load_engine(entry_points[id])
     return _registered_engines[id]
 
 
-def all_engines():
+def all_engine_ids():
+    """
+    Returns a list of the IDs of all available simulation engines, without
+    importing engines provided by plugins.
+    """
+    ids = list(_registered_engines.keys())
+    for engine_id in _get_engine_entry_points().keys():
+        if engine_id not in ids:
+            ids.append(engine_id)
+    return ids
+
+
+def all_engines(load=True):
     """
-    Returns an iterator over all registered simulation engines.
+    Returns an iterator over all registered simulation engines. If load is
+    False, only engines that have already been imported are returned;
+    otherwise engines provided by plugins are imported as required.
     """
-    for sim_engine in _registered_engines.values():
-        yield sim_engine
+    engine_ids = all_engine_ids() if load else list(_registered_engines.keys())
+    for engine_id in engine_ids:
+        yield get_engine(engine_id)
 
 
 @attr.s(frozen=True)
@@ -64,11 +173,205 @@ class Engine(object):
         :type contig: :class:`msprime.simulations.Contig`
         :param samples: The samples to be obtained from the simulation.
         :type samples: list of :class:`msprime.simulations.Sample`
+        :param max_time: If specified, the simulation is run in a separate
+            process, which is terminated if it runs for longer than this
+            number of seconds (wall clock time).
+        :type max_time: float
+        :param max_memory: If specified, the simulation is run in a separate
+            process in which the size of the address space is limited to
+            this number of bytes.
+        :type max_memory: int
+        :param observer: If specified, the observer is notified of the
+            start and end of each phase of the simulation, and periodically
+            of the progress of long running phases.
+        :type observer: :class:`.SimulationObserver`
         :return: A succinct tree sequence.
         :rtype: :class:`tskit.trees.TreeSequence`
+        :raises ResourceLimitError: If the time or memory limit is exceeded.
         """
         raise NotImplementedError()
 
+    def simulate_nested(
+            self, model=None, contig=None, sample_sizes=None, **kwargs):
+        """
+        Simulates the model once using the largest of the specified sample
+        configurations, and derives a tree sequence for each configuration
+        by simplifying the result. Because all of the returned tree sequences
+        come from the same simulation the sample sets are nested, i.e., the
+        samples in a smaller configuration are a subset of the samples in any
+        larger configuration. This is much cheaper than running a separate
+        simulation for each configuration. Other keyword arguments are
+        passed to :meth:`.simulate`.
+
+        :param model: The demographic model to simulate.
+        :type model: :class:`.Model`
+        :param contig: The contig, defining the length and recombination
+            rate(s).
+        :type contig: :class:`msprime.simulations.Contig`
+        :param sample_sizes: A list of sample configurations. Each
+            configuration is a list giving the number of samples to draw from
+            each population, as for :meth:`.Model.get_samples`.
+        :type sample_sizes: list of lists of int
+        :return: A list of succinct tree sequences, one for each of the
+            specified sample configurations.
+        :rtype: list of :class:`tskit.trees.TreeSequence`
+        """
+        if sample_sizes is None or len(sample_sizes) == 0:
+            raise ValueError("At least one sample configuration must be specified")
+        num_populations = max(len(sizes) for sizes in sample_sizes)
+        max_sizes = [0 for _ in range(num_populations)]
+        for sizes in sample_sizes:
+            for j, n in enumerate(sizes):
+                if n < 0:
+                    raise ValueError("Sample sizes must be non-negative")
+                max_sizes[j] = max(max_sizes[j], n)
+        samples = model.get_samples(*max_sizes)
+        ts = self.simulate(model=model, contig=contig, samples=samples, **kwargs)
+        with observers.observe_phase(
+                kwargs.get("observer"), observers.PHASE_SUBSAMPLE):
+            return [_subsample(ts, sizes, max_sizes) for sizes in sample_sizes]
+
+    def prepare(self, model=None, contig=None, samples=None, **kwargs):
+        """
+        Prepares the model for repeated simulation with the specified contig
+        and samples, returning a :class:`.PreparedSimulation` which can be
+        run with different random seeds. Keyword arguments are as for
+        :meth:`.simulate`. Engines may override this method to do the work
+        that does not depend on the random seed once, which makes running
+        many replicates of small simulations faster.
+
+        :param model: The demographic model to simulate.
+        :type model: :class:`.Model`
+        :param contig: The contig, defining the length and recombination
+            rate(s).
+        :type contig: :class:`msprime.simulations.Contig`
+        :param samples: The samples to be obtained from the simulation.
+        :type samples: list of :class:`msprime.simulations.Sample`
+        :rtype: :class:`.PreparedSimulation`
+        """
+        return PreparedSimulation(
+            self, model=model, contig=contig, samples=samples, **kwargs)
+
+    async def simulate_async(self, executor=None, semaphore=None, **kwargs):
+        """
+        Asynchronous version of :meth:`.simulate`, which runs the simulation
+        in the specified executor so that the asyncio event loop is not
+        blocked. Keyword arguments are passed to :meth:`.simulate`.
+
+        If the task awaiting the simulation is cancelled, simulations that
+        have not yet started are not run. When running in a thread pool,
+        the ``cancel_event`` passed to :meth:`.simulate` is also set (an
+        event is created if not specified), which stops running simulations
+        for engines that support cancellation. msprime simulations can only
+        be stopped once running if they are run in a separate process, i.e.,
+        if ``max_time`` or ``max_memory`` are specified.
+
+        :param executor: The executor used to run the simulation. If None,
+            the default executor of the event loop (a thread pool) is used.
+            If a :class:`concurrent.futures.ProcessPoolExecutor` is
+            specified, the arguments must be picklable.
+        :type executor: :class:`concurrent.futures.Executor`
+        :param semaphore: If specified, the simulation is not submitted to
+            the executor until the semaphore is acquired. Sharing a
+            semaphore between calls limits the number of simulations that
+            run concurrently.
+        :type semaphore: :class:`asyncio.Semaphore`
+        :return: A succinct tree sequence.
+        :rtype: :class:`tskit.trees.TreeSequence`
+        """
+        if semaphore is None:
+            return await self._simulate_in_executor(executor, **kwargs)
+        async with semaphore:
+            return await self._simulate_in_executor(executor, **kwargs)
+
+    async def _simulate_in_executor(self, executor, **kwargs):
+        if not isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            if kwargs.get("cancel_event") is None:
+                kwargs["cancel_event"] = threading.Event()
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(executor, functools.partial(
+            self.simulate, **kwargs))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if kwargs.get("cancel_event") is not None:
+                kwargs["cancel_event"].set()
+            raise
+
+    def _simulate_with_limits(
+            self, max_time=None, max_memory=None, observer=None,
+            cancel_event=None, poll_interval=0.1, **kwargs):
+        """
+        Runs :meth:`.simulate` with the specified keyword arguments in a
+        child process subject to the specified time and memory limits, and
+        returns the resulting tree sequence. Engines should call this from
+        their :meth:`.simulate` method when a limit is specified. The child
+        process is killed and a :class:`.SimulationCancelledError` raised if
+        the cancel_event is set.
+        """
+        import tskit
+        if not _resource_module_available or sys.platform == "win32":
+            raise ValueError("Resource limits are not supported on this platform")
+        if max_time is not None and max_time <= 0:
+            raise ValueError("max_time must be positive")
+        if max_memory is not None and max_memory <= 0:
+            raise ValueError("max_memory must be positive")
+        # We fork so that the engine, model and contig do not need to be
+        # pickled. The tree sequence is returned through a temporary file.
+        context = multiprocessing.get_context("fork")
+        receiver, sender = context.Pipe(duplex=False)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "output.trees")
+            process = context.Process(
+                target=_run_limited_simulation,
+                args=(sender, self, kwargs, max_memory, output_file))
+            start = time.perf_counter()
+            process.start()
+            sender.close()
+            peak_rss = None
+            try:
+                with observers.observe_phase(
+                        observer, observers.PHASE_SIMULATE,
+                        lambda: {"peak_rss": _get_peak_rss(process.pid)}):
+                    try:
+                        while True:
+                            if receiver.poll(poll_interval):
+                                try:
+                                    status, value, peak_rss = receiver.recv()
+                                except EOFError:
+                                    process.join()
+                                    raise SimulationError(
+                                        "Simulation process exited unexpectedly "
+                                        f"with status {process.exitcode}")
+                                break
+                            elapsed = time.perf_counter() - start
+                            peak_rss = _get_peak_rss(process.pid) or peak_rss
+                            if cancel_event is not None and cancel_event.is_set():
+                                raise SimulationCancelledError(
+                                    f"Simulation cancelled after {elapsed:.1f}s")
+                            if max_time is not None and elapsed > max_time:
+                                raise ResourceLimitError(
+                                    "time", max_time, elapsed, peak_rss)
+                    finally:
+                        # The periodic reports miss the end of the simulation,
+                        # and there are none if it is shorter than the progress
+                        # interval, so we always report the final peak RSS.
+                        if (peak_rss is not None and observer is not None
+                                and observer.progress_interval is not None):
+                            observer.progress(
+                                observers.PHASE_SIMULATE,
+                                time.perf_counter() - start, peak_rss=peak_rss)
+            finally:
+                _kill_process_group(process)
+                receiver.close()
+            elapsed = time.perf_counter() - start
+            if status == "memory":
+                raise ResourceLimitError("memory", max_memory, elapsed, peak_rss)
+            elif status == "error":
+                raise value
+            with observers.observe_phase(observer, observers.PHASE_LOAD):
+                return tskit.load(output_file)
+
     def get_version(self):
         """
         Returns the version of the engine.
@@ -92,6 +395,401 @@ class Engine(object):
         pass
 
 
+class PreparedSimulation(object):
+    """
+    A simulation which has been prepared by :meth:`.Engine.prepare` so that
+    it can be run repeatedly with different random seeds.
+    """
+    def __init__(self, engine, **kwargs):
+        self.engine = engine
+        self.kwargs = kwargs
+
+    def run(self, seed=None, observer=None):
+        """
+        Runs the simulation with the specified random seed.
+
+        :param int seed: The random seed.
+        :param observer: If specified, the observer notified of the progress
+            of the simulation.
+        :type observer: :class:`.SimulationObserver`
+        :return: A succinct tree sequence.
+        :rtype: :class:`tskit.trees.TreeSequence`
+        """
+        return self.engine.simulate(seed=seed, observer=observer, **self.kwargs)
+
+
+class SimulationError(Exception):
+    """
+    Exception raised when a simulation run by an external program fails.
+    """
+
+
+class SimulationTimeoutError(SimulationError):
+    """
+    Exception raised when a simulation does not complete within the
+    specified time limit.
+    """
+
+
+class SimulationCancelledError(SimulationError):
+    """
+    Exception raised when a simulation is cancelled before completion.
+    """
+
+
+class ResourceLimitError(SimulationError):
+    """
+    Exception raised when a simulation exceeds its time or memory limit.
+
+    :ivar resource: The resource for which the limit was exceeded, either
+        "time" or "memory".
+    :vartype resource: str
+    :ivar limit: The limit that was exceeded, in seconds or bytes.
+    :vartype limit: float
+    :ivar elapsed_time: The wall clock time in seconds for which the
+        simulation ran before it was stopped.
+    :vartype elapsed_time: float
+    :ivar peak_rss: The peak resident set size of the simulation process
+        in bytes, or None if this is not available.
+    :vartype peak_rss: int
+    """
+    def __init__(self, resource, limit, elapsed_time, peak_rss):
+        import humanize
+        self.resource = resource
+        self.limit = limit
+        self.elapsed_time = elapsed_time
+        self.peak_rss = peak_rss
+        if resource == "time":
+            limit_str = f"{limit}s"
+        else:
+            limit_str = humanize.naturalsize(limit, binary=True)
+        peak_rss_str = "unknown"
+        if peak_rss is not None:
+            peak_rss_str = humanize.naturalsize(peak_rss, binary=True)
+        super().__init__(
+            f"Simulation exceeded {resource} limit of {limit_str} "
+            f"(elapsed={elapsed_time:.2f}s; peak_rss={peak_rss_str})")
+
+
+def _get_peak_rss(pid=None):
+    """
+    Returns the peak resident set size in bytes of the current process or,
+    if pid is specified, of the process with that ID. The peak RSS of other
+    processes is only available on Linux; None is returned otherwise.
+    """
+    if pid is None:
+        if not _resource_module_available:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            max_rss *= 1024  # Linux and other OSs (e.g. freeBSD) report maxrss in kb
+        return max_rss
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _run_limited_simulation(sender, engine, kwargs, max_memory, output_file):
+    """
+    Entry point for the child process used to run simulations with resource
+    limits. Sends a (status, value, peak_rss) tuple to the parent process,
+    where status is one of "ok", "memory" or "error".
+    """
+    # Start a new process group, so that any processes started by the engine
+    # are also terminated if we exceed the time limit.
+    os.setpgrp()
+    if max_memory is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            max_memory = min(max_memory, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+    try:
+        ts = engine.simulate(**kwargs)
+        ts.dump(output_file)
+        result = ("ok", None)
+    except MemoryError:
+        result = ("memory", None)
+    except Exception as e:
+        # The simulator libraries report allocation failures using their
+        # own exception types.
+        if "out of memory" in str(e).lower():
+            result = ("memory", None)
+        else:
+            result = ("error", e)
+    try:
+        sender.send(result + (_get_peak_rss(),))
+    except Exception:
+        # The exception could not be pickled.
+        sender.send(("error", SimulationError(repr(result[1])), _get_peak_rss()))
+    sender.close()
+
+
+def _kill_process_group(process):
+    """
+    Kills the specified multiprocessing process and any processes in its
+    process group, if it is still running.
+    """
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+    process.join()
+
+
+class ExternalEngine(Engine):
+    """
+    Abstract class representing a simulation engine that runs an external
+    simulator program in a subprocess.
+
+    The model, contig and samples are rendered into an input script by the
+    :func:`get_script()` method, which is written to a temporary file and
+    passed to the program on the command line returned by
+    :func:`get_command()`. The program must write its output in the tskit
+    '.trees' format, either to the output file given on the command line, or,
+    if ``stream_output`` is True, to stdout. Streamed output is loaded
+    directly from the pipe as it is written. Streaming output is not
+    supported on Windows.
+
+    By default, the input script is a JSON document describing the
+    simulation, which external programs may read directly. Subclasses
+    should override :func:`get_script()` to generate input in the format
+    required by other simulators.
+
+    :ivar executable: The path to the external simulator program.
+    :vartype executable: str
+    :ivar stream_output: If True, the program writes the tree sequence to
+        stdout. Otherwise, it is written to a temporary file.
+    :vartype stream_output: bool
+    :ivar poll_interval: The interval in seconds at which a running
+        simulation is checked for timeout and cancellation.
+    :vartype poll_interval: float
+    """
+    executable = None
+    stream_output = False
+    poll_interval = 0.1
+
+    def get_script(self, model, contig, samples, seed=None):
+        """
+        Returns the input script for the external simulator as a string.
+
+        :param model: The demographic model to simulate.
+        :type model: :class:`.Model`
+        :param contig: The contig, defining the length and recombination
+            rate(s).
+        :type contig: :class:`msprime.simulations.Contig`
+        :param samples: The samples to be obtained from the simulation.
+        :type samples: list of :class:`msprime.simulations.Sample`
+        :param int seed: The random seed.
+        :rtype: str
+        """
+        num_populations = len(model.population_configurations)
+        recomb_map = contig.recombination_map
+        script = {
+            "seed": seed,
+            "mutation_rate": contig.mutation_rate,
+            "recombination_map": {
+                "positions": list(recomb_map.get_positions()),
+                "rates": list(recomb_map.get_rates()),
+            },
+            "population_configurations": [
+                {"initial_size": pc.initial_size, "growth_rate": pc.growth_rate}
+                for pc in model.population_configurations],
+            "migration_matrix": [
+                [float(rate) for rate in row] for row in model.migration_matrix],
+            "demographic_events": [
+                event.get_ll_representation(num_populations)
+                for event in model.demographic_events],
+            "samples": [
+                {"population": sample.population, "time": sample.time}
+                for sample in samples],
+        }
+        return json.dumps(script)
+
+    def get_command(self, script_file, output_file=None):
+        """
+        Returns the command line used to run the external simulator, as a
+        list of strings.
+
+        :param str script_file: The path of the input script.
+        :param str output_file: The path that the tree sequence should be
+            written to, or None if the output is streamed to stdout.
+        :rtype: list of str
+        """
+        command = [self.executable, script_file]
+        if output_file is not None:
+            command.append(output_file)
+        return command
+
+    def get_version(self):
+        result = subprocess.run(
+            [self.executable, "--version"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True)
+        return result.stdout.decode().strip()
+
+    def simulate(self, model=None, contig=None, samples=None, seed=None,
+                 timeout=None, cancel_event=None, max_time=None, max_memory=None,
+                 observer=None, **kwargs):
+        """
+        Simulates the model by running the external simulator. See
+        :meth:`.Engine.simulate()` for definitions of the parameters shared
+        by all engines. A :class:`.SimulationError` is raised if the
+        program exits with an error.
+
+        :param timeout: The maximum time in seconds for which the simulation
+            may run. If the time limit is exceeded the program is terminated
+            and a :class:`.SimulationTimeoutError` is raised.
+        :type timeout: float
+        :param cancel_event: If specified, the program is terminated and a
+            :class:`.SimulationCancelledError` is raised when this event is
+            set, e.g. from another thread.
+        :type cancel_event: :class:`threading.Event`
+        """
+        import tskit
+        if max_time is not None or max_memory is not None:
+            return self._simulate_with_limits(
+                max_time=max_time, max_memory=max_memory, model=model,
+                contig=contig, samples=samples, seed=seed, timeout=timeout,
+                cancel_event=cancel_event, observer=observer, **kwargs)
+        with observers.observe_phase(observer, observers.PHASE_SCRIPT):
+            script = self.get_script(model, contig, samples, seed=seed)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script_file = os.path.join(tmpdir, "input")
+            with open(script_file, "w") as f:
+                f.write(script)
+            output_file = None
+            if not self.stream_output:
+                output_file = os.path.join(tmpdir, "output.trees")
+            command = self.get_command(script_file, output_file)
+            logger.info(f"Running {' '.join(command)}")
+            # Write stderr to a file rather than a pipe, so that a program
+            # writing a lot of diagnostic output cannot block.
+            with open(os.path.join(tmpdir, "stderr"), "w+b") as stderr:
+                stdout = subprocess.PIPE if self.stream_output else subprocess.DEVNULL
+                process = subprocess.Popen(command, stdout=stdout, stderr=stderr)
+                try:
+                    if self.stream_output:
+                        ts = self._run_streaming(
+                            process, timeout, cancel_event, observer)
+                    else:
+                        with observers.observe_phase(
+                                observer, observers.PHASE_SIMULATE,
+                                lambda: {"peak_rss": _get_peak_rss(process.pid)}):
+                            self._wait(process, timeout, cancel_event)
+                finally:
+                    if process.poll() is None:
+                        self._terminate(process)
+                if process.returncode != 0:
+                    stderr.seek(0)
+                    message = stderr.read().decode(errors="replace").strip()
+                    raise SimulationError(
+                        f"{self.name} exited with status {process.returncode}: "
+                        f"{message}")
+            if not self.stream_output:
+                with observers.observe_phase(observer, observers.PHASE_LOAD):
+                    ts = tskit.load(output_file)
+        return ts
+
+    def _run_streaming(self, process, timeout, cancel_event, observer=None):
+        import tskit
+        # tskit does not release the GIL while waiting for data from a pipe,
+        # so we cannot supervise the process from another thread while the
+        # tree sequence is being loaded from it. Instead, we copy the output
+        # to a temporary file as it arrives, enforcing the timeout and
+        # cancellation until the program has finished writing, and then
+        # load the tree sequence from the file.
+        start = time.perf_counter()
+        with tempfile.TemporaryFile() as output:
+            with observers.observe_phase(
+                    observer, observers.PHASE_SIMULATE,
+                    lambda: {"peak_rss": _get_peak_rss(process.pid)}):
+                self._wait(process, timeout, cancel_event, process.stdout, start)
+            with observers.observe_phase(observer, observers.PHASE_LOAD):
+                self._copy_output(process, timeout, cancel_event, output, start)
+                process.stdout.close()
+                process.wait()
+                if process.returncode != 0:
+                    return None
+                output.seek(0)
+                try:
+                    return tskit.load(output)
+                except Exception as e:
+                    raise SimulationError(
+                        f"Error reading output from {self.name}: {e}")
+
+    def _copy_output(self, process, timeout, cancel_event, output, start):
+        """
+        Copies the standard output of the process to the specified file
+        until the process closes it, terminating the process if the timeout
+        expires or the cancel event is set.
+        """
+        fd = process.stdout.fileno()
+        while True:
+            self._wait(process, timeout, cancel_event, process.stdout, start)
+            data = os.read(fd, 1 << 20)
+            if len(data) == 0:
+                return
+            output.write(data)
+
+    def _wait(self, process, timeout, cancel_event, output=None, start=None):
+        """
+        Waits for the process to exit (or, if output is specified, for data
+        to be available for reading from it), terminating the process if the
+        timeout expires or the cancel event is set. The elapsed time is
+        measured from start, if specified.
+        """
+        if start is None:
+            start = time.perf_counter()
+        while True:
+            if output is None:
+                try:
+                    process.wait(self.poll_interval)
+                    return
+                except subprocess.TimeoutExpired:
+                    pass
+            else:
+                readable, _, _ = select.select([output], [], [], self.poll_interval)
+                if len(readable) > 0:
+                    return
+            elapsed = time.perf_counter() - start
+            if cancel_event is not None and cancel_event.is_set():
+                self._terminate(process)
+                raise SimulationCancelledError(
+                    f"{self.name} simulation cancelled after {elapsed:.1f}s")
+            if timeout is not None and elapsed > timeout:
+                self._terminate(process)
+                raise SimulationTimeoutError(
+                    f"{self.name} simulation exceeded time limit of {timeout}s")
+
+    def _terminate(self, process, grace_period=5):
+        logger.info(f"Terminating {self.name} process {process.pid}")
+        process.terminate()
+        try:
+            process.wait(grace_period)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _subsample(ts, sizes, max_sizes):
+    """
+    Returns the tree sequence simplified to the first sizes[j] samples from
+    each population j. Returns the original tree sequence if all of the
+    samples are retained.
+    """
+    if list(sizes) + [0] * (len(max_sizes) - len(sizes)) == max_sizes:
+        return ts
+    nodes = []
+    for pop_index, n in enumerate(sizes):
+        nodes.extend(ts.samples(population=pop_index)[:n])
+    return ts.simplify(samples=nodes, filter_populations=False)
+
+
 class _MsprimeEngine(Engine):
     id = "msprime"
     name = "msprime"
@@ -101,23 +799,387 @@ class _MsprimeEngine(Engine):
                 year="2016",
                 author="Kelleher et al."),
             ]
+    # The first model in this list is used by default.
+    supported_models = ["hudson", "dtwf", "smc", "smc_prime"]
+
+    def get_demographic_events(self, model, msprime_change_model=None):
+        """
+        Returns the list of demographic events for the specified model,
+        including a :class:`msprime.SimulationModelChange` event for each
+        of the (time, model) tuples in ``msprime_change_model``.
+        """
+        import msprime
+        demographic_events = list(model.demographic_events)
+        if msprime_change_model is not None:
+            for t, change_model in msprime_change_model:
+                if change_model not in self.supported_models:
+                    raise ValueError(f"Unrecognised model '{change_model}'")
+                if not isinstance(t, (int, float)) or t < 0:
+                    raise ValueError(
+                        f"Model change time must be a non-negative number, "
+                        f"not '{t}'")
+                demographic_events.append(
+                    msprime.SimulationModelChange(t, change_model))
+            demographic_events.sort(key=lambda x: x.time)
+        return demographic_events
 
     def simulate(self, model=None, contig=None, samples=None, seed=None,
-                 **kwargs):
-        return msprime.simulate(
-                samples=samples,
-                recombination_map=contig.recombination_map,
-                mutation_rate=contig.mutation_rate,
-                population_configurations=model.population_configurations,
-                migration_matrix=model.migration_matrix,
-                demographic_events=model.demographic_events,
-                random_seed=seed)
+                 msprime_model=None, msprime_change_model=None, max_time=None,
+                 max_memory=None, observer=None, **kwargs):
+        """
+        Simulates the model using msprime. See :meth:`.Engine.simulate()`
+        for definitions of the parameters shared by all engines.
+
+        :param msprime_model: The msprime simulation model to be used, one
+            of ``hudson`` (the default), ``dtwf``, ``smc`` or ``smc_prime``.
+            The ``smc`` and ``smc_prime`` approximations are faster than the
+            exact coalescent with recombination, particularly for long contigs.
+        :type msprime_model: str
+        :param msprime_change_model: A list of (time, model) tuples. At each
+            specified time (in generations), the simulation switches to the
+            given model. For example, ``msprime_model="dtwf"`` combined with
+            ``msprime_change_model=[(500, "hudson")]`` simulates the recent
+            past exactly with the discrete time Wright-Fisher model and
+            switches to the faster Hudson coalescent after 500 generations.
+        :type msprime_change_model: list of (float, str) tuples
+        """
+        if max_time is not None or max_memory is not None:
+            return self._simulate_with_limits(
+                max_time=max_time, max_memory=max_memory, model=model,
+                contig=contig, samples=samples, seed=seed,
+                msprime_model=msprime_model,
+                msprime_change_model=msprime_change_model, observer=observer,
+                **kwargs)
+        prepared = self.prepare(
+            model=model, contig=contig, samples=samples,
+            msprime_model=msprime_model,
+            msprime_change_model=msprime_change_model)
+        return prepared.run(seed, observer=observer)
+
+    def prepare(self, model=None, contig=None, samples=None, msprime_model=None,
+                msprime_change_model=None, **kwargs):
+        """
+        Prepares the model for repeated simulation using msprime. See
+        :meth:`.Engine.prepare()` and :meth:`.simulate()` for definitions
+        of the parameters.
+
+        The returned object converts the demographic model, recombination
+        map and samples into their msprime representations once, and each
+        call to its ``run`` method only runs :func:`msprime.sim_ancestry`
+        and :func:`msprime.sim_mutations` with the new random seed.
+
+        :rtype: :class:`.PreparedSimulation`
+        """
+        import msprime
+        if msprime_model is None:
+            msprime_model = self.supported_models[0]
+        if msprime_model not in self.supported_models:
+            raise ValueError(f"Unrecognised model '{msprime_model}'")
+        demographic_events = self.get_demographic_events(
+            model, msprime_change_model)
+        # The model changes are given to msprime as a list of models, each
+        # running for a specified duration, and the other events form the
+        # demography.
+        model_changes = [(0, msprime_model)]
+        events = []
+        for event in demographic_events:
+            if isinstance(event, msprime.SimulationModelChange):
+                model_changes.append((event.time, event.model))
+            else:
+                events.append(event)
+        model_classes = {
+            "hudson": msprime.StandardCoalescent,
+            "dtwf": msprime.DiscreteTimeWrightFisher,
+            "smc": msprime.SmcApproxCoalescent,
+            "smc_prime": msprime.SmcPrimeApproxCoalescent,
+        }
+        ancestry_models = [
+            model_classes[name](duration=end - start)
+            for (start, name), (end, _) in zip(model_changes, model_changes[1:])]
+        ancestry_models.append(model_classes[model_changes[-1][1]]())
+        demography = msprime.Demography.from_old_style(
+            model.population_configurations,
+            migration_matrix=model.migration_matrix, demographic_events=events,
+            ignore_sample_size=True)
+        # Each sample is a haploid sample node, as with msprime.simulate.
+        sample_sets = [
+            msprime.SampleSet(
+                len(list(group)), population=population, time=time, ploidy=1)
+            for (population, time), group in itertools.groupby(
+                samples, key=lambda sample: (sample.population, sample.time))]
+        if contig.recombination_map is None:
+            # A unit length sequence without recombination, as simulated by
+            # msprime.simulate when no recombination map is given.
+            rate_map = msprime.RateMap.uniform(1, 0)
+        else:
+            rate_map = contig.recombination_map.map
+        # As with msprime.simulate, the genome is continuous, with infinite
+        # sites mutations, and time is scaled for diploid populations.
+        return _MsprimePreparedSimulation(
+            self,
+            ancestry_kwargs=dict(
+                samples=sample_sets, demography=demography,
+                recombination_rate=rate_map, ploidy=2,
+                discrete_genome=False, model=ancestry_models),
+            mutation_kwargs=dict(
+                rate=contig.mutation_rate, model=msprime.BinaryMutationModel(),
+                discrete_genome=False))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--msprime-model", default=self.supported_models[0],
+            choices=self.supported_models,
+            help=(
+                "Specify the simulation model used by msprime. The 'smc' and "
+                "'smc_prime' approximations are faster than the exact "
+                "'hudson' coalescent. See the msprime documentation for "
+                f"details. Default={self.supported_models[0]}."))
+        parser.add_argument(
+            "--msprime-change-model", metavar=("T", "MODEL"),
+            type=_time_or_model, default=None, action="append", nargs=2,
+            help=(
+                "Change to the specified simulation model at time T "
+                "(in generations). This option may be provided multiple "
+                "times. E.g. '--msprime-model dtwf --msprime-change-model "
+                "500 hudson' simulates the first 500 generations with the "
+                "discrete time Wright-Fisher model, which is much faster than "
+                "the exact coalescent for large sample sizes."))
 
     def get_version(self):
+        import msprime
         return msprime.__version__
 
 
+class _MsprimePreparedSimulation(PreparedSimulation):
+    """
+    A simulation prepared by the msprime engine. The ancestry_kwargs and
+    mutation_kwargs are the msprime representations of the simulation,
+    which are passed to :func:`msprime.sim_ancestry` and
+    :func:`msprime.sim_mutations` for each run.
+    """
+    def __init__(self, engine, ancestry_kwargs, mutation_kwargs):
+        super().__init__(engine)
+        self.ancestry_kwargs = ancestry_kwargs
+        self.mutation_kwargs = mutation_kwargs
+
+    def _mutate(self, ts, seed):
+        import msprime
+        return msprime.sim_mutations(ts, random_seed=seed, **self.mutation_kwargs)
+
+    def run(self, seed=None, observer=None):
+        import msprime
+        # The ancestry and mutations are reported as one phase.
+        with observers.observe_phase(
+                observer, observers.PHASE_SIMULATE,
+                lambda: {"peak_rss": _get_peak_rss()}):
+            ts = msprime.sim_ancestry(random_seed=seed, **self.ancestry_kwargs)
+            return self._mutate(ts, seed)
+
+    def run_replicates(self, num_replicates, seed=None):
+        """
+        Returns an iterator over the specified number of independent
+        replicate simulations. The ancestry simulator is set up once and
+        reused for all replicates. Note that the replicates are determined by
+        the single random seed, and so differ from those obtained by calling
+        :meth:`.run` with different seeds.
+
+        :param int num_replicates: The number of replicates.
+        :param int seed: The random seed.
+        :rtype: iterator over :class:`tskit.trees.TreeSequence`
+        """
+        import msprime
+        rng = random.Random(seed)
+        for ts in msprime.sim_ancestry(
+                num_replicates=num_replicates, random_seed=seed,
+                **self.ancestry_kwargs):
+            mutation_seed = None
+            if seed is not None:
+                mutation_seed = rng.randint(1, 2**32 - 1)
+            yield self._mutate(ts, mutation_seed)
+
+
+def _time_or_model(value):
+    # The --msprime-change-model option takes a (time, model) pair. argparse
+    # applies the same type function to both values, so we convert
+    # numeric values to floats and leave the model names as strings.
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+@attr.s(frozen=True, kw_only=True)
+class AutoEngine(Engine):
+    """
+    Pseudo-engine which selects the simulation model used by msprime
+    according to the size of the problem, and then runs the simulation
+    using the msprime engine. The selection is made by :meth:`.select`, and
+    the command line interface records it in the provenance record of the
+    output tree sequence. Any ``msprime_model`` and ``msprime_change_model`` arguments
+    are replaced by the selected options.
+
+    The default thresholds are derived from ``benchmarks/auto_engine.py``.
+    The exact coalescent is increasingly inaccurate when the number of
+    samples is not small compared with the population size. In the
+    benchmark, the hybrid of the discrete time Wright-Fisher model for the
+    recent past and the Hudson coalescent before that took within 10% of the
+    time of the Hudson coalescent for simulations taking more than a fraction
+    of a second, so the hybrid is used for large samples. For smaller
+    simulations the fixed cost of the DTWF phase dominates, and so the
+    Hudson coalescent is used when it is adequate. The SMC approximations
+    were slower than the exact coalescent at every problem size with
+    msprime 1.x, so they are not selected by default.
+
+    :ivar dtwf_sample_fraction: The DTWF hybrid is used if the number of
+        samples is larger than this fraction of the smallest initial size
+        of the sampled populations.
+    :vartype dtwf_sample_fraction: float
+    :ivar dtwf_generations: The number of generations simulated with the
+        DTWF model by the hybrid.
+    :vartype dtwf_generations: float
+    :ivar smc_min_scaled_recombination: If not None, the SMC' approximation
+        is used when the DTWF hybrid is not needed and the scaled
+        recombination rate 4 Ne L of the contig (where L is the genetic
+        length in Morgans and Ne the mean initial population size) is at
+        least this value.
+    :vartype smc_min_scaled_recombination: float
+    """
+    id = "auto"
+    name = "auto"
+    dtwf_sample_fraction = attr.ib(default=0.1)
+    dtwf_generations = attr.ib(default=100)
+    smc_min_scaled_recombination = attr.ib(default=None)
+
+    @property
+    def citations(self):
+        return get_engine("msprime").citations
+
+    def select(self, model, contig, samples):
+        """
+        Returns a dictionary describing the engine and options selected to
+        simulate the specified samples from the model on the contig. The
+        ``engine`` and ``options`` keys give the ID of the selected engine
+        and the keyword arguments passed to its :meth:`.Engine.simulate`
+        method, ``reason`` describes why they were chosen, and the remaining
+        keys give the properties of the problem and thresholds used.
+
+        :rtype: dict
+        """
+        sizes = [config.initial_size for config in model.population_configurations]
+        sampled_populations = {sample.population for sample in samples}
+        min_sampled_size = min(sizes[j] for j in sampled_populations)
+        genetic_length = contig.recombination_map.get_total_recombination_rate()
+        scaled_recombination = 4 * (sum(sizes) / len(sizes)) * genetic_length
+        num_samples = len(samples)
+        if num_samples > self.dtwf_sample_fraction * min_sampled_size:
+            options = {
+                "msprime_model": "dtwf",
+                "msprime_change_model": [(self.dtwf_generations, "hudson")]}
+            reason = (
+                f"{num_samples} samples is more than {self.dtwf_sample_fraction} "
+                f"times the population size {min_sampled_size:g}")
+        elif (self.smc_min_scaled_recombination is not None and
+                scaled_recombination >= self.smc_min_scaled_recombination):
+            options = {"msprime_model": "smc_prime", "msprime_change_model": None}
+            reason = (
+                f"Scaled recombination rate {scaled_recombination:g} is at least "
+                f"{self.smc_min_scaled_recombination:g}")
+        else:
+            options = {"msprime_model": "hudson", "msprime_change_model": None}
+            reason = "Default model for this problem size"
+        return {
+            "engine": "msprime",
+            "options": options,
+            "reason": reason,
+            "num_samples": num_samples,
+            "genetic_length": genetic_length,
+            "min_sampled_population_size": min_sampled_size,
+            "scaled_recombination": scaled_recombination,
+            "thresholds": {
+                "dtwf_sample_fraction": self.dtwf_sample_fraction,
+                "dtwf_generations": self.dtwf_generations,
+                "smc_min_scaled_recombination": self.smc_min_scaled_recombination,
+            },
+        }
+
+    def get_selection(
+            self, model=None, contig=None, samples=None,
+            auto_dtwf_sample_fraction=None, auto_dtwf_generations=None,
+            auto_smc_min_scaled_recombination=None, **kwargs):
+        """
+        Returns the selection made by :meth:`.select` when :meth:`.simulate`
+        is called with the specified arguments, in which the ``auto_*``
+        arguments override the corresponding thresholds of this engine.
+        Other keyword arguments are ignored.
+
+        :rtype: dict
+        """
+        overrides = {
+            "dtwf_sample_fraction": auto_dtwf_sample_fraction,
+            "dtwf_generations": auto_dtwf_generations,
+            "smc_min_scaled_recombination": auto_smc_min_scaled_recombination,
+        }
+        engine = attr.evolve(
+            self, **{k: v for k, v in overrides.items() if v is not None})
+        return engine.select(model, contig, samples)
+
+    def simulate(
+            self, model=None, contig=None, samples=None, seed=None,
+            auto_dtwf_sample_fraction=None, auto_dtwf_generations=None,
+            auto_smc_min_scaled_recombination=None, **kwargs):
+        """
+        Simulates the model for the specified contig and samples, using the
+        engine and options selected by :meth:`.select`. The ``auto_*``
+        arguments override the corresponding thresholds of this engine.
+        Other keyword arguments are passed to the selected engine. See
+        :meth:`.Engine.simulate()` for definitions of the other parameters.
+
+        The selection is not recorded in the returned tree sequence, which
+        would require copying its tables; use :meth:`.get_selection` to
+        record it, as the command line interface does in its provenance
+        record.
+
+        :return: A succinct tree sequence.
+        :rtype: :class:`tskit.trees.TreeSequence`
+        """
+        selection = self.get_selection(
+            model, contig, samples,
+            auto_dtwf_sample_fraction=auto_dtwf_sample_fraction,
+            auto_dtwf_generations=auto_dtwf_generations,
+            auto_smc_min_scaled_recombination=auto_smc_min_scaled_recombination)
+        logger.info(
+            f"Selected {selection['engine']} with {selection['options']}: "
+            f"{selection['reason']}")
+        kwargs.update(selection["options"])
+        return get_engine(selection["engine"]).simulate(
+            model=model, contig=contig, samples=samples, seed=seed, **kwargs)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--auto-dtwf-sample-fraction", type=float, default=None,
+            metavar="F",
+            help=(
+                "Use the DTWF/Hudson hybrid if the number of samples is "
+                "larger than F times the smallest sampled population size. "
+                f"Default={self.dtwf_sample_fraction}."))
+        parser.add_argument(
+            "--auto-dtwf-generations", type=float, default=None, metavar="T",
+            help=(
+                "The number of generations simulated with the DTWF model by "
+                f"the hybrid. Default={self.dtwf_generations}."))
+        parser.add_argument(
+            "--auto-smc-min-scaled-recombination", type=float, default=None,
+            metavar="RHO",
+            help=(
+                "Use the SMC' approximation if the scaled recombination rate "
+                "4NeL of the contig is at least RHO. Disabled by default."))
+
+    def get_version(self):
+        return get_engine("msprime").get_version()
+
+
 register_engine(_MsprimeEngine())
+register_engine(AutoEngine())
 
 
 def get_default_engine():
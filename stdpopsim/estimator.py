@@ -0,0 +1,324 @@
+"""
+Predicting the running time and memory usage of simulations without running
+them, using a simple model fitted to benchmark simulations.
+"""
+import json
+import logging
+import multiprocessing
+import pathlib
+import platform
+import time
+
+import attr
+import numpy as np
+
+import stdpopsim
+from . import engines
+
+logger = logging.getLogger(__name__)
+
+# The calibration shipped with stdpopsim, which was fitted to the default
+# benchmark simulations (see get_calibration_simulations) on a Linux machine.
+DEFAULT_CALIBRATION_FILE = pathlib.Path(__file__).parent / "estimator_calibration.json"
+
+CALIBRATION_FORMAT_VERSION = 1
+
+# The (species, model, chromosome) combinations simulated by the benchmark.
+# A model of None denotes the species' default constant size model.
+CALIBRATION_MODELS = [
+    ("homsap", None, "chr22"),
+    ("homsap", "ooa_3", "chr22"),
+    ("homsap", "zigzag", "chr22"),
+]
+CALIBRATION_LENGTH_MULTIPLIERS = [0.01, 0.03, 0.1, 0.3, 1]
+CALIBRATION_NUM_SAMPLES = [10, 100, 1000]
+QUICK_CALIBRATION_LENGTH_MULTIPLIERS = [0.01, 0.03]
+QUICK_CALIBRATION_NUM_SAMPLES = [10, 100]
+
+
+def get_features(model, contig, samples):
+    """
+    Returns a dictionary of the features of a simulation used to predict its
+    running time and memory usage: the total number of samples, the genetic
+    length of the contig in Morgans, the mean initial size of the
+    populations and the number of epochs in the demographic model.
+    """
+    sizes = [config.initial_size for config in model.population_configurations]
+    times = {event.time for event in model.demographic_events}
+    return {
+        "num_samples": len(samples),
+        "genetic_length": contig.recombination_map.get_total_recombination_rate(),
+        "population_size": sum(sizes) / len(sizes),
+        "num_epochs": len(times) + 1,
+    }
+
+
+def _design_matrix(features):
+    """
+    Returns the matrix of predictors for the specified list of feature
+    dictionaries. We work on a log scale, as the running time of coalescent
+    simulations grows approximately as a power of the scaled recombination
+    rate 4 Ne L and of the number of samples.
+    """
+    rows = []
+    for f in features:
+        rho = 4 * f["population_size"] * f["genetic_length"]
+        rows.append([
+            1, np.log1p(rho), np.log(max(f["num_samples"], 1)),
+            np.log(f["num_epochs"])])
+    return np.array(rows, dtype=float).reshape((len(rows), 4))
+
+
+@attr.s(frozen=True, kw_only=True)
+class Estimate(object):
+    """
+    The predicted resources required by a simulation.
+
+    :ivar runtime: The predicted wall clock time in seconds.
+    :vartype runtime: float
+    :ivar runtime_upper: An upper bound on the wall clock time in seconds,
+        based on the spread of the benchmark measurements about the fitted
+        model (two standard deviations on the log scale).
+    :vartype runtime_upper: float
+    :ivar peak_memory: The predicted peak resident set size in bytes of the
+        process running the simulation.
+    :vartype peak_memory: int
+    :ivar peak_memory_upper: An upper bound on the peak memory in bytes.
+    :vartype peak_memory_upper: int
+    """
+    runtime = attr.ib(type=float)
+    runtime_upper = attr.ib(type=float)
+    peak_memory = attr.ib(type=int)
+    peak_memory_upper = attr.ib(type=int)
+
+    def asdict(self):
+        return attr.asdict(self)
+
+
+@attr.s(kw_only=True)
+class ResourceEstimator(object):
+    """
+    Predicts the running time and peak memory of simulations from the
+    features returned by :func:`.get_features`, using log-linear models
+    fitted to benchmark measurements (see :meth:`.fit`). The memory model
+    predicts the memory used by the simulation in addition to that already
+    used by the process.
+
+    :ivar engine: The ID of the simulation engine used for the benchmarks.
+    :ivar measurements: The benchmark measurements the estimator was fitted
+        to, as a list of dictionaries.
+    """
+    engine = attr.ib(type=str)
+    engine_version = attr.ib(type=str, default=None)
+    time_coefficients = attr.ib(factory=list)
+    memory_coefficients = attr.ib(factory=list)
+    time_residual_sd = attr.ib(type=float, default=0)
+    memory_residual_sd = attr.ib(type=float, default=0)
+    environment = attr.ib(factory=dict)
+    measurements = attr.ib(factory=list)
+
+    @classmethod
+    def fit(cls, measurements, engine="msprime", engine_version=None):
+        """
+        Returns an estimator fitted by least squares to the specified list
+        of measurements, each of which is a dictionary containing the
+        features of a simulation together with its measured ``wall_time``
+        in seconds and ``memory`` in bytes.
+        """
+        X = _design_matrix(measurements)
+        if len(measurements) <= X.shape[1]:
+            raise ValueError(
+                f"At least {X.shape[1] + 1} measurements are required to "
+                "calibrate the estimator")
+        wall_time = np.array([m["wall_time"] for m in measurements], dtype=float)
+        memory = np.array([m["memory"] for m in measurements], dtype=float)
+        coefficients = []
+        residual_sd = []
+        for y in [np.log(np.maximum(wall_time, 1e-4)),
+                  np.log(np.maximum(memory, 2**20))]:
+            beta, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+            coefficients.append([float(b) for b in beta])
+            residual_sd.append(float(np.std(y - X @ beta)))
+        return cls(
+            engine=engine, engine_version=engine_version,
+            time_coefficients=coefficients[0],
+            memory_coefficients=coefficients[1],
+            time_residual_sd=residual_sd[0], memory_residual_sd=residual_sd[1],
+            environment=get_environment(), measurements=list(measurements))
+
+    def estimate(self, model, contig, samples, base_memory=None):
+        """
+        Returns the :class:`.Estimate` of the resources needed to simulate
+        the specified samples from the model on the contig. If base_memory
+        is not specified, the memory currently used by this process is
+        added to the predicted memory used by the simulation.
+
+        :rtype: :class:`.Estimate`
+        """
+        if base_memory is None:
+            base_memory = engines._get_peak_rss() or 0
+        x = _design_matrix([get_features(model, contig, samples)])[0]
+        log_time = float(x @ self.time_coefficients)
+        log_memory = float(x @ self.memory_coefficients)
+        return Estimate(
+            runtime=float(np.exp(log_time)),
+            runtime_upper=float(np.exp(log_time + 2 * self.time_residual_sd)),
+            peak_memory=int(base_memory + np.exp(log_memory)),
+            peak_memory_upper=int(
+                base_memory + np.exp(log_memory + 2 * self.memory_residual_sd)))
+
+    def asdict(self):
+        d = attr.asdict(self)
+        d["version"] = CALIBRATION_FORMAT_VERSION
+        return d
+
+    def dump(self, path):
+        """
+        Writes the calibration of this estimator to the specified path as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.asdict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the estimator with the calibration stored in the specified
+        JSON file.
+        """
+        with open(path) as f:
+            d = json.load(f)
+        version = d.pop("version", None)
+        if version != CALIBRATION_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported estimator calibration format version {version} "
+                f"in {path}")
+        return cls(**d)
+
+
+def get_environment():
+    """
+    Returns a dictionary describing the hardware and software used to run
+    the calibration benchmarks.
+    """
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.system(),
+        "python": platform.python_version(),
+        "stdpopsim": stdpopsim.__version__,
+    }
+
+
+def get_user_calibration_path():
+    """
+    Returns the path of the calibration fitted on this machine by the
+    ``stdpopsim calibrate-estimator`` command, which is stored in the cache
+    directory.
+    """
+    return stdpopsim.get_cache_dir() / "estimator_calibration.json"
+
+
+def get_default_estimator():
+    """
+    Returns the estimator fitted on this machine if there is one, and the
+    estimator calibrated by the benchmark shipped with stdpopsim otherwise.
+
+    :rtype: :class:`.ResourceEstimator`
+    """
+    path = get_user_calibration_path()
+    if not path.exists():
+        path = DEFAULT_CALIBRATION_FILE
+    logger.info(f"Loading estimator calibration from {path}")
+    return ResourceEstimator.load(path)
+
+
+def get_calibration_simulations(quick=False):
+    """
+    Returns the list of (species, model, chromosome, length multiplier,
+    number of samples) tuples simulated to calibrate the estimator. If quick
+    is True, only the smaller simulations are included.
+    """
+    length_multipliers = CALIBRATION_LENGTH_MULTIPLIERS
+    sample_sizes = CALIBRATION_NUM_SAMPLES
+    if quick:
+        length_multipliers = QUICK_CALIBRATION_LENGTH_MULTIPLIERS
+        sample_sizes = QUICK_CALIBRATION_NUM_SAMPLES
+    return [
+        (species_id, model_id, chromosome, length_multiplier, num_samples)
+        for species_id, model_id, chromosome in CALIBRATION_MODELS
+        for length_multiplier in length_multipliers
+        for num_samples in sample_sizes]
+
+
+def _run_measurement(sender, engine, kwargs):
+    """
+    Entry point for the child process used to measure the resources used by
+    a simulation.
+    """
+    base_memory = engines._get_peak_rss()
+    before = time.perf_counter()
+    engine.simulate(**kwargs)
+    wall_time = time.perf_counter() - before
+    sender.send((wall_time, engines._get_peak_rss() - base_memory))
+    sender.close()
+
+
+def measure(engine, model, contig, samples, seed=1):
+    """
+    Runs the specified simulation in a child process and returns a dictionary
+    containing its features, its wall clock time in seconds (``wall_time``)
+    and the memory used in addition to that of the parent process in bytes
+    (``memory``). Running each simulation in a fresh process ensures that
+    the peak memory is that of the simulation itself.
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    kwargs = {"model": model, "contig": contig, "samples": samples, "seed": seed}
+    process = context.Process(
+        target=_run_measurement, args=(sender, engine, kwargs))
+    process.start()
+    sender.close()
+    try:
+        wall_time, memory = receiver.recv()
+    except EOFError:
+        raise RuntimeError("Benchmark simulation failed")
+    finally:
+        process.join()
+    measurement = get_features(model, contig, samples)
+    measurement.update(wall_time=wall_time, memory=memory)
+    return measurement
+
+
+def calibrate(engine=None, simulations=None, seed=1, callback=None):
+    """
+    Runs the benchmark simulations and returns a :class:`.ResourceEstimator`
+    fitted to the measurements. If simulations is None, the list returned by
+    :func:`.get_calibration_simulations` is used. If callback is specified,
+    it is called with each simulation tuple and its measurement.
+
+    :rtype: :class:`.ResourceEstimator`
+    """
+    if engine is None:
+        engine = stdpopsim.get_default_engine()
+    if simulations is None:
+        simulations = get_calibration_simulations()
+    measurements = []
+    for simulation in simulations:
+        species_id, model_id, chromosome, length_multiplier, num_samples = simulation
+        species = stdpopsim.get_species(species_id)
+        if model_id is None:
+            model = stdpopsim.PiecewiseConstantSize(species.population_size)
+        else:
+            model = species.get_model(model_id)
+        contig = species.get_contig(chromosome, length_multiplier=length_multiplier)
+        # Divide the samples as evenly as possible among the populations.
+        k = model.num_sampling_populations
+        sample_sizes = [num_samples // k + (j < num_samples % k) for j in range(k)]
+        samples = model.get_samples(*sample_sizes)
+        measurement = measure(engine, model, contig, samples, seed=seed)
+        measurement["simulation"] = list(simulation)
+        measurements.append(measurement)
+        if callback is not None:
+            callback(simulation, measurement)
+    return ResourceEstimator.fit(
+        measurements, engine=engine.id, engine_version=engine.get_version())
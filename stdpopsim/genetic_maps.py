@@ -10,8 +10,6 @@ import warnings
 import os
 import urllib.request
 
-import msprime
-
 from . import cache
 
 logger = logging.getLogger(__name__)
@@ -139,6 +137,7 @@ class GeneticMap(object):
         """
         Returns the genetic map for the chromosome with the specified name.
         """
+        import msprime
         chrom = self.species.genome.get_chromosome(name)
         if not self.is_cached():
             self.download()
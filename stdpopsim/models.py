@@ -3,9 +3,6 @@ Common infrastructure for specifying demographic models.
 """
 import sys
 
-import msprime
-import numpy as np
-
 
 # Defaults taken from np.allclose
 DEFAULT_ATOL = 1e-05
@@ -48,6 +45,7 @@ def verify_population_configurations_equal(
     (2) the initial_size is defined. If these assumptions are violated a
     ValueError is raised.
     """
+    import numpy as np
     for pc1, pc2 in zip(pop_configs1, pop_configs2):
         if pc1.sample_size is not None or pc2.sample_size is not None:
             raise ValueError(
@@ -88,6 +86,7 @@ def verify_demographic_events_equal(
     Checks if the specified list of msprime DemographicEvent objects are equal
     to the specified tolerances and raises a UnequalModelsError otherwise.
     """
+    import numpy as np
     # Get the low-level dictionary representations of the events.
     dicts1 = [event.get_ll_representation(num_populations) for event in events1]
     dicts2 = [event.get_ll_representation(num_populations) for event in events2]
@@ -196,6 +195,7 @@ class Model(object):
         Equivalent to the :func:`.equals` method, but raises a UnequalModelsError if the
         models are not equal rather than returning False.
         """
+        import numpy as np
         mm1 = np.array(self.migration_matrix)
         mm2 = np.array(other.migration_matrix)
         if mm1.shape != mm2.shape:
@@ -211,6 +211,7 @@ class Model(object):
             rtol=rtol, atol=atol)
 
     def debug(self, out_file=sys.stdout):
+        import msprime
         # Use the demography debugger to print out the demographic history
         # that we have just described.
         dd = msprime.DemographyDebugger(
@@ -229,6 +230,7 @@ class Model(object):
             perhaps link into a section of the tutorial showing it in action.
 
         """
+        import msprime
         samples = []
         for pop_index, n in enumerate(args):
             if self.populations[pop_index].allow_samples:
@@ -278,6 +280,7 @@ class PiecewiseConstantSize(Model):
     doi = None
 
     def __init__(self, N0, *args):
+        import msprime
         self.population_configurations = [
             msprime.PopulationConfiguration(
                 initial_size=N0, metadata=self.populations[0].asdict())
@@ -334,6 +337,7 @@ class GenericIM(Model):
     doi = None
 
     def __init__(self, NA, N1, N2, T, M12, M21):
+        import msprime
         self.population_configurations = [
             msprime.PopulationConfiguration(
                 initial_size=N1, metadata=self.populations[0].asdict()),
@@ -0,0 +1,336 @@
+"""
+Infrastructure for observing the progress of simulations, reporting the
+time taken by the different phases of a simulation and periodic progress
+information while long phases are running.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Names of the phases reported by the CLI and the built-in engines.
+PHASE_PARSE = "parse"
+PHASE_CONTIG = "contig"
+PHASE_MODEL = "model"
+PHASE_SCRIPT = "script"
+PHASE_SIMULATE = "simulate"
+PHASE_LOAD = "load"
+PHASE_SUBSAMPLE = "subsample"
+PHASE_PROVENANCE = "provenance"
+PHASE_WRITE = "write"
+PHASE_STATS = "stats"
+
+
+class SimulationObserver(object):
+    """
+    Base class for objects observing the progress of a simulation. An
+    observer is passed to :meth:`.Engine.simulate` using the ``observer``
+    keyword argument. Subclasses should override the methods for the events
+    that they are interested in; by default, events are ignored.
+
+    Note that :meth:`.progress` is called from a background thread.
+
+    :ivar progress_interval: The interval in seconds at which progress is
+        reported while a phase is running. If None (the default), only the
+        start and end of each phase are reported.
+    :vartype progress_interval: float
+    """
+    progress_interval = None
+
+    def phase_started(self, phase):
+        """
+        Called when the specified phase of the simulation starts.
+
+        :param str phase: The name of the phase, e.g. "simulate".
+        """
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        """
+        Called when the specified phase of the simulation is finished.
+
+        :param str phase: The name of the phase.
+        :param float wall_time: The wall clock time in seconds taken by the
+            phase.
+        :param float cpu_time: The CPU time in seconds used by the current
+            process during the phase.
+        """
+
+    def progress(self, phase, elapsed_time, **kwargs):
+        """
+        Called periodically while the specified phase is running, with any
+        additional information provided by the engine (e.g., ``peak_rss``)
+        as keyword arguments.
+
+        :param str phase: The name of the phase.
+        :param float elapsed_time: The wall clock time in seconds since the
+            phase started.
+        """
+
+
+class JsonObserver(SimulationObserver):
+    """
+    Simulation observer that writes each event as a JSON object on a
+    separate line of the specified output file. Each object has an
+    ``event`` key, which is one of "phase_started", "phase_finished" or
+    "progress", a ``phase`` key, and a ``timestamp`` key giving the time
+    at which the event occured in seconds since the epoch.
+
+    :param output: The file-like object to write to.
+    :param float progress_interval: The interval in seconds at which progress
+        is reported, or None to disable progress reports.
+    """
+    def __init__(self, output, progress_interval=None):
+        self.output = output
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+
+    def write(self, event, phase, **kwargs):
+        record = {"event": event, "phase": phase, "timestamp": time.time()}
+        record.update(kwargs)
+        with self._lock:
+            print(json.dumps(record), file=self.output, flush=True)
+
+    def phase_started(self, phase):
+        self.write("phase_started", phase)
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        self.write("phase_finished", phase, wall_time=wall_time, cpu_time=cpu_time)
+
+    def progress(self, phase, elapsed_time, **kwargs):
+        self.write("progress", phase, elapsed_time=elapsed_time, **kwargs)
+
+
+class ObserverGroup(SimulationObserver):
+    """
+    Simulation observer which passes each event on to all of the specified
+    observers. Progress is reported at the shortest progress interval of the
+    observers, to those observers that have a progress interval.
+
+    :param observers: The observers.
+    :type observers: list of :class:`.SimulationObserver`
+    """
+    def __init__(self, observers):
+        self.observers = list(observers)
+        intervals = [
+            observer.progress_interval for observer in self.observers
+            if observer.progress_interval is not None]
+        self.progress_interval = min(intervals) if len(intervals) > 0 else None
+
+    def phase_started(self, phase):
+        for observer in self.observers:
+            observer.phase_started(phase)
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        for observer in self.observers:
+            observer.phase_finished(phase, wall_time, cpu_time)
+
+    def progress(self, phase, elapsed_time, **kwargs):
+        for observer in self.observers:
+            if observer.progress_interval is not None:
+                observer.progress(phase, elapsed_time, **kwargs)
+
+
+class ProfilingObserver(SimulationObserver):
+    """
+    Simulation observer which profiles the functions called in each phase
+    using :mod:`cProfile`, and/or the memory allocated by Python code in each
+    phase using :mod:`tracemalloc`. Profiling runs from :meth:`.start` to
+    :meth:`.stop`, and anything outside of a phase is attributed to the
+    "other" phase. The times, function profiles and memory of a phase
+    exclude any phases nested within it, and phases which occur more than
+    once (e.g. for replicates) are combined. The lines allocating the most
+    memory are found by comparing snapshots taken at the start and end of
+    the first occurrence of each phase, and so include nested phases; they
+    are only listed for phases using at least 1MiB.
+
+    Note that only the thread calling :meth:`.start` is profiled, and that
+    memory allocated by C libraries directly (e.g. by msprime while
+    simulating) is not traced.
+
+    :param bool cpu: Whether to profile the functions called.
+    :param bool memory: Whether to trace memory allocations.
+    :param int limit: The number of functions and allocation sites listed
+        for each phase by :meth:`.write_report`.
+    """
+    OTHER = "other"
+    # The allocation sites are only listed for phases using at least this
+    # many bytes.
+    MIN_MEMORY = 2**20
+
+    def __init__(self, cpu=True, memory=False, limit=20):
+        self.cpu = cpu
+        self.memory = memory
+        self.limit = limit
+        # Records for each phase, in the order they were first started.
+        self.phases = {}
+        self._stack = []
+
+    def _get_record(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = {
+                "count": 0, "wall_time": 0, "cpu_time": 0,
+                "profile": cProfile.Profile() if self.cpu else None,
+                "memory_peak": 0, "memory_net": 0, "snapshots": None}
+        return self.phases[phase]
+
+    def _push(self, phase):
+        if len(self._stack) > 0:
+            self._suspend(self._stack[-1])
+        record = self._get_record(phase)
+        frame = {"record": record, "snapshot": None}
+        if self.memory and record["count"] == 0 and phase != self.OTHER:
+            frame["snapshot"] = tracemalloc.take_snapshot()
+        self._stack.append(frame)
+        self._resume(frame)
+
+    def _pop(self):
+        frame = self._stack.pop()
+        self._suspend(frame)
+        record = frame["record"]
+        record["count"] += 1
+        if frame["snapshot"] is not None:
+            record["snapshots"] = (frame["snapshot"], tracemalloc.take_snapshot())
+        if len(self._stack) > 0:
+            self._resume(self._stack[-1])
+
+    def _suspend(self, frame):
+        if self.cpu:
+            frame["record"]["profile"].disable()
+        record = frame["record"]
+        record["wall_time"] += time.perf_counter() - frame["wall_time"]
+        record["cpu_time"] += time.process_time() - frame["cpu_time"]
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record["memory_net"] += current - frame["memory_start"]
+            record["memory_peak"] = max(
+                record["memory_peak"], peak - frame["memory_start"])
+
+    def _resume(self, frame):
+        if self.memory:
+            tracemalloc.reset_peak()
+            frame["memory_start"] = tracemalloc.get_traced_memory()[0]
+        frame["wall_time"] = time.perf_counter()
+        frame["cpu_time"] = time.process_time()
+        if self.cpu:
+            frame["record"]["profile"].enable()
+
+    def _get_allocations(self, record):
+        # Comparing snapshots is slow, so we only do this for the phases
+        # which use a significant amount of memory.
+        if record["snapshots"] is None or max(
+                record["memory_peak"], record["memory_net"]) < self.MIN_MEMORY:
+            return []
+        start, end = record["snapshots"]
+        ignored = {tracemalloc.__file__, __file__}
+        return [
+            diff for diff in end.compare_to(start, "lineno")
+            if diff.traceback[0].filename not in ignored and diff.size_diff != 0]
+
+    def start(self):
+        """
+        Starts profiling.
+        """
+        if self.memory:
+            tracemalloc.start()
+        self._push(self.OTHER)
+
+    def stop(self):
+        """
+        Stops profiling, finishing any phases that are still running.
+        """
+        while len(self._stack) > 0:
+            self._pop()
+        if self.memory:
+            tracemalloc.stop()
+
+    def phase_started(self, phase):
+        self._push(phase)
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        self._pop()
+
+    def write_report(self, output):
+        """
+        Writes a text report of the time and memory used by each phase,
+        followed by the functions with the largest cumulative time and the
+        lines allocating the most memory in each phase, to the specified
+        file object.
+        """
+        columns = ["phase", "count", "wall_time", "cpu_time"]
+        if self.memory:
+            columns += ["memory_peak", "memory_net"]
+        rows = []
+        for phase, record in self.phases.items():
+            row = [
+                phase, str(record["count"]), f"{record['wall_time']:.3f}s",
+                f"{record['cpu_time']:.3f}s"]
+            if self.memory:
+                row += [
+                    f"{record['memory_peak'] / 2**20:.1f}MiB",
+                    f"{record['memory_net'] / 2**20:.1f}MiB"]
+            rows.append(row)
+        widths = [
+            max(len(row[j]) for row in [columns] + rows)
+            for j in range(len(columns))]
+        for row in [columns] + rows:
+            line = "  ".join(value.ljust(width) for value, width in zip(row, widths))
+            print(line.rstrip(), file=output)
+        for phase, record in self.phases.items():
+            if self.cpu:
+                print(f"\n# CPU profile: {phase}", file=output)
+                stream = io.StringIO()
+                stats = pstats.Stats(record["profile"], stream=stream)
+                stats.sort_stats("cumulative").print_stats(self.limit)
+                print(stream.getvalue().strip("\n"), file=output)
+            allocations = self._get_allocations(record)
+            if len(allocations) > 0:
+                print(f"\n# Memory allocations: {phase}", file=output)
+                for diff in allocations[:self.limit]:
+                    print(
+                        f"{diff.size_diff / 2**10:+.1f}KiB "
+                        f"{diff.count_diff:+d} blocks {diff.traceback}",
+                        file=output)
+
+
+@contextlib.contextmanager
+def observe_phase(observer, phase, get_progress=None):
+    """
+    Context manager reporting the start and end of the specified phase to
+    the observer. If the observer's ``progress_interval`` is set, progress is
+    also reported periodically from a background thread while the phase is
+    running, with the additional information returned by the get_progress
+    function (a dictionary). If observer is None, nothing is reported.
+    """
+    if observer is None:
+        yield
+        return
+    observer.phase_started(phase)
+    start_wall_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    stop = threading.Event()
+    thread = None
+    if observer.progress_interval is not None:
+        def report_progress():
+            while not stop.wait(observer.progress_interval):
+                info = {} if get_progress is None else get_progress()
+                elapsed_time = time.perf_counter() - start_wall_time
+                observer.progress(phase, elapsed_time, **info)
+
+        thread = threading.Thread(target=report_progress, daemon=True)
+        thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if thread is not None:
+            thread.join()
+        observer.phase_finished(
+            phase, time.perf_counter() - start_wall_time,
+            time.process_time() - start_cpu_time)
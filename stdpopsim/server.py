@@ -0,0 +1,432 @@
+"""
+A local HTTP server which runs simulations requested as JSON documents,
+keeping the species catalog, the contigs built from genetic maps and the
+prepared simulations in memory between requests.
+"""
+import collections
+import concurrent.futures
+import http.server
+import io
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+
+import stdpopsim
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# The keys of a simulation request, and their default values. The species
+# and samples are required.
+REQUEST_DEFAULTS = {
+    "species": None,
+    "model": None,
+    "chromosome": None,
+    "genetic_map": None,
+    "length_multiplier": 1,
+    "samples": None,
+    "seed": None,
+    "engine": None,
+    "output": "trees",
+    "compression": None,
+}
+
+OUTPUT_TYPES = ["trees", "stats"]
+
+# Requests with larger bodies are rejected.
+MAX_REQUEST_SIZE = 1 << 20
+
+
+class RequestError(Exception):
+    """
+    Exception raised when a simulation request is invalid.
+    """
+
+
+class ServerBusyError(Exception):
+    """
+    Exception raised when a simulation request cannot be queued because the
+    queue of the server is full.
+    """
+
+
+class LruCache(object):
+    """
+    A thread safe mapping holding at most the specified number of items, in
+    which the least recently used item is discarded when the cache is full.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, factory):
+        """
+        Returns the item with the specified key, calling factory() to create
+        it if it is not in the cache. The factory is called without holding
+        the lock, so an item may occasionally be created more than once.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value
+
+
+def is_integer(value):
+    """
+    Returns True if the specified JSON value is an integer. JSON booleans
+    are decoded as bool, which is a subclass of int, and so are excluded.
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_request(document, default_engine):
+    """
+    Returns the simulation request described by the specified JSON document
+    as a dictionary with all of the keys in :data:`REQUEST_DEFAULTS`, raising
+    a :class:`RequestError` if it is invalid.
+    """
+    if not isinstance(document, dict):
+        raise RequestError("The request must be a JSON object")
+    unknown = set(document.keys()) - set(REQUEST_DEFAULTS.keys())
+    if len(unknown) > 0:
+        raise RequestError(f"Unknown request keys: {sorted(unknown)}")
+    request = dict(REQUEST_DEFAULTS)
+    request.update(document)
+    if request["engine"] is None:
+        request["engine"] = default_engine
+    for key in ["species", "samples"]:
+        if request[key] is None:
+            raise RequestError(f"The '{key}' key is required")
+    samples = request["samples"]
+    if not isinstance(samples, list) or not all(
+            is_integer(n) and n >= 0 for n in samples):
+        raise RequestError("The samples must be a list of non-negative integers")
+    if sum(samples) < 2:
+        raise RequestError("At least two samples are required")
+    if request["output"] not in OUTPUT_TYPES:
+        raise RequestError(f"The output must be one of {OUTPUT_TYPES}")
+    if request["compression"] not in [None] + list(storage.COMPRESSION_CODECS):
+        raise RequestError(f"Unknown compression '{request['compression']}'")
+    if request["seed"] is not None and not is_integer(request["seed"]):
+        raise RequestError("The seed must be an integer")
+    length_multiplier = request["length_multiplier"]
+    if isinstance(length_multiplier, bool) or not isinstance(
+            length_multiplier, (int, float)):
+        raise RequestError("The length_multiplier must be a number")
+    return request
+
+
+def get_stats(ts, model):
+    """
+    Returns a dictionary of summary statistics of the specified tree
+    sequence, in which the statistics for each sampled population are
+    keyed by the population names of the model.
+    """
+    sample_sets = [
+        ts.samples(population=j) for j in range(ts.num_populations)]
+    sampled = [j for j, samples in enumerate(sample_sets) if len(samples) > 0]
+    sample_sets = [sample_sets[j] for j in sampled]
+    population_names = [model.populations[j].name for j in sampled]
+    stats = {
+        "num_samples": ts.num_samples,
+        "sequence_length": ts.sequence_length,
+        "num_trees": ts.num_trees,
+        "num_sites": ts.num_sites,
+        "num_mutations": ts.num_mutations,
+        "diversity": float(ts.diversity()),
+        "segregating_sites": float(ts.segregating_sites()),
+        "tajimas_d": float(ts.Tajimas_D()) if ts.num_sites > 0 else None,
+        "populations": {},
+    }
+    diversity = ts.diversity(sample_sets)
+    for j, population_name in enumerate(population_names):
+        stats["populations"][population_name] = {
+            "num_samples": len(sample_sets[j]),
+            "diversity": float(diversity[j]),
+        }
+    return stats
+
+
+class SimulationService(object):
+    """
+    Runs simulation requests in a bounded pool of worker threads. Up to
+    num_workers simulations run at the same time, and up to max_queue
+    further requests wait for a worker; requests submitted when the queue is
+    full are rejected with a :class:`ServerBusyError`, so that clients can
+    retry later rather than the server accumulating unbounded work.
+
+    The contigs, which contain the recombination maps compiled from genetic
+    maps, and the prepared simulations (see :meth:`.Engine.prepare`) are
+    cached, so that repeated requests for the same species, model,
+    chromosome and samples only run the simulation itself.
+    """
+    def __init__(self, num_workers=1, max_queue=16, cache_size=64):
+        if num_workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+        if max_queue < 0:
+            raise ValueError("The maximum queue size must be non-negative")
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.default_engine = stdpopsim.get_default_engine().id
+        self.contigs = LruCache(cache_size)
+        self.prepared = LruCache(cache_size)
+        self.num_completed = 0
+        self.num_failed = 0
+        self.num_rejected = 0
+        self._slots = threading.BoundedSemaphore(num_workers + max_queue)
+        self._lock = threading.Lock()
+        self._num_pending = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="stdpopsim-worker")
+
+    def warm_up(self):
+        """
+        Loads all species in the catalog.
+        """
+        before = time.perf_counter()
+        species_ids = [species.id for species in stdpopsim.all_species()]
+        logger.info(
+            f"Loaded {len(species_ids)} species in "
+            f"{time.perf_counter() - before:.2f}s")
+
+    def status(self):
+        """
+        Returns a dictionary describing the state of the service.
+        """
+        return {
+            "workers": self.num_workers,
+            "max_queue": self.max_queue,
+            "pending": self._num_pending,
+            "completed": self.num_completed,
+            "failed": self.num_failed,
+            "rejected": self.num_rejected,
+            "contigs": {
+                "size": len(self.contigs), "hits": self.contigs.hits,
+                "misses": self.contigs.misses},
+            "prepared": {
+                "size": len(self.prepared), "hits": self.prepared.hits,
+                "misses": self.prepared.misses},
+        }
+
+    def get_contig(self, species, request):
+        key = (
+            species.id, request["chromosome"], request["genetic_map"],
+            request["length_multiplier"])
+        return self.contigs.get(key, lambda: species.get_contig(
+            request["chromosome"], genetic_map=request["genetic_map"],
+            length_multiplier=request["length_multiplier"]))
+
+    def get_model(self, species, model_id):
+        if model_id is None:
+            model = stdpopsim.PiecewiseConstantSize(species.population_size)
+            model.generation_time = species.generation_time
+            return model
+        return species.get_model(model_id)
+
+    def prepare(self, request):
+        """
+        Returns the model and the prepared simulation for the specified
+        request.
+        """
+        try:
+            species = stdpopsim.get_species(request["species"])
+            engine = stdpopsim.get_engine(request["engine"])
+            model = self.get_model(species, request["model"])
+            if request["chromosome"] is None:
+                request["chromosome"] = species.genome.chromosomes[0].id
+            samples = request["samples"]
+            if len(samples) > model.num_sampling_populations:
+                raise ValueError(
+                    "Cannot sample from more than "
+                    f"{model.num_sampling_populations} populations")
+            contig = self.get_contig(species, request)
+            sample_sets = model.get_samples(*samples)
+        except ValueError as e:
+            raise RequestError(str(e))
+        key = (
+            engine.id, species.id, request["model"], request["chromosome"],
+            request["genetic_map"], request["length_multiplier"], tuple(samples))
+        prepared = self.prepared.get(key, lambda: engine.prepare(
+            model=model, contig=contig, samples=sample_sets))
+        return model, prepared
+
+    def run(self, request):
+        """
+        Runs the specified simulation request, returning a tuple
+        (content_type, body).
+        """
+        model, prepared = self.prepare(request)
+        before = time.perf_counter()
+        ts = prepared.run(seed=request["seed"])
+        logger.info(
+            f"Simulated {request['species']} {request['model']} "
+            f"{request['chromosome']} {request['samples']} in "
+            f"{time.perf_counter() - before:.3f}s")
+        if request["output"] == "stats":
+            stats = get_stats(ts, model)
+            return "application/json", json.dumps(stats).encode()
+        from . import cli
+        provenance = cli.get_provenance_dict()
+        provenance["parameters"]["request"] = request
+        output = io.BytesIO()
+        storage.dump(ts, output, provenance, compression=request["compression"])
+        return "application/octet-stream", output.getvalue()
+
+    def submit(self, request):
+        """
+        Submits the specified simulation request to the worker pool,
+        returning a :class:`concurrent.futures.Future` for the result of
+        :meth:`.run`. Raises a :class:`ServerBusyError` if the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.num_rejected += 1
+            raise ServerBusyError(
+                f"The server is busy: {self.num_workers + self.max_queue} "
+                "requests are already running or queued")
+        with self._lock:
+            self._num_pending += 1
+        try:
+            future = self._executor.submit(self.run, request)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self._num_pending -= 1
+            if future is not None:
+                if future.exception() is None:
+                    self.num_completed += 1
+                else:
+                    self.num_failed += 1
+        self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class SimulationRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests to a :class:`SimulationServer`. A POST request to
+    /simulate runs the simulation described by the JSON body (see
+    :data:`REQUEST_DEFAULTS`), and a GET request to /status returns the
+    state of the server.
+    """
+    server_version = f"stdpopsim/{stdpopsim.__version__}"
+
+    def address_string(self):
+        # Unix domain sockets do not have a client address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "local"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in ({} if headers is None else headers).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, document, headers=None):
+        body = json.dumps(document).encode()
+        self.send_body(status, "application/json", body, headers)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(200, self.server.service.status())
+        else:
+            self.send_error_json(404, f"Unknown path '{self.path}'")
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error_json(400, "Invalid Content-Length")
+            return
+        if length > MAX_REQUEST_SIZE:
+            self.send_error_json(413, "The request is too large")
+            return
+        # The body is read before checking the path, so that the client is
+        # not writing to a closed connection when the error is sent.
+        content = self.rfile.read(length)
+        if self.path != "/simulate":
+            self.send_error_json(404, f"Unknown path '{self.path}'")
+            return
+        service = self.server.service
+        try:
+            document = json.loads(content)
+            request = parse_request(document, service.default_engine)
+            future = service.submit(request)
+            content_type, body = future.result()
+        except json.JSONDecodeError as e:
+            self.send_error_json(400, f"Invalid JSON: {e}")
+        except RequestError as e:
+            self.send_error_json(400, str(e))
+        except ServerBusyError as e:
+            self.send_error_json(503, str(e), {"Retry-After": "1"})
+        except Exception as e:
+            logger.exception("Simulation failed")
+            self.send_error_json(500, f"{type(e).__name__}: {e}")
+        else:
+            self.send_body(200, content_type, body)
+
+
+class SimulationServer(http.server.ThreadingHTTPServer):
+    """
+    An HTTP server listening on the specified TCP address, which runs the
+    simulations requested by clients using the specified
+    :class:`SimulationService`.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        super().__init__(address, SimulationRequestHandler)
+
+
+class UnixSimulationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A :class:`SimulationServer` listening on a Unix domain socket at the
+    specified path.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        super().__init__(path, SimulationRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
@@ -2,10 +2,10 @@
 Infrastructure for defining basic information about species and
 organising the species catalog.
 """
+import importlib
 import logging
 
 import attr
-import msprime
 
 from . import genomes
 
@@ -13,6 +13,18 @@ logger = logging.getLogger(__name__)
 
 registered_species = {}
 
+# The species in the catalog, mapping their IDs to the modules in
+# stdpopsim.catalog that define them and their names. These modules are only
+# imported when the species are first used, so that importing stdpopsim does
+# not build every species and model in the catalog.
+catalog_index = {
+    "homsap": ("homo_sapiens", "Homo sapiens"),
+    "pongo": ("pongo", "Pongo"),
+    "aratha": ("arabidopsis_thaliana", "Arabidopsis thaliana"),
+    "esccol": ("e_coli", "Escherichia coli"),
+    "dromel": ("drosophila_melanogaster", "Drosophila melanogaster"),
+}
+
 
 def register_species(species):
     """
@@ -22,7 +34,19 @@ def register_species(species):
     registered_species[species.id] = species
 
 
+def _load_catalog_species(id):
+    """
+    Imports the catalog module defining the species with the specified ID,
+    which registers the species, if it has not already been registered.
+    """
+    if id not in registered_species and id in catalog_index:
+        logger.debug(f"Loading species '{id}' from the catalog")
+        module_name, _ = catalog_index[id]
+        importlib.import_module(f"stdpopsim.catalog.{module_name}")
+
+
 def get_species(id):
+    _load_catalog_species(id)
     if id not in registered_species:
         # TODO we should probably have a custom exception here and standardise
         # on using these for all the catalog search functions.
@@ -37,8 +61,26 @@ def all_species():
     """
     Returns an iterator over all species in the catalog.
     """
-    for species in registered_species.values():
-        yield species
+    # The catalog species are listed first, in a fixed order, regardless of
+    # the order in which they were loaded.
+    for id in catalog_index:
+        _load_catalog_species(id)
+    species_ids = list(catalog_index.keys()) + [
+        id for id in registered_species if id not in catalog_index]
+    for id in species_ids:
+        yield registered_species[id]
+
+
+def all_species_names():
+    """
+    Returns a dictionary mapping the IDs of all species in the catalog to
+    their names, in the order of :func:`all_species`, without loading the
+    species.
+    """
+    names = {id: name for id, (_, name) in catalog_index.items()}
+    for id, species in registered_species.items():
+        names[id] = species.name
+    return names
 
 
 def all_genetic_maps():
@@ -122,6 +164,7 @@ class Species(object):
         :rtype: :class:`.Contig`
         :return: A :class:`.Contig` describing a simulation of the section of genome.
         """
+        import msprime
         chrom = self.genome.get_chromosome(chromosome)
         if genetic_map is None:
             logger.debug(f"Making flat chromosome {length_multiplier} * {chrom.id}")
@@ -0,0 +1,106 @@
+"""
+Windowed summary statistics of simulated tree sequences, computed for each
+sampled population, for runs in which the tree sequence itself is not
+needed.
+"""
+import concurrent.futures
+import itertools
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The statistics computed by get_window_stats, in the order of the columns.
+STATISTICS = ["diversity", "tajimas_d", "fst", "sfs"]
+
+
+def get_windows(sequence_length, num_windows):
+    """
+    Returns the breakpoints of the specified number of windows of equal
+    length covering the sequence, as used by the tskit statistics.
+    """
+    if num_windows < 1:
+        raise ValueError("The number of windows must be at least 1")
+    return np.linspace(0, sequence_length, num_windows + 1)
+
+
+def get_window_stats(ts, windows, population_names=None, num_threads=1):
+    """
+    Returns a dictionary mapping column names to arrays with one value for
+    each of the specified windows (see :func:`get_windows`), containing the
+    start and end of each window followed by:
+
+    - ``diversity_<pop>``: the nucleotide diversity of each population.
+    - ``tajimas_d_<pop>``: Tajima's D for each population, which is NaN in
+      windows without segregating sites.
+    - ``fst_<pop1>_<pop2>``: the Fst between each pair of populations.
+    - ``sfs_<pop>_<k>``: the number of sites at which k samples of each
+      population carry the derived allele, for 0 < k < n, where n is the
+      number of samples from the population.
+
+    Statistics are computed from the sites, for the populations that have
+    samples, which are named by population_names (by default, by their
+    IDs). The statistics are computed as separate tasks in a pool of
+    num_threads threads; tskit releases the GIL while computing them.
+    """
+    if num_threads < 1:
+        raise ValueError("The number of threads must be at least 1")
+    if population_names is None:
+        population_names = [str(j) for j in range(ts.num_populations)]
+    if len(population_names) != ts.num_populations:
+        raise ValueError("There must be one name for each population")
+    sample_sets = []
+    names = []
+    for j, name in enumerate(population_names):
+        samples = ts.samples(population=j)
+        if len(samples) > 0:
+            sample_sets.append(samples)
+            names.append(name)
+    pairs = list(itertools.combinations(range(len(sample_sets)), 2))
+
+    def diversity():
+        values = ts.diversity(sample_sets, windows=windows)
+        return [(f"diversity_{name}", values[:, j]) for j, name in enumerate(names)]
+
+    def tajimas_d():
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = ts.Tajimas_D(sample_sets, windows=windows)
+        return [(f"tajimas_d_{name}", values[:, j]) for j, name in enumerate(names)]
+
+    def fst():
+        if len(pairs) == 0:
+            return []
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = ts.Fst(sample_sets, indexes=pairs, windows=windows)
+        return [
+            (f"fst_{names[a]}_{names[b]}", values[:, j])
+            for j, (a, b) in enumerate(pairs)]
+
+    def sfs(j):
+        values = ts.allele_frequency_spectrum(
+            [sample_sets[j]], windows=windows, polarised=True,
+            span_normalise=False)
+        return [
+            (f"sfs_{names[j]}_{k}", values[:, k])
+            for k in range(1, len(sample_sets[j]))]
+
+    tasks = [diversity, tajimas_d, fst] + [
+        lambda j=j: sfs(j) for j in range(len(sample_sets))]
+    stats = {"start": windows[:-1], "end": windows[1:]}
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        for columns in executor.map(lambda task: task(), tasks):
+            stats.update(columns)
+    return stats
+
+
+def write_window_stats(stats, file):
+    """
+    Writes the specified dictionary of windowed statistics returned by
+    :func:`get_window_stats` to the specified text file object, as a
+    tab-separated table with a header line and one row for each window.
+    """
+    columns = list(stats.keys())
+    print("\t".join(columns), file=file)
+    for row in zip(*(stats[column] for column in columns)):
+        print("\t".join(f"{value:.6g}" for value in row), file=file)
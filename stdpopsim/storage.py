@@ -0,0 +1,580 @@
+"""
+Writing tree sequences to files and streams with additional provenance
+information, without copying the tables, optionally with columnar
+compression. Tree sequences may also be streamed as VCF, optionally
+compressed in the BGZF format, or as chunked genotype matrices in NumPy's
+npz format.
+"""
+import datetime
+import io
+import json
+import logging
+import lzma
+import os
+import queue
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+import kastore.store
+import tskit
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_FORMAT_NAME = "stdpopsim.trees.compressed"
+COMPRESSED_FORMAT_VERSION = (1, 0)
+
+# The versions of kastore for which write_arrays has been tested, as the
+# range [lower, upper), which is also declared in setup.py. write_arrays
+# uses the internals of kastore.store, which may change in other versions.
+KASTORE_VERSIONS = ("0.3.6", "0.4")
+
+# The suffix added to the names of files in the compressed format, which
+# tskit.load cannot read, to distinguish them from '.trees' files.
+COMPRESSED_SUFFIX = ".sz"
+
+# Functions to compress and decompress the bytes of a single column.
+COMPRESSION_CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+# Integer columns whose values are sorted or nearly so, which are stored as
+# the differences between successive values. Offset columns are included
+# implicitly.
+DELTA_COLUMNS = {
+    "edges/parent",
+    "individuals/parents",
+    "mutations/site",
+    "indexes/edge_insertion_order",
+    "indexes/edge_removal_order",
+}
+
+# Floating point columns that contain many repeated values, which compress
+# best when stored unchanged.
+PLAIN_COLUMNS = {
+    "edges/left",
+    "edges/right",
+    "migrations/left",
+    "migrations/right",
+}
+
+
+# The maximum amount of uncompressed data in a BGZF block, as used by bgzip.
+BGZF_BLOCK_SIZE = 0xff00
+
+# The empty block that marks the end of a BGZF file.
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# The number of chunks of VCF text that may wait to be written by the
+# background thread.
+VCF_QUEUE_SIZE = 16
+
+# The default number of sites in each chunk of genotypes.
+GENOTYPES_CHUNK_SIZE = 10000
+
+
+def _get_skeleton_arrays(tables):
+    """
+    Returns the kastore arrays for a table collection with the same metadata,
+    schemas and time units as the specified tables, but no rows. These are
+    the arrays in the tskit file format that are not table columns, encoded
+    by tskit itself.
+    """
+    skeleton = tskit.TableCollection(tables.sequence_length)
+    skeleton.time_units = tables.time_units
+    skeleton.metadata_schema = tables.metadata_schema
+    skeleton.metadata = tables.metadata
+    if tables.has_reference_sequence():
+        reference_sequence = tables.reference_sequence
+        skeleton.reference_sequence.data = reference_sequence.data
+        skeleton.reference_sequence.url = reference_sequence.url
+        skeleton.reference_sequence.metadata_schema = reference_sequence.metadata_schema
+        skeleton.reference_sequence.metadata = reference_sequence.metadata
+    for name, table in tables.table_name_map.items():
+        if hasattr(table, "metadata_schema"):
+            getattr(skeleton, name).metadata_schema = table.metadata_schema
+    with tempfile.TemporaryFile() as f:
+        skeleton.dump(f)
+        f.seek(0)
+        return dict(kastore.load(f, read_all=True))
+
+
+def get_arrays(ts, provenance=None):
+    """
+    Returns a dictionary mapping the keys of the tskit file format to the
+    arrays that would be stored for the specified tree sequence. The table
+    columns are views of the tree sequence's memory, and are not copied. If
+    provenance is specified, it is added as the final row of the provenance
+    table. Provenance may be a dictionary, which is encoded as JSON, or a
+    string.
+    """
+    tables = ts.tables
+    arrays = _get_skeleton_arrays(tables)
+    for name, table in tables.table_name_map.items():
+        for column in table.column_names:
+            key = f"{name}/{column}"
+            array = getattr(table, column)
+            dtype = arrays[key].dtype
+            # tskit stores metadata and text columns as int8 in memory, but
+            # as uint8 in files. Offset columns are written as 64 bit.
+            if array.dtype.itemsize == dtype.itemsize:
+                array = array.view(dtype)
+            arrays[key] = array
+    indexes = tables.indexes
+    arrays["indexes/edge_insertion_order"] = indexes.edge_insertion_order
+    arrays["indexes/edge_removal_order"] = indexes.edge_removal_order
+    if provenance is not None:
+        if not isinstance(provenance, str):
+            provenance = json.dumps(provenance)
+        timestamp = datetime.datetime.now().isoformat()
+        for column, value in [("record", provenance), ("timestamp", timestamp)]:
+            data = arrays[f"provenances/{column}"]
+            offset = arrays[f"provenances/{column}_offset"]
+            encoded = np.frombuffer(value.encode(), dtype=np.uint8)
+            arrays[f"provenances/{column}"] = np.concatenate([data, encoded])
+            arrays[f"provenances/{column}_offset"] = np.append(
+                offset, offset[-1] + len(encoded)).astype(offset.dtype)
+    return arrays
+
+
+def write_arrays(arrays, file):
+    """
+    Writes the specified dictionary of one dimensional arrays to the
+    specified binary file object in the kastore format. Unlike
+    :func:`kastore.dump`, the arrays are written directly from their memory
+    without being copied, and the file is written sequentially, so that it
+    may be a pipe (e.g., stdout). This uses the internals of
+    :mod:`kastore.store`, and so only supports :data:`KASTORE_VERSIONS`.
+    """
+    keys = sorted(arrays.keys())
+    encoded_keys = [key.encode("utf-8") for key in keys]
+    offset = kastore.store.HEADER_SIZE + len(keys) * kastore.store.ITEM_DESCRIPTOR_SIZE
+    descriptors = []
+    for key, encoded_key in zip(keys, encoded_keys):
+        array = np.ascontiguousarray(arrays[key])
+        if len(array.shape) != 1:
+            raise ValueError("Only 1D arrays supported")
+        type_ = kastore.store.np_dtype_to_type_map[str(array.dtype)]
+        descriptor = kastore.store.ItemDescriptor(type_)
+        descriptor.key = encoded_key
+        descriptor.array = array
+        descriptor.key_start = offset
+        descriptor.key_len = len(encoded_key)
+        offset += descriptor.key_len
+        descriptors.append(descriptor)
+    for descriptor in descriptors:
+        offset += -offset % kastore.store.ARRAY_ALIGN
+        descriptor.array_start = offset
+        descriptor.array_len = descriptor.array.shape[0]
+        offset += descriptor.array.nbytes
+    file_size = offset
+
+    header = struct.pack(
+        "<8sHHIQ", kastore.store.MAGIC, kastore.store.VERSION_MAJOR,
+        kastore.store.VERSION_MINOR, len(descriptors), file_size)
+    file.write(header.ljust(kastore.store.HEADER_SIZE, b"\0"))
+    for descriptor in descriptors:
+        file.write(descriptor.pack())
+    offset = kastore.store.HEADER_SIZE + len(keys) * kastore.store.ITEM_DESCRIPTOR_SIZE
+    for descriptor in descriptors:
+        file.write(descriptor.key)
+        offset += descriptor.key_len
+    for descriptor in descriptors:
+        file.write(b"\0" * (descriptor.array_start - offset))
+        file.write(memoryview(descriptor.array).cast("B"))
+        offset = descriptor.array_start + descriptor.array.nbytes
+    file.flush()
+
+
+def _get_filter(key, array):
+    """
+    Returns the name of the filter applied to the specified column before it
+    is compressed.
+    """
+    if array.dtype.itemsize == 1 or key in PLAIN_COLUMNS:
+        return None
+    if array.dtype.kind in "iu" and (key in DELTA_COLUMNS or key.endswith("_offset")):
+        return "delta"
+    return "shuffle"
+
+
+def _shuffle(array):
+    # Group the bytes of the values by significance, so that the high order
+    # bytes, which vary little, are stored together.
+    return array.view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, length):
+    array = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, length)
+    return np.ascontiguousarray(array.T).view(dtype).reshape(length)
+
+
+def _encode_column(key, array):
+    array = np.ascontiguousarray(array)
+    filter_ = _get_filter(key, array)
+    if filter_ is None:
+        data = memoryview(array).cast("B")
+    else:
+        if filter_ == "delta":
+            unsigned = array.view(f"u{array.dtype.itemsize}")
+            # The differences wrap around, so that decoding is exact.
+            array = np.diff(unsigned, prepend=np.zeros(1, dtype=unsigned.dtype))
+        data = _shuffle(array)
+    return filter_, data
+
+
+def _decode_column(filter_, dtype, length, data):
+    if filter_ is None:
+        return np.frombuffer(data, dtype=dtype)
+    if filter_ == "delta":
+        unsigned = np.dtype(f"u{dtype.itemsize}")
+        differences = _unshuffle(data, unsigned, length)
+        return np.cumsum(differences, dtype=unsigned).view(dtype)
+    if filter_ == "shuffle":
+        return _unshuffle(data, dtype, length)
+    raise ValueError(f"Unknown column filter '{filter_}'")
+
+
+def compress_arrays(arrays, codec="zlib"):
+    """
+    Returns a dictionary of arrays that stores a compressed version of the
+    specified dictionary of one dimensional arrays (see :func:`get_arrays`),
+    for writing with :func:`write_arrays`. Each column is compressed
+    separately with the specified codec (one of "zlib" or "lzma"), after
+    sorted integer columns are replaced by the differences between
+    successive values, and the bytes of other numeric columns are grouped by
+    significance. Use :func:`decompress_arrays` to recover the original
+    arrays.
+    """
+    if codec not in COMPRESSION_CODECS:
+        raise ValueError(
+            f"Unknown compression codec '{codec}'; must be one of "
+            f"{sorted(COMPRESSION_CODECS)}")
+    compress, _ = COMPRESSION_CODECS[codec]
+    columns = {}
+    compressed = {}
+    for key in sorted(arrays.keys()):
+        array = arrays[key]
+        if len(array.shape) != 1:
+            raise ValueError("Only 1D arrays supported")
+        filter_, data = _encode_column(key, array)
+        columns[key] = {
+            "dtype": array.dtype.str, "length": array.shape[0], "filter": filter_}
+        compressed[f"columns/{key}"] = np.frombuffer(compress(data), dtype=np.uint8)
+    header = {"codec": codec, "columns": columns}
+    compressed["format/name"] = np.frombuffer(
+        COMPRESSED_FORMAT_NAME.encode(), dtype=np.int8)
+    compressed["format/version"] = np.array(COMPRESSED_FORMAT_VERSION, dtype=np.uint32)
+    compressed["compression/header"] = np.frombuffer(
+        json.dumps(header).encode(), dtype=np.uint8)
+    return compressed
+
+
+def decompress_arrays(compressed):
+    """
+    Returns the dictionary of arrays stored in the specified dictionary
+    returned by :func:`compress_arrays`.
+    """
+    version = tuple(int(v) for v in compressed["format/version"])
+    if version[0] != COMPRESSED_FORMAT_VERSION[0]:
+        raise ValueError(f"Unsupported compressed file version {version}")
+    header = json.loads(bytes(compressed["compression/header"]).decode())
+    if header["codec"] not in COMPRESSION_CODECS:
+        raise ValueError(f"Unknown compression codec '{header['codec']}'")
+    _, decompress = COMPRESSION_CODECS[header["codec"]]
+    arrays = {}
+    for key, column in header["columns"].items():
+        data = decompress(bytes(compressed[f"columns/{key}"]))
+        arrays[key] = _decode_column(
+            column["filter"], np.dtype(column["dtype"]), column["length"], data)
+    return arrays
+
+
+def _get_tables_dict(arrays):
+    """
+    Returns the dictionary representation of a table collection (see
+    :meth:`tskit.TableCollection.fromdict`) for the specified arrays of the
+    tskit file format.
+    """
+    tables = {}
+    for key, array in arrays.items():
+        group, _, name = key.rpartition("/")
+        if group == "format" or key == "uuid":
+            continue
+        if key == "sequence_length":
+            value = float(array[0])
+        elif name in ("metadata_schema", "time_units") or (
+                group == "reference_sequence" and name in ("data", "url")):
+            value = bytes(array).decode()
+        elif name == "metadata" and group in ("", "reference_sequence"):
+            value = bytes(array)
+        elif array.dtype == np.uint8:
+            # Text and metadata columns are stored as uint8 in files, but
+            # are int8 in memory.
+            value = array.view(np.int8)
+        else:
+            value = array
+        if group == "":
+            tables[name] = value
+        else:
+            tables.setdefault(group, {})[name] = value
+    return tables
+
+
+def dump(ts, file, provenance=None, compression=None):
+    """
+    Writes the specified tree sequence to a file in the tskit '.trees'
+    format, adding the specified provenance record (see :func:`get_arrays`).
+    This is equivalent to adding the provenance to a copy of the tables and
+    writing these, but the tables are not copied, so the memory used is
+    about that of the tree sequence itself. The file may be a path or a
+    binary file object.
+
+    If compression is specified, the file is written in a compressed format
+    using the specified codec (see :func:`compress_arrays`), which can be
+    read with :func:`load`. The columns are compressed in memory and the
+    file is still written sequentially, so that the uncompressed file is
+    never written.
+    """
+    arrays = get_arrays(ts, provenance)
+    if compression is not None:
+        arrays = compress_arrays(arrays, compression)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as f:
+            write_arrays(arrays, f)
+    else:
+        write_arrays(arrays, file)
+
+
+def load(file):
+    """
+    Returns the tree sequence stored in the specified file, which may be a
+    path or a binary file object. The file may be in the tskit '.trees'
+    format, or the compressed format written by :func:`dump`.
+    """
+    arrays = dict(kastore.load(file, read_all=True))
+    name = bytes(arrays.get("format/name", b"")).decode()
+    if name == COMPRESSED_FORMAT_NAME:
+        arrays = decompress_arrays(arrays)
+        name = bytes(arrays["format/name"]).decode()
+    if name != "tskit.trees":
+        raise ValueError(f"File format '{name}' is not a tree sequence")
+    tables = tskit.TableCollection.fromdict(_get_tables_dict(arrays))
+    if not tables.has_index():
+        tables.build_index()
+    return tables.tree_sequence()
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    A binary file object that compresses the data written to it in the BGZF
+    format, as written by bgzip, and writes it to the specified binary file
+    object. BGZF files are gzip files, and can be indexed with tabix. The
+    final block and the end of file marker are written when the writer is
+    closed, but the underlying file is not closed.
+    """
+    def __init__(self, file, level=6):
+        self.file = file
+        self.level = level
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(self.buffer[:BGZF_BLOCK_SIZE])
+            del self.buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        # The gzip header has an extra field with the size of the block
+        # minus one, which allows the blocks to be found without
+        # decompressing them.
+        header = struct.pack(
+            "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+            len(compressed) + 25)
+        trailer = struct.pack("<II", zlib.crc32(data), len(data))
+        self.file.write(header + compressed + trailer)
+
+    def close(self):
+        if not self.closed:
+            if len(self.buffer) > 0:
+                self._write_block(self.buffer)
+                self.buffer.clear()
+            self.file.write(BGZF_EOF)
+            self.file.flush()
+        super().close()
+
+
+class _ThreadedWriter(io.RawIOBase):
+    """
+    A binary file object that passes the data written to it to a background
+    thread, which writes it to the specified binary file object, so that
+    compressing and writing the data overlaps with generating it. Errors
+    raised by the underlying file are raised by the next call to write or
+    close. The underlying file is not closed.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.error = None
+        self.queue = queue.Queue(VCF_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            # After an error, keep taking data from the queue so that the
+            # writing thread does not block.
+            if self.error is None:
+                try:
+                    self.file.write(data)
+                except BaseException as e:
+                    self.error = e
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
+        if self.error is not None:
+            raise self.error
+
+
+def write_vcf(ts, file, compression=None, contig_id="1"):
+    """
+    Writes the variants of the specified tree sequence to a file in VCF
+    format, using :meth:`tskit.TreeSequence.write_vcf`. The variants are
+    written while the trees are traversed, and the VCF text is written to
+    the file (and compressed) by a background thread. The file may be a
+    path or a binary file object, and is written sequentially, so that it
+    may be a pipe (e.g., stdout).
+
+    If compression is "bgzip", the file is compressed in the BGZF format
+    (see :class:`BgzfWriter`). Site positions are rounded to the nearest
+    integer, except that sites rounded to zero are written at position 1,
+    as VCF positions start at 1.
+    """
+    if compression not in (None, "bgzip"):
+        raise ValueError(
+            f"Unknown VCF compression '{compression}'; must be 'bgzip' or None")
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as f:
+            write_vcf(ts, f, compression, contig_id)
+        return
+    bgzf = None
+    if compression == "bgzip":
+        bgzf = BgzfWriter(file)
+        file = bgzf
+    output = io.TextIOWrapper(
+        io.BufferedWriter(_ThreadedWriter(file), BGZF_BLOCK_SIZE),
+        encoding="utf-8")
+    try:
+        ts.write_vcf(
+            output, contig_id=contig_id,
+            position_transform=lambda x: np.maximum(1, np.round(x)))
+    finally:
+        output.close()
+    if bgzf is not None:
+        bgzf.close()
+    else:
+        file.flush()
+
+
+def _get_population_names(ts):
+    # Population names are stored in the metadata of tree sequences written
+    # by msprime 1.0 and later.
+    names = []
+    for population in ts.populations():
+        metadata = population.metadata
+        if isinstance(metadata, dict) and "name" in metadata:
+            names.append(str(metadata["name"]))
+        else:
+            names.append(f"pop_{population.id}")
+    return names
+
+
+def write_genotypes(
+        ts, file, compression=None, chunk_size=GENOTYPES_CHUNK_SIZE,
+        population_names=None):
+    """
+    Writes the genotypes of the samples in the specified tree sequence to a
+    file in NumPy's ``.npz`` format, which can be read with :func:`numpy.load`.
+    The genotypes are written in chunks of chunk_size consecutive sites, as
+    the trees are traversed, so that the memory used does not depend on the
+    number of sites. The file may be a path or a binary file object, and is
+    written sequentially, so that it may be a pipe (e.g., stdout). If
+    compression is "zlib", the arrays are compressed as by
+    :func:`numpy.savez_compressed`. The file contains the arrays:
+
+    - ``positions``: the position of each site.
+    - ``genotypes_<j>``: the genotypes at the j-th chunk of sites, with
+      one row per site and one column per sample (as in
+      :meth:`tskit.TreeSequence.genotype_matrix`). Each genotype is the index
+      of the sample's allele, where 0 is the ancestral state.
+    - ``sample_populations``: the index of the population of each sample.
+    - ``population_names``: the name of each population. If
+      population_names is not specified, the names are taken from the
+      population metadata.
+    """
+    if compression not in (None, "zlib"):
+        raise ValueError(
+            f"Unknown genotypes compression '{compression}'; must be 'zlib' or None")
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be at least 1")
+    if population_names is None:
+        population_names = _get_population_names(ts)
+    if len(population_names) != ts.num_populations:
+        raise ValueError("There must be one name for each population")
+    # The number of alleles at a site is at most one more than the number of
+    # mutations, which decides the smallest type that can hold the genotypes.
+    max_mutations = np.bincount(ts.mutations_site, minlength=1).max()
+    dtype = np.int8 if max_mutations < 127 else np.int32
+    zip_compression = zipfile.ZIP_STORED
+    if compression == "zlib":
+        zip_compression = zipfile.ZIP_DEFLATED
+
+    with zipfile.ZipFile(file, "w", compression=zip_compression) as zf:
+
+        def write_array(name, array):
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+
+        write_array("positions", ts.sites_position)
+        samples = ts.samples()
+        write_array("sample_populations", ts.nodes_population[samples])
+        write_array("population_names", np.array(population_names, dtype=str))
+        chunk = np.zeros((min(chunk_size, ts.num_sites), len(samples)), dtype=dtype)
+        num_rows = 0
+        num_chunks = 0
+        for variant in ts.variants(copy=False):
+            chunk[num_rows] = variant.genotypes
+            num_rows += 1
+            if num_rows == chunk_size:
+                write_array(f"genotypes_{num_chunks}", chunk)
+                num_rows = 0
+                num_chunks += 1
+        if num_rows > 0:
+            write_array(f"genotypes_{num_chunks}", chunk[:num_rows])
+    if not isinstance(file, (str, os.PathLike)):
+        file.flush()
@@ -2,7 +2,9 @@
 Test cases for the command line interfaces to stdpopsim
 """
 import unittest
+import gzip
 import tempfile
+import os
 import pathlib
 import subprocess
 import json
@@ -11,12 +13,14 @@ import io
 import argparse  # NOQA
 from unittest import mock
 
+import numpy as np
 import tskit
 import msprime
 import kastore
 
 import stdpopsim
 import stdpopsim.cli as cli
+from stdpopsim import storage
 
 
 class TestException(Exception):
@@ -177,6 +181,72 @@ class TestHomoSapiensArgumentParser(unittest.TestCase):
             call.assert_called_with(bib)
 
 
+class TestMsprimeArgumentParser(unittest.TestCase):
+    """
+    Tests for the msprime engine specific arguments.
+    """
+    def test_defaults(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertEqual(args.msprime_model, "hudson")
+        self.assertEqual(args.msprime_change_model, None)
+
+    def test_msprime_model(self):
+        parser = cli.stdpopsim_cli_parser()
+        for model in ["hudson", "dtwf", "smc", "smc_prime"]:
+            args = parser.parse_args(["--msprime-model", model, "homsap", "2"])
+            self.assertEqual(args.msprime_model, model)
+
+    def test_msprime_change_model(self):
+        parser = cli.stdpopsim_cli_parser()
+        cmd = (
+            "--msprime-model dtwf --msprime-change-model 100 hudson "
+            "--msprime-change-model 1e4 smc homsap 2")
+        args = parser.parse_args(cmd.split())
+        self.assertEqual(args.msprime_model, "dtwf")
+        self.assertEqual(
+            args.msprime_change_model, [[100, "hudson"], [1e4, "smc"]])
+
+
+class TestAutoEngineArgumentParser(unittest.TestCase):
+    """
+    Tests for the auto engine specific arguments.
+    """
+    def test_defaults(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["-e", "auto", "homsap", "2"])
+        self.assertEqual(args.engine, "auto")
+        self.assertEqual(args.auto_dtwf_sample_fraction, None)
+        self.assertEqual(args.auto_dtwf_generations, None)
+        self.assertEqual(args.auto_smc_min_scaled_recombination, None)
+
+    def test_thresholds(self):
+        parser = cli.stdpopsim_cli_parser()
+        cmd = (
+            "-e auto --auto-dtwf-sample-fraction 0.5 --auto-dtwf-generations 20 "
+            "--auto-smc-min-scaled-recombination 1e5 homsap 2")
+        args = parser.parse_args(cmd.split())
+        self.assertEqual(args.auto_dtwf_sample_fraction, 0.5)
+        self.assertEqual(args.auto_dtwf_generations, 20)
+        self.assertEqual(args.auto_smc_min_scaled_recombination, 1e5)
+
+    def test_end_to_end(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / "output.trees"
+            cmd = (
+                f"-e auto --auto-dtwf-sample-fraction 0 homsap -c chr22 -l0.001 "
+                f"5 -q -s 3 -o {filename}")
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                capture_output(cli.stdpopsim_main, cmd.split())
+            ts = tskit.load(str(filename))
+        records = [json.loads(p.record) for p in ts.provenances()]
+        self.assertEqual(records[-1]["software"]["name"], "stdpopsim")
+        selection = records[-1]["parameters"]["engine_selection"]
+        self.assertEqual(selection["engine"], "msprime")
+        self.assertEqual(selection["options"]["msprime_model"], "dtwf")
+        self.assertEqual(selection["thresholds"]["dtwf_sample_fraction"], 0)
+
+
 class TestEndToEnd(unittest.TestCase):
     """
     Checks that simulations we run from the CLI have plausible looking output.
@@ -243,6 +313,16 @@ class TestEndToEnd(unittest.TestCase):
         cmd = "esccol -l 1e-7 2"
         self.verify(cmd, num_samples=2)
 
+    def test_msprime_smc(self):
+        cmd = "--msprime-model smc homsap -c chr22 -l0.01 10"
+        self.verify(cmd, num_samples=10)
+
+    def test_msprime_dtwf_hybrid(self):
+        cmd = (
+            "--msprime-model dtwf --msprime-change-model 10 hudson "
+            "homsap -c chr22 -l0.01 -m ooa_3 10")
+        self.verify(cmd, num_samples=10)
+
 
 class TestEndToEndSubprocess(TestEndToEnd):
     """
@@ -268,6 +348,469 @@ class TestEndToEndSubprocess(TestEndToEnd):
         self.assertEqual(prov_seed, seed)
 
 
+class TestSubsample(unittest.TestCase):
+    """
+    Tests for writing nested subsamples from the CLI.
+    """
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "10", "-o", "x.trees"])
+        self.assertEqual(args.subsample, None)
+        args = parser.parse_args(
+            "homsap 10 5 --subsample 2 1 --subsample 4 -o x.trees".split())
+        self.assertEqual(args.samples, [10, 5])
+        self.assertEqual(args.subsample, [[2, 1], [4]])
+
+    def test_subsample_output(self):
+        self.assertEqual(
+            cli.get_subsample_output("out.trees", [10, 5]), "out_10_5.trees")
+        self.assertEqual(
+            cli.get_subsample_output("/a/b/out", [3]), "/a/b/out_3")
+
+    def test_end_to_end(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / "output.trees"
+            cmd = (
+                f"homsap -c chr22 -l0.01 -m ooa_3 6 4 -q -o {filename} -s 5 "
+                "--subsample 2 1 --subsample 5")
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+            self.assertEqual(len(stdout), 0)
+            self.assertEqual(len(stderr), 0)
+            full = tskit.load(str(filename))
+            sub1 = tskit.load(str(pathlib.Path(tmpdir) / "output_2_1.trees"))
+            sub2 = tskit.load(str(pathlib.Path(tmpdir) / "output_5.trees"))
+        self.assertEqual(full.num_samples, 10)
+        self.assertEqual(sub1.num_samples, 3)
+        self.assertEqual(sub2.num_samples, 5)
+        self.assertEqual(len(sub1.samples(population=1)), 1)
+        self.assertEqual(len(sub2.samples(population=1)), 0)
+        for ts in [full, sub1, sub2]:
+            provenance = json.loads(ts.provenance(ts.num_provenances - 1).record)
+            self.assertEqual(provenance["software"]["name"], "stdpopsim")
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def verify_error(self, cmd, mock_setup_logging):
+        with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                cli.stdpopsim_main(cmd.split())
+            mocked_exit.assert_called_once()
+
+    def test_no_output(self):
+        self.verify_error("homsap -q 10 --subsample 5")
+
+    def test_too_many_samples(self):
+        self.verify_error("homsap -q -m ooa_3 10 --subsample 11 -o x.trees")
+        self.verify_error("homsap -q -m ooa_3 10 --subsample 5 1 -o x.trees")
+
+
+class TestReplicates(unittest.TestCase):
+    """
+    Tests for running multiple replicates, optionally partitioned into tasks.
+    """
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "10"])
+        self.assertEqual(args.replicates, None)
+        self.assertEqual(args.task_index, None)
+        self.assertEqual(args.num_tasks, None)
+        args = parser.parse_args(
+            "homsap 10 --replicates 100 --task-index 3 --num-tasks 10".split())
+        self.assertEqual(args.replicates, 100)
+        self.assertEqual(args.task_index, 3)
+        self.assertEqual(args.num_tasks, 10)
+
+    def test_replicate_output(self):
+        self.assertEqual(
+            cli.get_replicate_output("out.trees", 7, 1000), "out_007.trees")
+        self.assertEqual(
+            cli.get_replicate_output("/a/b/out", 0, 1), "/a/b/out_0")
+        self.assertEqual(
+            cli.get_replicate_output("out.trees", 10, 11), "out_10.trees")
+
+    def test_replicate_seeds(self):
+        seeds = [cli.get_replicate_seed(1234, j) for j in range(1000)]
+        self.assertEqual(len(set(seeds)), len(seeds))
+        for seed in seeds:
+            self.assertTrue(0 < seed < 2**32)
+        self.assertEqual(seeds, [cli.get_replicate_seed(1234, j) for j in range(1000)])
+        self.assertNotEqual(seeds[0], cli.get_replicate_seed(1235, 0))
+
+    def test_task_replicates(self):
+        for num_replicates in [1, 5, 10, 99, 100]:
+            for num_tasks in [1, 3, 10, 101]:
+                indexes = []
+                for task_index in range(num_tasks):
+                    task = cli.get_task_replicates(
+                        num_replicates, task_index, num_tasks)
+                    self.assertLessEqual(
+                        len(task), num_replicates // num_tasks + 1)
+                    indexes.extend(task)
+                self.assertEqual(indexes, list(range(num_replicates)))
+
+    def run_stdpopsim(self, cmd):
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+        self.assertEqual(len(stdout), 0)
+        self.assertEqual(len(stderr), 0)
+
+    def get_replicate_provenance(self, ts):
+        provenance = json.loads(ts.provenance(ts.num_provenances - 1).record)
+        return provenance["parameters"]["replicate"]
+
+    def test_end_to_end(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            self.run_stdpopsim(
+                f"homsap -c chr22 -l0.001 5 -q -s 12 -o {tmpdir / 'out.trees'} "
+                "--replicates 3")
+            self.assertEqual(
+                sorted(path.name for path in tmpdir.glob("*.trees")),
+                ["out_0.trees", "out_1.trees", "out_2.trees"])
+            for j in range(3):
+                ts = tskit.load(str(tmpdir / f"out_{j}.trees"))
+                self.assertEqual(ts.num_samples, 5)
+                replicate = self.get_replicate_provenance(ts)
+                seed = cli.get_replicate_seed(12, j)
+                self.assertEqual(
+                    replicate, {"index": j, "seed": seed, "master_seed": 12})
+                self.assertEqual(
+                    json.loads(ts.provenance(0).record)["parameters"]["random_seed"],
+                    seed)
+
+    def test_tasks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            self.run_stdpopsim(
+                f"homsap -c chr22 -l0.001 5 -q -s 12 -o {tmpdir / 'all.trees'} "
+                "--replicates 5")
+            for task_index in range(2):
+                self.run_stdpopsim(
+                    f"homsap -c chr22 -l0.001 5 -q -s 12 "
+                    f"-o {tmpdir / 'task.trees'} --replicates 5 "
+                    f"--task-index {task_index} --num-tasks 2")
+                if task_index == 0:
+                    self.assertEqual(len(list(tmpdir.glob("task_*.trees"))), 2)
+            for j in range(5):
+                ts1 = tskit.load(str(tmpdir / f"all_{j}.trees"))
+                ts2 = tskit.load(str(tmpdir / f"task_{j}.trees"))
+                self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+                self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+
+    def test_subsample(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            self.run_stdpopsim(
+                f"homsap -c chr22 -l0.001 5 -q -o {tmpdir / 'out.trees'} "
+                "--replicates 2 --subsample 2")
+            self.assertEqual(
+                sorted(path.name for path in tmpdir.glob("*.trees")),
+                ["out_0.trees", "out_0_2.trees", "out_1.trees", "out_1_2.trees"])
+            ts = tskit.load(str(tmpdir / "out_1_2.trees"))
+            self.assertEqual(ts.num_samples, 2)
+            replicate = self.get_replicate_provenance(ts)
+            self.assertEqual(replicate["index"], 1)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def verify_error(self, cmd, mock_setup_logging):
+        with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                cli.stdpopsim_main(cmd.split())
+            mocked_exit.assert_called_once()
+
+    def test_errors(self):
+        self.verify_error("homsap -q 10 --replicates 2")
+        self.verify_error("homsap -q 10 --replicates 0 -o x.trees")
+        self.verify_error("homsap -q 10 --task-index 1 -o x.trees")
+        self.verify_error("homsap -q 10 --num-tasks 2 -o x.trees")
+        self.verify_error(
+            "homsap -q 10 --replicates 2 --num-tasks 2 --task-index 0 -o x.trees")
+        self.verify_error(
+            "homsap -q 10 -s 1 --replicates 2 --num-tasks 2 --task-index 2 "
+            "-o x.trees")
+        self.verify_error(
+            "homsap -q 10 -s 1 --replicates 2 --num-tasks 0 -o x.trees")
+
+
+class TestResume(unittest.TestCase):
+    """
+    Tests for the progress journal and resuming runs of multiple replicates.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = pathlib.Path(self.tmpdir.name) / "out.trees"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_stdpopsim(self, options):
+        cmd = f"homsap -c chr22 -l0.001 5 -q -o {self.output} --replicates 3 {options}"
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+        self.assertEqual(len(stdout), 0)
+        self.assertEqual(len(stderr), 0)
+
+    def read_journal(self, name="out.journal"):
+        with open(pathlib.Path(self.tmpdir.name) / name) as f:
+            return [json.loads(line) for line in f]
+
+    def test_journal_path(self):
+        self.assertEqual(cli.get_journal_path("a/out.trees"), "a/out.journal")
+        self.assertEqual(
+            cli.get_journal_path("a/out.trees", 3, 10), "a/out.task3.journal")
+
+    def test_journal(self):
+        self.run_stdpopsim("-s 5 --subsample 2")
+        records = self.read_journal()
+        self.assertEqual(
+            [record["event"] for record in records], ["started", "completed"] * 3)
+        for j, record in enumerate(records[1::2]):
+            self.assertEqual(record["index"], j)
+            self.assertEqual(record["seed"], cli.get_replicate_seed(5, j))
+            self.assertEqual(record["master_seed"], 5)
+            self.assertEqual(len(record["outputs"]), 2)
+            for output in record["outputs"]:
+                self.assertTrue(pathlib.Path(output).exists())
+        # No temporary files are left behind.
+        self.assertEqual(len(list(pathlib.Path(self.tmpdir.name).glob(".*"))), 0)
+
+    def test_task_journals(self):
+        self.run_stdpopsim("-s 5 --num-tasks 2 --task-index 1")
+        records = self.read_journal("out.task1.journal")
+        self.assertEqual([record["index"] for record in records], [1, 1, 2, 2])
+        self.assertEqual(len(cli.read_journals(self.output)), 4)
+
+    def test_resume(self):
+        self.run_stdpopsim("-s 5")
+        original = tskit.load(str(self.tmpdir.name + "/out_1.trees"))
+        pathlib.Path(self.tmpdir.name, "out_1.trees").unlink()
+        self.run_stdpopsim("-s 5 --resume")
+        records = self.read_journal()
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records[-1]["event"], "completed")
+        self.assertEqual(records[-1]["index"], 1)
+        resumed = tskit.load(str(self.tmpdir.name + "/out_1.trees"))
+        self.assertEqual(original.tables.edges, resumed.tables.edges)
+        # Nothing is rerun when all replicates are complete.
+        self.run_stdpopsim("-s 5 --resume")
+        self.assertEqual(len(self.read_journal()), 8)
+
+    def test_resume_compressed(self):
+        self.run_stdpopsim("-s 5 --compression zlib")
+        records = self.read_journal()
+        for j, record in enumerate(records[1::2]):
+            path = pathlib.Path(self.tmpdir.name, f"out_{j}.trees.sz")
+            self.assertEqual(record["outputs"], [str(path)])
+            self.assertTrue(path.exists())
+        pathlib.Path(self.tmpdir.name, "out_1.trees.sz").unlink()
+        self.run_stdpopsim("-s 5 --compression zlib --resume")
+        records = self.read_journal()
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records[-1]["index"], 1)
+        self.assertTrue(pathlib.Path(self.tmpdir.name, "out_1.trees.sz").exists())
+
+    def test_resume_master_seed(self):
+        self.run_stdpopsim("")
+        master_seed = self.read_journal()[0]["master_seed"]
+        pathlib.Path(self.tmpdir.name, "out_2.trees").unlink()
+        self.run_stdpopsim("--resume")
+        records = self.read_journal()
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records[-1]["master_seed"], master_seed)
+
+    def test_resume_different_seed(self):
+        self.run_stdpopsim("-s 5")
+        self.run_stdpopsim("-s 6 --resume")
+        self.assertEqual(len(self.read_journal()), 12)
+
+    def test_incomplete_journal(self):
+        self.run_stdpopsim("-s 5")
+        with open(cli.get_journal_path(self.output), "a") as f:
+            f.write('{"event": "comp')
+        self.assertEqual(len(cli.read_journals(self.output)), 6)
+        self.assertEqual(
+            cli.get_completed_replicates(cli.read_journals(self.output)),
+            {(j, cli.get_replicate_seed(5, j)) for j in range(3)})
+
+    def test_resume_different_arguments(self):
+        self.run_stdpopsim("-s 5")
+        pathlib.Path(self.tmpdir.name, "out_1.trees").unlink()
+        for options in [
+                "-s 5 --resume -m ooa_3", "-s 5 --resume --compression zlib",
+                "-s 5 --resume --replicates 20"]:
+            with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as e:
+                with self.assertRaises(TestException):
+                    self.run_stdpopsim(options)
+                e.assert_called_once()
+        self.assertEqual(len(self.read_journal()), 6)
+        # Options which do not change the outputs may differ.
+        self.run_stdpopsim("-s 5 --resume --progress-interval 1")
+        self.assertEqual(len(self.read_journal()), 8)
+
+    def test_arguments_hash(self):
+        parser = cli.stdpopsim_cli_parser()
+        args1 = parser.parse_args("homsap 5 -o a.trees -s 1 --replicates 2".split())
+        args2 = parser.parse_args("homsap 5 -o b.trees -s 2 --replicates 2 -q".split())
+        args3 = parser.parse_args("homsap 6 -o a.trees -s 1 --replicates 2".split())
+        args4 = parser.parse_args("homsap 5 -o a.trees -s 1 --replicates 10".split())
+        self.assertEqual(cli.get_arguments_hash(args1), cli.get_arguments_hash(args2))
+        self.assertNotEqual(
+            cli.get_arguments_hash(args1), cli.get_arguments_hash(args3))
+        # The number of replicates changes the names of the output files.
+        self.assertNotEqual(
+            cli.get_arguments_hash(args1), cli.get_arguments_hash(args4))
+
+    def test_permissions(self):
+        ts = msprime.simulate(10, random_seed=2)
+        umask = os.umask(0o022)
+        try:
+            cli.dump_atomic(ts, self.output)
+        finally:
+            os.umask(umask)
+        self.assertEqual(self.output.stat().st_mode & 0o777, 0o644)
+
+    def test_dump_atomic_error(self):
+        ts = msprime.simulate(10, random_seed=2)
+        with mock.patch("stdpopsim.storage.write_arrays", side_effect=TestException):
+            with self.assertRaises(TestException):
+                cli.dump_atomic(ts, self.output)
+        self.assertEqual(len(list(pathlib.Path(self.tmpdir.name).iterdir())), 0)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def test_resume_requires_replicates(self, mock_setup_logging):
+        with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                cli.stdpopsim_main("homsap -q 10 -o x.trees --resume".split())
+            mocked_exit.assert_called_once()
+
+
+class TestDryRun(unittest.TestCase):
+    """
+    Tests for the --dry-run and --estimate options.
+    """
+    def run_stdpopsim(self, cmd):
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            with mock.patch("msprime.sim_ancestry") as mocked_simulate:
+                stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+        mocked_simulate.assert_not_called()
+        return stdout, stderr
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "10"])
+        self.assertFalse(args.dry_run)
+        self.assertFalse(args.estimate)
+        self.assertEqual(args.calibration, None)
+        args = parser.parse_args(
+            "homsap 10 --dry-run --estimate --calibration x.json".split())
+        self.assertTrue(args.dry_run)
+        self.assertTrue(args.estimate)
+        self.assertEqual(args.calibration, "x.json")
+
+    def test_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / "output.trees"
+            stdout, stderr = self.run_stdpopsim(
+                f"homsap -q -c chr22 10 --dry-run -o {filename}")
+            self.assertFalse(filename.exists())
+        self.assertEqual(stdout, "")
+        self.assertEqual(stderr, "")
+
+    def test_estimate(self):
+        stdout, stderr = self.run_stdpopsim(
+            "homsap -q -c chr22 -m ooa_3 10 5 --dry-run --estimate")
+        estimate = json.loads(stdout)
+        self.assertEqual(estimate["num_simulations"], 1)
+        self.assertEqual(estimate["features"]["num_samples"], 15)
+        self.assertGreater(estimate["runtime"], 0)
+        self.assertGreater(estimate["runtime_upper"], estimate["runtime"])
+        self.assertGreater(estimate["peak_memory"], 0)
+        self.assertGreater(estimate["peak_memory_upper"], estimate["peak_memory"])
+
+    def test_estimate_replicates(self):
+        stdout, _ = self.run_stdpopsim(
+            "homsap -q -c chr22 10 --dry-run --estimate")
+        single = json.loads(stdout)
+        stdout, _ = self.run_stdpopsim(
+            "homsap -q -c chr22 10 --dry-run --estimate -o x.trees -s 1 "
+            "--replicates 100 --num-tasks 10 --task-index 2")
+        task = json.loads(stdout)
+        self.assertEqual(task["num_simulations"], 10)
+        self.assertAlmostEqual(task["runtime"], 10 * single["runtime"])
+
+    def test_calibration_file(self):
+        from stdpopsim import estimator
+        # An estimator predicting a constant runtime of 7 seconds.
+        e = estimator.ResourceEstimator(
+            engine="msprime", time_coefficients=[np.log(7), 0, 0, 0],
+            memory_coefficients=[np.log(2**20), 0, 0, 0])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "calibration.json"
+            e.dump(path)
+            stdout, _ = self.run_stdpopsim(
+                f"homsap -q -c chr22 10 -l 0.01 --dry-run --estimate "
+                f"--calibration {path}")
+        estimate = json.loads(stdout)
+        self.assertAlmostEqual(estimate["runtime"], 7)
+        self.assertAlmostEqual(estimate["runtime_upper"], 7)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def test_estimate_requires_dry_run(self, mock_setup_logging):
+        with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                cli.stdpopsim_main("homsap -q 10 --estimate".split())
+            mocked_exit.assert_called_once()
+
+
+class TestCalibrateEstimator(unittest.TestCase):
+    """
+    Tests for the calibrate-estimator subcommand.
+    """
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["calibrate-estimator"])
+        self.assertEqual(args.output, None)
+        self.assertFalse(args.quick)
+        self.assertEqual(args.runner, cli.run_calibrate_estimator)
+        args = parser.parse_args(["calibrate-estimator", "--quick", "-o", "x.json"])
+        self.assertEqual(args.output, "x.json")
+        self.assertTrue(args.quick)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def test_quick(self, mock_setup_logging):
+        from stdpopsim import estimator
+        simulations = estimator.get_calibration_simulations(quick=True)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "calibration.json"
+            with mock.patch(
+                    "stdpopsim.estimator.get_calibration_simulations",
+                    return_value=simulations[:6]) as mocked:
+                capture_output(
+                    cli.stdpopsim_main,
+                    ["calibrate-estimator", "--quick", "-o", str(path)])
+            mocked.assert_called_once_with(quick=True)
+            e = estimator.ResourceEstimator.load(path)
+        self.assertEqual(len(e.measurements), 6)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def test_default_output(self, mock_setup_logging):
+        from stdpopsim import estimator
+        saved_cache_dir = stdpopsim.get_cache_dir()
+        fitted = estimator.ResourceEstimator.fit([
+            {"num_samples": n, "genetic_length": 1, "population_size": 1000,
+             "num_epochs": k, "wall_time": n, "memory": 2**20 * n}
+            for n in [10, 100, 1000] for k in [1, 2]])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                stdpopsim.set_cache_dir(pathlib.Path(tmpdir) / "cache")
+                with mock.patch(
+                        "stdpopsim.estimator.calibrate", return_value=fitted):
+                    capture_output(cli.stdpopsim_main, ["calibrate-estimator"])
+                self.assertEqual(estimator.get_default_estimator(), fitted)
+            finally:
+                stdpopsim.set_cache_dir(saved_cache_dir)
+
+
 class TestWriteOutput(unittest.TestCase):
     """
     Tests the paths through the write_output function.
@@ -276,18 +819,57 @@ class TestWriteOutput(unittest.TestCase):
         ts = msprime.simulate(10, random_seed=2)
         parser = cli.stdpopsim_cli_parser()
         args = parser.parse_args(["aratha", "2"])
-        with mock.patch("shutil.copyfileobj") as mocked_copy:
-            cli.write_output(ts, args)
-            mocked_copy.assert_called_once()
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            with mock.patch("tempfile.TemporaryDirectory") as mocked_tmpdir:
+                cli.write_output(ts, args)
+            mocked_tmpdir.assert_not_called()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.trees"
+            path.write_bytes(stdout.buffer.getvalue())
+            written = tskit.load(str(path))
+        self.assertEqual(written.num_provenances, ts.num_provenances + 1)
+        self.assertEqual(written.tables.nodes, ts.tables.nodes)
 
     def test_to_file(self):
         ts = msprime.simulate(10, random_seed=2)
         parser = cli.stdpopsim_cli_parser()
         output_file = "mocked.trees"
         args = parser.parse_args(["homsap", "2", "-o", output_file])
-        with mock.patch("tskit.TreeSequence.dump") as mocked_dump:
+        with mock.patch("stdpopsim.storage.dump") as mocked_dump:
+            cli.write_output(ts, args)
+            mocked_dump.assert_called_once()
+            self.assertEqual(mocked_dump.call_args[0][:2], (ts, output_file))
+
+    def test_provenance(self):
+        ts = msprime.simulate(10, random_seed=2)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = str(pathlib.Path(tmpdir) / "out.trees")
+            parser = cli.stdpopsim_cli_parser()
+            args = parser.parse_args(["homsap", "2", "-o", output_file])
+            cli.write_output(ts, args)
+            written = tskit.load(output_file)
+        self.assertEqual(written.num_provenances, ts.num_provenances + 1)
+        record = json.loads(written.provenance(ts.num_provenances).record)
+        tskit.validate_provenance(record)
+        self.assertEqual(record["software"]["name"], "stdpopsim")
+        tables = written.dump_tables()
+        tables.provenances.truncate(ts.num_provenances)
+        self.assertEqual(tables, ts.tables)
+
+    def test_compression(self):
+        ts = msprime.simulate(10, random_seed=2)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = str(pathlib.Path(tmpdir) / "out.trees.sz")
+            parser = cli.stdpopsim_cli_parser()
+            args = parser.parse_args(
+                ["homsap", "2", "-o", output_file, "--compression", "zlib"])
             cli.write_output(ts, args)
-            mocked_dump.assert_called_once_with(output_file)
+            with self.assertRaises(tskit.FileFormatError):
+                tskit.load(output_file)
+            written = storage.load(output_file)
+        self.assertEqual(written.num_provenances, ts.num_provenances + 1)
+        self.assertEqual(written.tables.edges, ts.tables.edges)
 
 
 class TestRedirection(unittest.TestCase):
@@ -330,6 +912,34 @@ class TestRedirection(unittest.TestCase):
         cmd = "homsap -q -s 2 10 -c chr22 -l 0.001"
         self.verify(cmd)
 
+    def test_compression(self):
+        cmd = f"{sys.executable} -m stdpopsim homsap -q -s 2 10 -c chr22 -l 0.001"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename1 = pathlib.Path(tmpdir) / "output1.trees"
+            subprocess.run(
+                f"{cmd} -o {filename1}", shell=True, check=True,
+                stderr=subprocess.PIPE)
+            filename2 = pathlib.Path(tmpdir) / "output2.trees"
+            with open(filename2, "wb") as output:
+                subprocess.run(
+                    f"{cmd} --compression lzma", shell=True, check=True,
+                    stdout=output, stderr=subprocess.PIPE)
+            tables1 = tskit.load(filename1).dump_tables()
+            tables2 = storage.load(filename2).dump_tables()
+        tables1.provenances.clear()
+        tables2.provenances.clear()
+        self.assertEqual(tables1, tables2)
+
+    def test_pipe(self):
+        # The output can be read directly from a pipe, without being seekable.
+        cmd = f"{sys.executable} -m stdpopsim homsap -q -s 2 10 -c chr22 -l 0.001"
+        with subprocess.Popen(
+                cmd, shell=True, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE) as process:
+            ts = tskit.load(process.stdout)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(ts.num_samples, 10)
+
     def test_no_quiet(self):
         cmd = "homsap -s 3 10 -c chr22 -l 0.001"
         self.verify(cmd)
@@ -407,6 +1017,10 @@ class TestErrors(unittest.TestCase):
     def test_browning_america(self):
         self.verify_bad_samples("homsap -q -m america 2 3 4 5 6")
 
+    def test_bad_msprime_change_model(self):
+        self.verify_bad_samples(
+            "--msprime-change-model hudson 10 homsap -q -l 0.001 2")
+
 
 class TestHelp(unittest.TestCase):
 
@@ -618,3 +1232,1062 @@ class TestSearchWrappers(unittest.TestCase):
             cli.get_genetic_map_wrapper(species, "XXX")
             mocked_exit.assert_called_once_with(
                 "Genetic map 'homsap/XXX' not in catalog")
+
+
+class TestResourceLimitArguments(unittest.TestCase):
+    """
+    Tests for the resource limit arguments.
+    """
+    def test_defaults(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertEqual(args.max_time, None)
+        self.assertEqual(args.max_memory, None)
+
+    def test_limits(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(
+            "homsap 2 --max-time 3600 --max-memory 4G".split())
+        self.assertEqual(args.max_time, 3600)
+        self.assertEqual(args.max_memory, 4 * 2**30)
+
+    def test_memory_size(self):
+        self.assertEqual(cli.memory_size("1000"), 1000)
+        self.assertEqual(cli.memory_size("2k"), 2048)
+        self.assertEqual(cli.memory_size("512M"), 512 * 2**20)
+        self.assertEqual(cli.memory_size("1.5G"), 3 * 2**29)
+        self.assertEqual(cli.memory_size("1T"), 2**40)
+        for bad_value in ["", "G", "XG", "-1G", "0"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cli.memory_size(bad_value)
+
+    @mock.patch("stdpopsim.cli.setup_logging")
+    def test_limit_exceeded(self, mock_setup_logging):
+        cmd = "homsap -q -c chr1 1000 --max-time 0.5 -o x.trees"
+        with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                cli.stdpopsim_main(cmd.split())
+            mocked_exit.assert_called_once()
+            self.assertIn("time limit", mocked_exit.call_args[0][0])
+
+
+class TestProgressJson(unittest.TestCase):
+    """
+    Tests for writing phase timings and progress as JSON.
+    """
+    def test_defaults(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertEqual(args.progress_json, None)
+        self.assertEqual(args.progress_interval, 10)
+        self.assertEqual(cli.get_observer(args), (None, None))
+
+    def test_end_to_end(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / "output.trees"
+            progress_file = pathlib.Path(tmpdir) / "progress.json"
+            cmd = (
+                f"homsap -c chr22 -l0.01 10 -q -o {filename} "
+                f"--progress-json {progress_file} --progress-interval 0.001")
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+            self.assertEqual(len(stdout), 0)
+            self.assertEqual(len(stderr), 0)
+            with open(progress_file) as f:
+                records = [json.loads(line) for line in f]
+        phases = [
+            record["phase"] for record in records
+            if record["event"] == "phase_finished"]
+        self.assertEqual(
+            phases, ["model", "contig", "simulate", "provenance", "write"])
+        for record in records:
+            self.assertIn(
+                record["event"], ["phase_started", "phase_finished", "progress"])
+
+    def test_stderr(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / "output.trees"
+            cmd = f"homsap -c chr22 -l0.001 10 -q -o {filename} --progress-json -"
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                stdout, stderr = capture_output(cli.stdpopsim_main, cmd.split())
+        self.assertEqual(len(stdout), 0)
+        records = [json.loads(line) for line in stderr.splitlines()]
+        self.assertEqual(len(records), 10)
+
+    def test_closed_on_error(self):
+        files = []
+        observer_class = stdpopsim.JsonObserver
+
+        def json_observer(file, **kwargs):
+            files.append(file)
+            return observer_class(file, **kwargs)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            progress_file = pathlib.Path(tmpdir) / "progress.json"
+            cmd = f"homsap -c chr22 -l0.001 10 10 -q --progress-json {progress_file}"
+            with mock.patch("stdpopsim.cli.setup_logging"), \
+                    mock.patch("stdpopsim.JsonObserver", side_effect=json_observer), \
+                    mock.patch("stdpopsim.cli.exit", side_effect=TestException):
+                with self.assertRaises(TestException):
+                    cli.stdpopsim_main(cmd.split())
+            self.assertTrue(files[0].closed)
+            with open(progress_file) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]["event"], "phase_started")
+
+
+class TestEngineSelection(unittest.TestCase):
+    """
+    Tests for selecting the simulation engine before building the parser.
+    """
+    def test_get_engine_id(self):
+        self.assertEqual(cli.get_engine_id(["homsap", "2"]), "msprime")
+        self.assertEqual(cli.get_engine_id(["-e", "xyz", "homsap", "2"]), "xyz")
+        self.assertEqual(
+            cli.get_engine_id(["--engine", "xyz", "homsap", "-c", "chr1", "2"]),
+            "xyz")
+
+    def test_bad_engine(self):
+        with mock.patch(
+                "argparse.ArgumentParser.exit",
+                side_effect=TestException) as mocked_exit:
+            with self.assertRaises(TestException):
+                capture_output(cli.stdpopsim_main, ["-e", "XXX", "homsap", "2"])
+            mocked_exit.assert_called_once()
+
+
+class TestLazySpeciesParser(unittest.TestCase):
+    """
+    Tests for only building the subparser of the species being simulated.
+    """
+    def test_get_species_id(self):
+        self.assertEqual(cli.get_species_id(["homsap", "2"]), "homsap")
+        self.assertEqual(cli.get_species_id(["homsap", "-h"]), "homsap")
+        self.assertEqual(
+            cli.get_species_id(["-v", "-c", "x", "dromel", "-c", "chr2L", "2"]),
+            "dromel")
+        self.assertIsNone(cli.get_species_id(["download-genetic-maps", "homsap"]))
+        self.assertIsNone(cli.get_species_id(["calibrate-estimator", "--quick"]))
+
+    def test_top_level_help(self):
+        full = io.StringIO()
+        cli.stdpopsim_cli_parser().print_help(full)
+        lazy = io.StringIO()
+        cli.stdpopsim_cli_parser(species_ids=[]).print_help(lazy)
+        self.assertEqual(full.getvalue(), lazy.getvalue())
+        for species in stdpopsim.all_species():
+            self.assertIn(species.id, lazy.getvalue())
+
+    def test_placeholder_arguments(self):
+        parser = cli.stdpopsim_cli_parser(species_ids=["homsap"])
+        args = parser.parse_args(["homsap", "2", "-c", "chr22"])
+        self.assertEqual(args.chromosome, "chr22")
+        with mock.patch(
+                "argparse.ArgumentParser.exit", side_effect=TestException):
+            with self.assertRaises(TestException):
+                capture_output(parser.parse_args, ["dromel", "2"])
+
+    def test_main_builds_one_species(self):
+        with mock.patch(
+                "stdpopsim.cli.add_simulate_species_parser",
+                wraps=cli.add_simulate_species_parser) as mocked_add:
+            with mock.patch("stdpopsim.cli.run") as mocked_run:
+                cli.stdpopsim_main(["dromel", "-c", "chr2L", "2"])
+        mocked_add.assert_called_once()
+        self.assertEqual(mocked_add.call_args[0][1].id, "dromel")
+        args = mocked_run.call_args[0][0]
+        self.assertEqual(args.species, "dromel")
+        self.assertEqual(args.chromosome, "chr2L")
+
+    def test_main_other_subcommand(self):
+        with mock.patch(
+                "stdpopsim.cli.add_simulate_species_parser") as mocked_add:
+            with mock.patch("stdpopsim.cli.run") as mocked_run:
+                cli.stdpopsim_main(["download-genetic-maps", "homsap"])
+        mocked_add.assert_not_called()
+        self.assertEqual(mocked_run.call_args[0][0].species, "homsap")
+
+
+class TestDeferredImports(unittest.TestCase):
+    """
+    Tests that commands which do not run simulations do not import the
+    simulation dependencies.
+    """
+    def get_imported(self, arg_list):
+        # Use a new interpreter, as the modules are already imported here.
+        script = (
+            "import sys, stdpopsim.cli\n"
+            "try:\n"
+            f"    stdpopsim.cli.stdpopsim_main({arg_list!r})\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "modules = ['msprime', 'tskit', 'numpy', 'humanize']\n"
+            "print('imports:', *[m for m in modules if m in sys.modules])\n")
+        result = subprocess.run(
+            [sys.executable, "-c", script], check=True, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        return result.stdout.splitlines()[-1].split()[1:]
+
+    def test_fast_paths(self):
+        for arg_list in [["--version"], ["--help"], ["download-genetic-maps", "-h"]]:
+            self.assertEqual(self.get_imported(arg_list), [], arg_list)
+
+    def test_species_help(self):
+        self.assertIn("msprime", self.get_imported(["homsap", "--help-models"]))
+
+    def test_compression_choices(self):
+        # The choices are not taken from stdpopsim.storage, to avoid
+        # importing it when building the parser.
+        parser = cli.stdpopsim_cli_parser()
+        for codec in storage.COMPRESSION_CODECS:
+            args = parser.parse_args(["homsap", "2", "--compression", codec])
+            self.assertEqual(args.compression, codec)
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Tests for running batches of simulations listed in a file.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir_path = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_tsv(self, rows):
+        path = self.tmpdir_path / "jobs.tsv"
+        with open(path, "w") as f:
+            for row in rows:
+                print(*row, sep="\t", file=f)
+        return path
+
+    def read_summary(self, path):
+        with open(path) as f:
+            lines = [line.rstrip("\n").split("\t") for line in f]
+        header = lines[0]
+        return [dict(zip(header, line)) for line in lines[1:]]
+
+    def run_batch(self, arg_list, expect_failure=False):
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            if expect_failure:
+                with self.assertRaises(SystemExit):
+                    cli.stdpopsim_main(arg_list)
+            else:
+                cli.stdpopsim_main(arg_list)
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["batch", "jobs.tsv"])
+        self.assertEqual(args.jobs_file, "jobs.tsv")
+        self.assertEqual(args.jobs, 1)
+        self.assertIsNone(args.summary)
+        self.assertFalse(args.resume)
+        self.assertEqual(args.runner, cli.run_batch)
+        args = parser.parse_args(
+            ["-e", "msprime", "batch", "jobs.json", "-j", "4", "--summary", "x"])
+        self.assertEqual(args.engine, "msprime")
+        self.assertEqual(args.jobs, 4)
+        self.assertEqual(args.summary, "x")
+
+    def test_read_tsv(self):
+        path = self.write_tsv([
+            ["# A comment"],
+            ["species", "chromosome", "samples", "output", "seed"],
+            ["homsap", "chr22", "2,3", "a.trees", ""],
+            [],
+            ["dromel", "", "4", "b.trees", "5"],
+        ])
+        self.assertEqual(cli.read_batch_jobs(path), [
+            {"species": "homsap", "chromosome": "chr22", "samples": "2,3",
+             "output": "a.trees"},
+            {"species": "dromel", "samples": "4", "output": "b.trees", "seed": "5"},
+        ])
+
+    def test_read_tsv_bad_columns(self):
+        path = self.write_tsv([["species", "output"], ["homsap", "a", "b"]])
+        with self.assertRaises(ValueError):
+            cli.read_batch_jobs(path)
+
+    def test_read_json(self):
+        jobs = [{"species": "homsap", "samples": [2, 3], "output": "a.trees"}]
+        path = self.tmpdir_path / "jobs.json"
+        with open(path, "w") as f:
+            json.dump(jobs, f)
+        self.assertEqual(cli.read_batch_jobs(path), jobs)
+        with open(path, "w") as f:
+            json.dump({"species": "homsap"}, f)
+        with self.assertRaises(ValueError):
+            cli.read_batch_jobs(path)
+
+    def test_job_arg_list(self):
+        arg_list = cli.get_batch_job_arg_list({
+            "species": "homsap", "model": "OutOfAfrica_3G09", "chromosome": "chr22",
+            "genetic_map": "HapMapII_GRCh37", "length_multiplier": "0.1",
+            "samples": "2, 3", "seed": 7, "output": "a.trees"})
+        self.assertEqual(arg_list, [
+            "homsap", "--quiet", "--output", "a.trees",
+            "--model", "OutOfAfrica_3G09", "--chromosome", "chr22",
+            "--genetic-map", "HapMapII_GRCh37", "--length-multiplier", "0.1",
+            "--seed", "7", "2", "3"])
+        arg_list = cli.get_batch_job_arg_list(
+            {"species": "homsap", "samples": [2, 3], "output": "a.trees"})
+        self.assertEqual(arg_list[-2:], ["2", "3"])
+
+    def test_job_arg_list_errors(self):
+        for job in [
+                {"samples": "2", "output": "a.trees"},
+                {"species": "homsap", "output": "a.trees"},
+                {"species": "homsap", "samples": "2"},
+                {"species": "homsap", "samples": "2", "output": "a", "xyz": "1"}]:
+            with self.assertRaises(ValueError):
+                cli.get_batch_job_arg_list(job)
+
+    def test_parse_job_inherits_top_level_options(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["-e", "msprime", "batch", "jobs.tsv"])
+        job_args = cli.parse_batch_job(
+            ["homsap", "--quiet", "--output", "a.trees", "-c", "chr22", "2"],
+            args, 3)
+        self.assertEqual(job_args.engine, "msprime")
+        self.assertEqual(job_args.chromosome, "chr22")
+        self.assertNotEqual(job_args.runner, cli.run_batch)
+        self.assertEqual(job_args.batch_job["index"], 3)
+        with self.assertRaises(ValueError):
+            cli.parse_batch_job(["homsap", "-c", "chrXYZ", "2"], args)
+        with self.assertRaises(ValueError):
+            cli.parse_batch_job(["nospecies", "2"], args)
+
+    def test_end_to_end(self):
+        rows = [["species", "chromosome", "length_multiplier", "samples", "seed",
+                 "output"]]
+        for j in range(3):
+            rows.append([
+                "homsap", "chr22", "0.001", "2", str(j + 1),
+                str(self.tmpdir_path / f"out{j}.trees")])
+        jobs_file = self.write_tsv(rows)
+        summary = self.tmpdir_path / "summary.tsv"
+        for num_jobs in [1, 2]:
+            self.run_batch(
+                ["batch", str(jobs_file), "-j", str(num_jobs),
+                 "--summary", str(summary)])
+            results = self.read_summary(summary)
+            self.assertEqual(len(results), 3)
+            for j, result in enumerate(results):
+                self.assertEqual(result["job"], str(j))
+                self.assertEqual(result["status"], "ok")
+                self.assertEqual(result["error"], "")
+                self.assertGreater(float(result["wall_time"]), 0)
+                ts = tskit.load(str(self.tmpdir_path / f"out{j}.trees"))
+                self.assertEqual(ts.num_samples, 2)
+                provenance = json.loads(ts.provenance(ts.num_provenances - 1).record)
+                batch_job = provenance["parameters"]["batch_job"]
+                self.assertEqual(batch_job["index"], j)
+                self.assertIn("--seed", batch_job["args"])
+
+    def test_resume(self):
+        rows = [["species", "chromosome", "length_multiplier", "samples", "seed",
+                 "output"]]
+        for j in range(3):
+            rows.append([
+                "homsap", "chr22", "0.001", "2", str(j + 1),
+                str(self.tmpdir_path / f"out{j}.trees")])
+        rows.append(["homsap", "chrXYZ", "0.001", "2", "1", "bad.trees"])
+        jobs_file = self.write_tsv(rows)
+        summary = self.tmpdir_path / "summary.tsv"
+        self.run_batch(
+            ["batch", str(jobs_file), "--summary", str(summary), "--resume"],
+            expect_failure=True)
+        journal_path = self.tmpdir_path / "jobs.batch.journal"
+        self.assertEqual(cli.get_batch_journal_path(jobs_file), str(journal_path))
+        records = cli.read_journal(journal_path)
+        self.assertEqual([record["job"] for record in records], [0, 1, 2])
+        for j, record in enumerate(records):
+            self.assertEqual(record["event"], "completed")
+            self.assertEqual(record["seed"], j + 1)
+            self.assertEqual(
+                record["outputs"], [str(self.tmpdir_path / f"out{j}.trees")])
+        self.assertEqual(
+            [path.name for path in self.tmpdir_path.iterdir()
+             if path.name.startswith(".")], [])
+
+        # Only the jobs that are not complete are run again.
+        (self.tmpdir_path / "out1.trees").unlink()
+        rows[3][4] = "10"
+        jobs_file = self.write_tsv(rows)
+        self.run_batch(
+            ["batch", str(jobs_file), "--summary", str(summary), "--resume"],
+            expect_failure=True)
+        results = self.read_summary(summary)
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["skipped", "ok", "ok", "failed"])
+        records = cli.read_journal(journal_path)
+        self.assertEqual([record["job"] for record in records[3:]], [1, 2])
+        self.assertEqual(records[-1]["seed"], 10)
+        self.assertTrue((self.tmpdir_path / "out1.trees").exists())
+
+        # Without --resume, all of the jobs are run.
+        self.run_batch(
+            ["batch", str(jobs_file), "--summary", str(summary)],
+            expect_failure=True)
+        self.assertEqual(len(cli.read_journal(journal_path)), 8)
+
+    def test_resume_different_arguments(self):
+        rows = [
+            ["species", "chromosome", "length_multiplier", "samples", "seed", "output"],
+            ["homsap", "chr22", "0.001", "2", "1", str(self.tmpdir_path / "a.trees")]]
+        jobs_file = self.write_tsv(rows)
+        summary = self.tmpdir_path / "summary.tsv"
+        # The outputs are written atomically.
+        with mock.patch(
+                "stdpopsim.cli.write_atomic", wraps=cli.write_atomic) as write_atomic:
+            self.run_batch(["batch", str(jobs_file), "--summary", str(summary)])
+        write_atomic.assert_called_once()
+        self.assertEqual(
+            write_atomic.call_args[0][0], str(self.tmpdir_path / "a.trees"))
+        self.run_batch(
+            ["-e", "msprime", "batch", str(jobs_file), "--summary", str(summary),
+             "--resume", "-j", "2"])
+        self.assertEqual(self.read_summary(summary)[0]["status"], "skipped")
+        rows[1][2] = "0.002"
+        jobs_file = self.write_tsv(rows)
+        self.run_batch(
+            ["batch", str(jobs_file), "--summary", str(summary), "--resume"])
+        self.assertEqual(self.read_summary(summary)[0]["status"], "ok")
+
+    def test_failure_journal(self):
+        jobs = [
+            {"species": "homsap", "chromosome": "chr22", "length_multiplier": 0.001,
+             "samples": 2, "seed": 1,
+             "output": str(self.tmpdir_path / "nodir" / "c.trees")}]
+        jobs_file = self.tmpdir_path / "jobs.json"
+        with open(jobs_file, "w") as f:
+            json.dump(jobs, f)
+        summary = self.tmpdir_path / "summary.tsv"
+        self.run_batch(
+            ["batch", str(jobs_file), "--summary", str(summary)],
+            expect_failure=True)
+        records = cli.read_journal(self.tmpdir_path / "jobs.batch.journal")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["event"], "failed")
+        self.assertEqual(records[0]["job"], 0)
+        self.assertIn("nodir", records[0]["error"])
+
+    def test_failures(self):
+        jobs = [
+            {"species": "homsap", "chromosome": "chr22", "length_multiplier": 0.001,
+             "samples": 2, "seed": 1, "output": str(self.tmpdir_path / "a.trees")},
+            {"species": "homsap", "chromosome": "chrXYZ", "samples": 2,
+             "output": str(self.tmpdir_path / "b.trees")},
+            {"species": "homsap", "samples": 2},
+            {"species": "homsap", "chromosome": "chr22", "length_multiplier": 0.001,
+             "samples": 2, "seed": 1,
+             "output": str(self.tmpdir_path / "nodir" / "c.trees")},
+        ]
+        jobs_file = self.tmpdir_path / "jobs.json"
+        with open(jobs_file, "w") as f:
+            json.dump(jobs, f)
+        summary = self.tmpdir_path / "summary.tsv"
+        self.run_batch(
+            ["batch", str(jobs_file), "-j", "2", "--summary", str(summary)],
+            expect_failure=True)
+        results = self.read_summary(summary)
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["ok", "failed", "failed", "failed"])
+        self.assertIn("chrXYZ", results[1]["error"])
+        self.assertIn("output", results[2]["error"])
+        self.assertTrue((self.tmpdir_path / "a.trees").exists())
+
+    def test_summary_stderr(self):
+        jobs_file = self.write_tsv([["species", "samples", "output"]])
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            stdout, stderr = capture_output(
+                cli.stdpopsim_main, ["batch", str(jobs_file)])
+        self.assertEqual(stdout, "")
+        self.assertEqual(
+            stderr.splitlines(),
+            ["job\tspecies\toutput\tstatus\twall_time\terror"])
+
+    def test_missing_file(self):
+        with self.assertRaises(SystemExit):
+            self.run_batch(["batch", str(self.tmpdir_path / "nofile.tsv")])
+
+
+class TestServe(unittest.TestCase):
+    """
+    Tests for the serve subcommand. The server itself is tested in
+    test_server.py.
+    """
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["serve"])
+        self.assertEqual(args.host, "127.0.0.1")
+        self.assertEqual(args.port, 8000)
+        self.assertIsNone(args.socket)
+        self.assertEqual(args.workers, 1)
+        self.assertEqual(args.max_queue, 16)
+        self.assertEqual(args.runner, cli.run_serve)
+        args = parser.parse_args(
+            "serve --port 0 --workers 4 --max-queue 2 --cache-size 8".split())
+        self.assertEqual(args.port, 0)
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.max_queue, 2)
+        self.assertEqual(args.cache_size, 8)
+
+    def test_interrupt(self):
+        with mock.patch(
+                "stdpopsim.server.SimulationServer.serve_forever",
+                side_effect=KeyboardInterrupt):
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                capture_output(
+                    cli.stdpopsim_main, ["-e", "msprime", "serve", "--port", "0"])
+
+    def test_bad_workers(self):
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            with self.assertRaises(SystemExit):
+                cli.stdpopsim_main(["serve", "--workers", "0"])
+
+
+class TestProfile(unittest.TestCase):
+    """
+    Tests for the --profile option.
+    """
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertIsNone(args.profile)
+        self.assertEqual(args.profile_output, "-")
+        self.assertIsNone(args.profiler)
+        args = parser.parse_args(
+            ["--profile", "both", "--profile-output", "x", "homsap", "2"])
+        self.assertEqual(args.profile, "both")
+        self.assertEqual(args.profile_output, "x")
+
+    def test_get_profiler(self):
+        self.assertIsNone(cli.get_profiler(["homsap", "2"]))
+        self.assertIsNone(cli.get_profiler(["--profile", "xyz", "homsap", "2"]))
+        for mode, cpu, memory in [
+                ("cpu", True, False), ("mem", False, True), ("both", True, True)]:
+            profiler = cli.get_profiler(["-v", "--profile", mode, "homsap", "2"])
+            self.assertEqual(profiler.cpu, cpu)
+            self.assertEqual(profiler.memory, memory)
+
+    def test_get_observer(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        args.profiler = stdpopsim.ProfilingObserver()
+        observer, progress_file = cli.get_observer(args)
+        self.assertIs(observer, args.profiler)
+        self.assertIsNone(progress_file)
+        args = parser.parse_args(["homsap", "2", "--progress-json", "-"])
+        args.profiler = stdpopsim.ProfilingObserver()
+        observer, progress_file = cli.get_observer(args)
+        self.assertIsInstance(observer, stdpopsim.ObserverGroup)
+        self.assertIs(observer.observers[0], args.profiler)
+        self.assertIs(progress_file, sys.stderr)
+
+    def test_end_to_end(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            for mode in cli.PROFILE_MODES:
+                report = tmpdir / f"{mode}.txt"
+                with mock.patch("stdpopsim.cli.setup_logging"):
+                    cli.stdpopsim_main([
+                        "--profile", mode, "--profile-output", str(report),
+                        "homsap", "-c", "chr22", "-l", "0.001", "-s", "1", "-q",
+                        "-o", str(tmpdir / "out.trees"), "2"])
+                with open(report) as f:
+                    lines = f.read().splitlines()
+                table = (lines + [""])[1:(lines + [""]).index("")]
+                phases = [line.split()[0] for line in table]
+                self.assertEqual(phases, [
+                    "other", "parse", "model", "contig", "simulate",
+                    "provenance", "write"])
+                self.assertEqual(
+                    any(line.startswith("# CPU profile") for line in lines),
+                    mode != "mem")
+                self.assertEqual("memory_peak" in lines[0], mode != "cpu")
+                self.assertEqual(tskit.load(tmpdir / "out.trees").num_samples, 2)
+
+    def test_failure(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report = pathlib.Path(tmpdir) / "profile.txt"
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                with self.assertRaises(SystemExit):
+                    cli.stdpopsim_main([
+                        "--profile", "cpu", "--profile-output", str(report),
+                        "homsap", "-q", "-m", "ooa_3", "2", "2", "2", "2"])
+            with open(report) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(any(line.startswith("# CPU profile") for line in lines))
+            self.assertIn("model", [line.split()[0] for line in lines if line])
+
+    def test_stderr(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch("stdpopsim.cli.setup_logging"):
+                stdout, stderr = capture_output(cli.stdpopsim_main, [
+                    "--profile", "cpu", "homsap", "-c", "chr22", "-l", "0.001",
+                    "-q", "-o", str(pathlib.Path(tmpdir) / "out.trees"), "2"])
+        self.assertEqual(stdout, "")
+        self.assertTrue(stderr.startswith("phase"))
+        self.assertIn("# CPU profile: simulate", stderr)
+
+
+class TestMetricsJson(unittest.TestCase):
+    """
+    Tests for the --metrics-json option.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir_path = pathlib.Path(self.tmpdir.name)
+        self.metrics_file = self.tmpdir_path / "metrics.json"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_stdpopsim(self, arg_list):
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            cli.stdpopsim_main(
+                ["--metrics-json", str(self.metrics_file)] + arg_list)
+        with open(self.metrics_file) as f:
+            return json.load(f)
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertIsNone(args.metrics_json)
+        self.assertIsNone(args.metrics)
+        args = parser.parse_args(["--metrics-json", "x", "homsap", "2"])
+        self.assertEqual(args.metrics_json, "x")
+
+    def test_get_metrics(self):
+        self.assertIsNone(cli.get_metrics(["homsap", "2"]))
+        self.assertIsInstance(
+            cli.get_metrics(["--metrics-json", "x", "homsap", "2"]), cli.RunMetrics)
+
+    def test_get_random_seed(self):
+        ts = msprime.simulate(2, random_seed=1234)
+        self.assertEqual(cli.get_random_seed(ts), 1234)
+        tables = ts.dump_tables()
+        tables.provenances.clear()
+        self.assertIsNone(cli.get_random_seed(tables.tree_sequence()))
+
+    def test_end_to_end(self):
+        output = self.tmpdir_path / "out.trees"
+        record = self.run_stdpopsim([
+            "homsap", "-c", "chr22", "-l", "0.001", "-m", "ooa_3", "-s", "12",
+            "-q", "-o", str(output), "2", "3"])
+        self.assertEqual(record["status"], "ok")
+        self.assertIsNone(record["error"])
+        self.assertEqual(record["species"], "homsap")
+        self.assertEqual(record["engine"], "msprime")
+        self.assertEqual(record["engine_version"], msprime.__version__)
+        self.assertEqual(record["model"], "ooa_3")
+        self.assertEqual(record["chromosome"], "chr22")
+        self.assertEqual(record["samples"], [2, 3])
+        self.assertEqual(record["seed"], 12)
+        self.assertEqual(record["args"][0], "--metrics-json")
+        self.assertGreater(record["wall_time"], 0)
+        self.assertGreater(record["cpu_time"], 0)
+        self.assertGreater(record["peak_rss"], 0)
+        self.assertEqual(list(record["phases"].keys()), [
+            "parse", "model", "contig", "simulate", "provenance", "write"])
+        for phase in record["phases"].values():
+            self.assertEqual(phase["count"], 1)
+            self.assertGreaterEqual(phase["wall_time"], 0)
+            self.assertGreaterEqual(phase["cpu_time"], 0)
+        self.assertEqual(len(record["outputs"]), 1)
+        ts = tskit.load(output)
+        metrics = record["outputs"][0]
+        # The written tree sequence has an additional provenance record.
+        nbytes = metrics.pop("nbytes")
+        self.assertGreater(nbytes, 0)
+        self.assertLess(nbytes, ts.nbytes)
+        self.assertEqual(metrics, {
+            "output": str(output), "replicate": None, "seed": 12,
+            "num_samples": 5, "num_nodes": ts.num_nodes,
+            "num_edges": ts.num_edges, "num_sites": ts.num_sites,
+            "num_mutations": ts.num_mutations, "num_trees": ts.num_trees,
+            "file_size": output.stat().st_size})
+
+    def test_compressed_output(self):
+        record = self.run_stdpopsim([
+            "homsap", "-c", "chr22", "-l", "0.001", "-s", "12", "-q",
+            "-o", str(self.tmpdir_path / "out.trees"), "--compression", "zlib", "2"])
+        output = self.tmpdir_path / "out.trees.sz"
+        metrics = record["outputs"][0]
+        self.assertEqual(metrics["output"], str(output))
+        self.assertEqual(metrics["file_size"], output.stat().st_size)
+
+    @unittest.skipIf(sys.platform != "linux", "Peak RSS of children only on Linux")
+    def test_simulation_peak_rss(self):
+        metrics = []
+
+        def get_metrics(arg_list):
+            metrics.append(cli.RunMetrics())
+            return metrics[-1]
+
+        with mock.patch("stdpopsim.cli.get_metrics", side_effect=get_metrics):
+            record = self.run_stdpopsim([
+                "homsap", "-c", "chr22", "-l", "0.001", "-s", "12", "-q",
+                "-o", str(self.tmpdir_path / "out.trees"), "--max-time", "600",
+                "2"])
+        self.assertEqual(metrics[0].progress_interval, 10)
+        self.assertGreater(metrics[0].simulation_peak_rss, 0)
+        self.assertGreaterEqual(
+            record["peak_rss_children"], metrics[0].simulation_peak_rss)
+
+    def test_replicates(self):
+        output = self.tmpdir_path / "out.trees"
+        record = self.run_stdpopsim([
+            "homsap", "-c", "chr22", "-l", "0.001", "-s", "12", "-q",
+            "-o", str(output), "4", "--replicates", "2", "--subsample", "2"])
+        self.assertEqual(record["phases"]["simulate"]["count"], 2)
+        self.assertEqual(record["phases"]["write"]["count"], 4)
+        outputs = record["outputs"]
+        self.assertEqual(
+            [(o["replicate"], o["num_samples"]) for o in outputs],
+            [(0, 4), (0, 2), (1, 4), (1, 2)])
+        for o in outputs:
+            self.assertEqual(o["seed"], cli.get_replicate_seed(12, o["replicate"]))
+            self.assertTrue(pathlib.Path(o["output"]).exists())
+
+    def test_random_seed(self):
+        output = self.tmpdir_path / "out.trees"
+        record = self.run_stdpopsim([
+            "homsap", "-c", "chr22", "-l", "0.001", "-q", "-o", str(output), "2"])
+        self.assertIsNone(record["seed"])
+        seed = record["outputs"][0]["seed"]
+        self.assertEqual(seed, cli.get_random_seed(tskit.load(output)))
+        self.assertIsNotNone(seed)
+
+    def test_failure(self):
+        with self.assertRaises(SystemExit):
+            self.run_stdpopsim(["homsap", "-q", "-m", "ooa_3", "2", "2", "2", "2"])
+        with open(self.metrics_file) as f:
+            record = json.load(f)
+        self.assertEqual(record["status"], "failed")
+        self.assertIn("Cannot sample from more than 3 populations", record["error"])
+        self.assertEqual(record["outputs"], [])
+
+    def test_parse_failure(self):
+        with mock.patch(
+                "argparse.ArgumentParser.exit", side_effect=TestException):
+            with self.assertRaises(TestException):
+                capture_output(
+                    cli.stdpopsim_main,
+                    ["--metrics-json", str(self.metrics_file), "homsap"])
+        self.assertFalse(self.metrics_file.exists())
+
+    def test_dry_run(self):
+        record = self.run_stdpopsim(["homsap", "-q", "--dry-run", "2"])
+        self.assertEqual(record["status"], "ok")
+        self.assertEqual(record["outputs"], [])
+        self.assertNotIn("simulate", record["phases"])
+
+    def test_other_subcommand(self):
+        jobs_file = self.tmpdir_path / "jobs.tsv"
+        with open(jobs_file, "w") as f:
+            print("species\tsamples\toutput", file=f)
+        record = self.run_stdpopsim(["batch", str(jobs_file)])
+        self.assertEqual(record["status"], "ok")
+        self.assertEqual(list(record["phases"].keys()), ["parse"])
+
+    def test_with_profile(self):
+        output = self.tmpdir_path / "out.trees"
+        record = self.run_stdpopsim([
+            "--profile", "cpu", "--profile-output", str(self.tmpdir_path / "p"),
+            "homsap", "-c", "chr22", "-l", "0.001", "-q", "-o", str(output),
+            "--progress-json", str(self.tmpdir_path / "progress.json"), "2"])
+        self.assertIn("simulate", record["phases"])
+        with open(self.tmpdir_path / "p") as f:
+            self.assertIn("# CPU profile: simulate", f.read())
+
+
+class TestVcfOutput(unittest.TestCase):
+    """
+    Tests for the --format vcf option.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir_path = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_stdpopsim(self, arg_list):
+        cmd = ["homsap", "-q", "-c", "chr22", "-l", "0.001", "-s", "2", "4"]
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            cli.stdpopsim_main(cmd + arg_list)
+
+    def get_expected_vcf(self):
+        output = self.tmpdir_path / "out.trees"
+        self.run_stdpopsim(["-o", str(output)])
+        vcf = io.StringIO()
+        tskit.load(str(output)).write_vcf(vcf, contig_id="chr22")
+        return vcf.getvalue()
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertEqual(args.format, "trees")
+        args = parser.parse_args(
+            ["homsap", "2", "--format", "vcf", "--compression", "bgzip"])
+        self.assertEqual(args.format, "vcf")
+        self.assertEqual(args.compression, "bgzip")
+
+    def test_file(self):
+        output = self.tmpdir_path / "out.vcf"
+        self.run_stdpopsim(["--format", "vcf", "-o", str(output)])
+        self.assertEqual(output.read_text(), self.get_expected_vcf())
+
+    def test_stdout(self):
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            self.run_stdpopsim(["--format", "vcf"])
+        self.assertEqual(stdout.buffer.getvalue().decode(), self.get_expected_vcf())
+
+    def test_bgzip(self):
+        output = self.tmpdir_path / "out.vcf.gz"
+        self.run_stdpopsim(
+            ["--format", "vcf", "--compression", "bgzip", "-o", str(output)])
+        with gzip.open(output, "rt") as f:
+            self.assertEqual(f.read(), self.get_expected_vcf())
+        self.assertTrue(output.read_bytes().endswith(storage.BGZF_EOF))
+
+    def test_replicates(self):
+        output = self.tmpdir_path / "out.vcf.gz"
+        self.run_stdpopsim([
+            "--format", "vcf", "--compression", "bgzip", "-o", str(output),
+            "--replicates", "2"])
+        for j in range(2):
+            path = self.tmpdir_path / f"out_{j}.vcf.gz"
+            with gzip.open(path, "rt") as f:
+                self.assertTrue(f.readline().startswith("##fileformat=VCF"))
+
+    def test_bad_compression(self):
+        for arg_list in [
+                ["--compression", "bgzip"],
+                ["--format", "vcf", "--compression", "zlib"]]:
+            with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as e:
+                with self.assertRaises(TestException):
+                    self.run_stdpopsim(arg_list)
+                e.assert_called_once()
+
+    def test_split_output(self):
+        for output, expected in [
+                ("out.trees", ("out", ".trees")),
+                ("out.vcf.gz", ("out", ".vcf.gz")),
+                ("out.trees.sz", ("out", ".trees.sz")),
+                ("/a/b.c/out.gz", ("/a/b.c/out", ".gz")),
+                ("out", ("out", ""))]:
+            base, suffix = cli.split_output(output)
+            self.assertEqual((str(base), suffix), expected)
+        self.assertEqual(
+            cli.get_replicate_output("out.vcf.gz", 7, 10), "out_7.vcf.gz")
+        self.assertEqual(
+            cli.get_subsample_output("out.vcf.gz", [3]), "out_3.vcf.gz")
+
+    def test_compressed_output(self):
+        self.assertIsNone(cli.get_compressed_output(None))
+        self.assertEqual(cli.get_compressed_output("out.trees"), "out.trees.sz")
+        self.assertEqual(cli.get_compressed_output("out.trees.sz"), "out.trees.sz")
+        self.assertEqual(
+            cli.get_compressed_output(cli.get_replicate_output("out.trees.sz", 7, 10)),
+            "out_7.trees.sz")
+
+
+class TestGenotypesOutput(unittest.TestCase):
+    """
+    Tests for the --format npz option.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir_path = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_stdpopsim(self, arg_list):
+        cmd = [
+            "homsap", "-q", "-c", "chr22", "-l", "0.001", "-s", "2",
+            "-m", "ooa_3", "2", "0", "3"]
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            cli.stdpopsim_main(cmd + arg_list)
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertEqual(args.chunk_size, 10000)
+        args = parser.parse_args(["homsap", "2", "--format", "npz", "--chunk-size", "5"])
+        self.assertEqual(args.format, "npz")
+        self.assertEqual(args.chunk_size, 5)
+
+    def test_end_to_end(self):
+        trees = self.tmpdir_path / "out.trees"
+        self.run_stdpopsim(["-o", str(trees)])
+        ts = tskit.load(str(trees))
+        self.assertGreater(ts.num_sites, 0)
+        output = self.tmpdir_path / "out.npz"
+        self.run_stdpopsim([
+            "--format", "npz", "--compression", "zlib", "--chunk-size", "3",
+            "-o", str(output)])
+        with np.load(output) as data:
+            self.assertEqual(list(data["population_names"]), ["YRI", "CEU", "CHB"])
+            self.assertEqual(list(data["sample_populations"]), [0, 0, 2, 2, 2])
+            self.assertTrue(np.array_equal(data["positions"], ts.tables.sites.position))
+            chunks = [data[key] for key in sorted(
+                (key for key in data.keys() if key.startswith("genotypes")),
+                key=lambda key: int(key.split("_")[1]))]
+        self.assertEqual(chunks[0].shape, (3, 5))
+        self.assertTrue(np.array_equal(np.concatenate(chunks), ts.genotype_matrix()))
+
+    def test_get_population_names(self):
+        model = stdpopsim.get_species("homsap").get_model("ooa_3")
+        ts = msprime.simulate(2, random_seed=1)
+        self.assertIsNone(cli.get_population_names(ts))
+        self.assertIsNone(cli.get_population_names(ts, model))
+        ts = msprime.simulate(
+            population_configurations=[
+                msprime.PopulationConfiguration(2) for _ in range(3)],
+            migration_matrix=np.ones((3, 3)) - np.eye(3), random_seed=1)
+        self.assertEqual(
+            cli.get_population_names(ts, model), ["YRI", "CEU", "CHB"])
+
+    def test_stdout(self):
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            self.run_stdpopsim(["--format", "npz"])
+        stdout.buffer.seek(0)
+        with np.load(stdout.buffer) as data:
+            self.assertEqual(data["genotypes_0"].shape[1], 5)
+
+    def test_errors(self):
+        for arg_list in [
+                ["--format", "npz", "--compression", "bgzip"],
+                ["--format", "npz", "--chunk-size", "0"]]:
+            with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as e:
+                with self.assertRaises(TestException):
+                    self.run_stdpopsim(arg_list)
+                e.assert_called_once()
+
+
+class TestStats(unittest.TestCase):
+    """
+    Tests for the --stats option.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir_path = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_stdpopsim(self, arg_list):
+        cmd = [
+            "homsap", "-q", "-c", "chr22", "-l", "0.001", "-s", "2",
+            "-m", "ooa_3", "4", "0", "3"]
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            cli.stdpopsim_main(cmd + arg_list)
+
+    def read_table(self, path):
+        with open(path) as f:
+            return [line.split("\t") for line in f.read().splitlines()]
+
+    def test_parser(self):
+        parser = cli.stdpopsim_cli_parser()
+        args = parser.parse_args(["homsap", "2"])
+        self.assertIsNone(args.stats)
+        self.assertEqual(args.windows, 1)
+        self.assertEqual(args.stats_threads, 1)
+        args = parser.parse_args(
+            ["homsap", "2", "--stats", "x", "--windows", "10", "--stats-threads", "4"])
+        self.assertEqual(args.stats, "x")
+        self.assertEqual(args.windows, 10)
+        self.assertEqual(args.stats_threads, 4)
+
+    def test_stats_only(self):
+        stats_file = self.tmpdir_path / "stats.tsv"
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch("sys.stdout", stdout):
+            self.run_stdpopsim(["--stats", str(stats_file), "--windows", "3"])
+        self.assertEqual(stdout.buffer.getvalue(), b"")
+        rows = self.read_table(stats_file)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][:7], [
+            "start", "end", "diversity_YRI", "diversity_CHB", "tajimas_d_YRI",
+            "tajimas_d_CHB", "fst_YRI_CHB"])
+        self.assertEqual(rows[1][0], "0")
+        self.assertTrue(all(len(row) == len(rows[0]) for row in rows))
+
+    def test_stats_and_output(self):
+        stats_file = self.tmpdir_path / "stats.tsv"
+        output = self.tmpdir_path / "out.trees"
+        self.run_stdpopsim(["--stats", str(stats_file), "-o", str(output)])
+        ts = tskit.load(str(output))
+        rows = self.read_table(stats_file)
+        diversity = ts.diversity(ts.samples(population=0))
+        self.assertAlmostEqual(float(rows[1][2]), diversity, places=5)
+
+    def test_stdout(self):
+        stdout = io.StringIO()
+        with mock.patch("sys.stdout", stdout):
+            self.run_stdpopsim(["--stats", "-", "--windows", "2"])
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("start\tend\tdiversity_YRI"))
+
+    def test_replicates(self):
+        stats_file = self.tmpdir_path / "stats.tsv"
+        output = self.tmpdir_path / "out.trees"
+        self.run_stdpopsim([
+            "--stats", str(stats_file), "-o", str(output), "--replicates", "2",
+            "--subsample", "2", "0", "1"])
+        for j in range(2):
+            for name in [f"stats_{j}.tsv", f"stats_{j}_2_0_1.tsv"]:
+                self.assertEqual(len(self.read_table(self.tmpdir_path / name)), 2)
+
+    def test_replicates_stats_only(self):
+        stats_file = self.tmpdir_path / "stats.tsv"
+        self.run_stdpopsim(["--stats", str(stats_file), "--replicates", "3"])
+        paths = [self.tmpdir_path / f"stats_{j}.tsv" for j in range(3)]
+        for path in paths:
+            self.assertEqual(len(self.read_table(path)), 2)
+        self.assertEqual(
+            sorted(self.tmpdir_path.iterdir()),
+            sorted(paths + [self.tmpdir_path / "stats.journal"]))
+        records = cli.read_journals(stats_file)
+        self.assertEqual(
+            [record["outputs"] for record in records[1::2]],
+            [[str(path)] for path in paths])
+        # The journal of the statistics file is used to resume the run.
+        paths[1].unlink()
+        self.run_stdpopsim(["--stats", str(stats_file), "--replicates", "3", "--resume"])
+        records = cli.read_journals(stats_file)
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records[-1]["index"], 1)
+        self.assertTrue(paths[1].exists())
+
+    def test_metrics_phase(self):
+        metrics_file = self.tmpdir_path / "metrics.json"
+        stats_file = self.tmpdir_path / "stats.tsv"
+        with mock.patch("stdpopsim.cli.setup_logging"):
+            cli.stdpopsim_main([
+                "--metrics-json", str(metrics_file), "homsap", "-q", "-c", "chr22",
+                "-l", "0.001", "-s", "2", "--stats", str(stats_file), "4"])
+        with open(metrics_file) as f:
+            metrics = json.load(f)
+        self.assertIn("stats", metrics["phases"])
+        self.assertNotIn("write", metrics["phases"])
+
+    def test_errors(self):
+        for arg_list in [
+                ["--stats", "x", "--windows", "0"],
+                ["--stats", "x", "--stats-threads", "0"],
+                ["--stats", "-", "--replicates", "2", "-o", "x"]]:
+            with mock.patch("stdpopsim.cli.exit", side_effect=TestException) as e:
+                with self.assertRaises(TestException):
+                    self.run_stdpopsim(arg_list)
+                e.assert_called_once()
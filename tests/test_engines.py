@@ -2,6 +2,18 @@
 Tests for simulation engine infrastructure.
 """
 import unittest
+from unittest import mock
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import json
+import asyncio
+import concurrent.futures
+import time
+
+import msprime
 
 import stdpopsim
 
@@ -45,3 +57,728 @@ class TestEngine_API(unittest.TestCase):
         e = stdpopsim.Engine()
         self.assertRaises(NotImplementedError, e.simulate)
         self.assertRaises(NotImplementedError, e.get_version)
+
+
+class _PluginEngine(stdpopsim.Engine):
+    id = "plugin-engine"
+    name = "plugin"
+    citations = []
+
+
+class _EntryPoint(object):
+    """
+    Minimal stand-in for an installed entry point, which records whether
+    the object it refers to has been loaded.
+    """
+    def __init__(self, name, obj):
+        self.name = name
+        self.obj = obj
+        self.num_loads = 0
+
+    def load(self):
+        self.num_loads += 1
+        return self.obj
+
+
+class TestEnginePlugins(unittest.TestCase):
+    """
+    Tests for discovering engines through entry points.
+    """
+    def setUp(self):
+        self.saved_engines = dict(stdpopsim.engines._registered_engines)
+        stdpopsim.engines._engine_entry_points = None
+
+    def tearDown(self):
+        stdpopsim.engines._registered_engines.clear()
+        stdpopsim.engines._registered_engines.update(self.saved_engines)
+        stdpopsim.engines._engine_entry_points = None
+
+    def mock_entry_points(self, entry_points):
+        return mock.patch(
+            "stdpopsim.engines._iter_entry_points", return_value=entry_points)
+
+    def test_installed_entry_points(self):
+        # Any engine installed in this environment must be loadable.
+        for engine_id in stdpopsim.all_engine_ids():
+            engine = stdpopsim.get_engine(engine_id)
+            self.assertEqual(engine.id, engine_id)
+
+    def test_lazy_loading(self):
+        entry_point = _EntryPoint("plugin-engine", _PluginEngine)
+        with self.mock_entry_points([entry_point]):
+            self.assertIn("plugin-engine", stdpopsim.all_engine_ids())
+            self.assertIn("msprime", stdpopsim.all_engine_ids())
+            ids = [engine.id for engine in stdpopsim.all_engines(load=False)]
+            self.assertNotIn("plugin-engine", ids)
+            self.assertEqual(entry_point.num_loads, 0)
+            engine = stdpopsim.get_engine("plugin-engine")
+            self.assertIsInstance(engine, _PluginEngine)
+            self.assertEqual(entry_point.num_loads, 1)
+            self.assertEqual(stdpopsim.get_engine("plugin-engine"), engine)
+            self.assertEqual(entry_point.num_loads, 1)
+            ids = [engine.id for engine in stdpopsim.all_engines(load=False)]
+            self.assertIn("plugin-engine", ids)
+
+    def test_all_engines_loads(self):
+        entry_point = _EntryPoint("plugin-engine", _PluginEngine())
+        with self.mock_entry_points([entry_point]):
+            ids = [engine.id for engine in stdpopsim.all_engines()]
+            self.assertIn("plugin-engine", ids)
+            self.assertEqual(entry_point.num_loads, 1)
+
+    def test_registered_engine_takes_precedence(self):
+        entry_point = _EntryPoint("msprime", _PluginEngine)
+        with self.mock_entry_points([entry_point]):
+            self.assertEqual(stdpopsim.all_engine_ids().count("msprime"), 1)
+            engine = stdpopsim.get_engine("msprime")
+            self.assertEqual(engine, stdpopsim.get_default_engine())
+            self.assertEqual(entry_point.num_loads, 0)
+
+    def test_bad_entry_points(self):
+        entry_points = [
+            _EntryPoint("not-an-engine", object),
+            _EntryPoint("wrong-id", _PluginEngine)]
+        with self.mock_entry_points(entry_points):
+            for entry_point in entry_points:
+                with self.assertRaises(ValueError):
+                    stdpopsim.get_engine(entry_point.name)
+
+
+class TestMsprimeEngine(unittest.TestCase):
+    """
+    Tests for the msprime specific simulation options.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_engine("msprime")
+        self.species = stdpopsim.get_species("homsap")
+        self.contig = self.species.get_contig("chr22", length_multiplier=0.001)
+        self.model = stdpopsim.PiecewiseConstantSize(self.species.population_size)
+        self.samples = self.model.get_samples(10)
+
+    def simulate(self, **kwargs):
+        return self.engine.simulate(
+            model=self.model, contig=self.contig, samples=self.samples,
+            seed=1, **kwargs)
+
+    def test_supported_models(self):
+        for msprime_model in self.engine.supported_models:
+            ts = self.simulate(msprime_model=msprime_model)
+            self.assertEqual(ts.num_samples, 10)
+
+    def test_default_model(self):
+        ts1 = self.simulate()
+        ts2 = self.simulate(msprime_model="hudson")
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+
+    def test_bad_model(self):
+        for bad_model in ["", "XXX", "Hudson"]:
+            with self.assertRaises(ValueError):
+                self.simulate(msprime_model=bad_model)
+
+    def test_change_model(self):
+        ts = self.simulate(
+            msprime_model="dtwf", msprime_change_model=[(10, "hudson")])
+        self.assertEqual(ts.num_samples, 10)
+
+    def test_change_model_does_not_alter_model(self):
+        num_events = len(self.model.demographic_events)
+        self.simulate(msprime_change_model=[(10, "smc"), (1, "hudson")])
+        self.assertEqual(len(self.model.demographic_events), num_events)
+
+    def test_change_model_events_sorted(self):
+        model = self.species.get_model("ooa_3")
+        events = self.engine.get_demographic_events(
+            model, [(1e6, "hudson"), (10, "smc")])
+        self.assertEqual(len(events), len(model.demographic_events) + 2)
+        times = [event.time for event in events]
+        self.assertEqual(times, sorted(times))
+
+    def test_bad_change_model(self):
+        for bad_change in [[(10, "XXX")], [(-1, "hudson")], [("hudson", 10)]]:
+            with self.assertRaises(ValueError):
+                self.simulate(msprime_change_model=bad_change)
+
+
+class TestAutoEngine(unittest.TestCase):
+    """
+    Tests for the engine selecting the simulation model by problem size.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_engine("auto")
+        self.species = stdpopsim.get_species("homsap")
+        self.contig = self.species.get_contig("chr22", length_multiplier=0.001)
+        self.model = stdpopsim.PiecewiseConstantSize(1000)
+
+    def test_registered(self):
+        self.assertIsInstance(self.engine, stdpopsim.AutoEngine)
+        self.assertIn("auto", stdpopsim.all_engine_ids())
+        self.assertEqual(
+            self.engine.citations, stdpopsim.get_engine("msprime").citations)
+        self.assertEqual(self.engine.get_version(), msprime.__version__)
+
+    def test_select_hudson(self):
+        selection = self.engine.select(
+            self.model, self.contig, self.model.get_samples(10))
+        self.assertEqual(selection["engine"], "msprime")
+        self.assertEqual(
+            selection["options"],
+            {"msprime_model": "hudson", "msprime_change_model": None})
+        self.assertEqual(selection["num_samples"], 10)
+        self.assertEqual(selection["min_sampled_population_size"], 1000)
+        self.assertAlmostEqual(
+            selection["scaled_recombination"],
+            4 * 1000 * self.contig.recombination_map.get_total_recombination_rate())
+
+    def test_select_hybrid(self):
+        selection = self.engine.select(
+            self.model, self.contig, self.model.get_samples(101))
+        self.assertEqual(
+            selection["options"],
+            {"msprime_model": "dtwf", "msprime_change_model": [(100, "hudson")]})
+
+    def test_select_sampled_populations(self):
+        model = self.species.get_model("ooa_3")
+        sizes = [c.initial_size for c in model.population_configurations]
+        selection = self.engine.select(
+            model, self.contig, model.get_samples(0, 0, 10))
+        self.assertEqual(selection["min_sampled_population_size"], sizes[2])
+        selection = self.engine.select(
+            model, self.contig, model.get_samples(10, 10, 10))
+        self.assertEqual(selection["min_sampled_population_size"], min(sizes))
+
+    def test_select_smc(self):
+        selection = self.engine.select(
+            self.model, self.contig, self.model.get_samples(10))
+        rho = selection["scaled_recombination"]
+        engine = stdpopsim.AutoEngine(smc_min_scaled_recombination=rho)
+        selection = engine.select(self.model, self.contig, self.model.get_samples(10))
+        self.assertEqual(selection["options"]["msprime_model"], "smc_prime")
+        # The hybrid takes precedence for large samples.
+        selection = engine.select(self.model, self.contig, self.model.get_samples(200))
+        self.assertEqual(selection["options"]["msprime_model"], "dtwf")
+
+    def test_simulate(self):
+        samples = self.model.get_samples(200)
+        ts = self.engine.simulate(
+            model=self.model, contig=self.contig, samples=samples, seed=2,
+            msprime_model="smc")
+        expected = stdpopsim.get_engine("msprime").simulate(
+            model=self.model, contig=self.contig, samples=samples, seed=2,
+            msprime_model="dtwf", msprime_change_model=[(100, "hudson")])
+        self.assertEqual(ts.tables.nodes, expected.tables.nodes)
+        self.assertEqual(ts.tables.edges, expected.tables.edges)
+        # The selection is not added to the tree sequence.
+        self.assertEqual(ts.num_provenances, expected.num_provenances)
+
+    def test_get_selection(self):
+        samples = self.model.get_samples(200)
+        selection = self.engine.get_selection(
+            self.model, self.contig, samples, msprime_model="smc")
+        self.assertEqual(
+            selection, self.engine.select(self.model, self.contig, samples))
+
+    def test_get_selection_thresholds(self):
+        parameters = self.engine.get_selection(
+            self.model, self.contig, self.model.get_samples(10),
+            auto_dtwf_sample_fraction=0.001, auto_dtwf_generations=5)
+        self.assertEqual(
+            parameters["options"]["msprime_change_model"], [(5, "hudson")])
+        self.assertEqual(parameters["thresholds"]["dtwf_sample_fraction"], 0.001)
+        # The registered engine is not modified.
+        self.assertEqual(self.engine.dtwf_sample_fraction, 0.1)
+
+
+class TestSimulateNested(unittest.TestCase):
+    """
+    Tests for simulating nested sample configurations from one simulation.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_default_engine()
+        species = stdpopsim.get_species("homsap")
+        self.contig = species.get_contig("chr22", length_multiplier=0.001)
+        self.model = species.get_model("ooa_3")
+
+    def test_sample_sizes(self):
+        sample_sizes = [[2, 3], [10, 5, 4], [1], [10, 5, 4]]
+        ts_list = self.engine.simulate_nested(
+            model=self.model, contig=self.contig, sample_sizes=sample_sizes,
+            seed=2)
+        self.assertEqual(len(ts_list), len(sample_sizes))
+        for sizes, ts in zip(sample_sizes, ts_list):
+            self.assertEqual(ts.num_samples, sum(sizes))
+            self.assertEqual(ts.num_populations, self.model.num_populations)
+            for pop_index, n in enumerate(sizes):
+                self.assertEqual(len(ts.samples(population=pop_index)), n)
+
+    def test_nested(self):
+        full, sub = self.engine.simulate_nested(
+            model=self.model, contig=self.contig, sample_sizes=[[6, 2], [3]],
+            seed=3)
+        # The subsample is equivalent to simplifying the full simulation.
+        expected = full.simplify(samples=[0, 1, 2], filter_populations=False)
+        self.assertEqual(sub.tables.nodes, expected.tables.nodes)
+        self.assertEqual(sub.tables.edges, expected.tables.edges)
+        self.assertEqual(sub.tables.sites, expected.tables.sites)
+
+    def test_matches_simulate(self):
+        sample_sizes = [4, 2]
+        ts1, = self.engine.simulate_nested(
+            model=self.model, contig=self.contig, sample_sizes=[sample_sizes],
+            seed=4)
+        ts2 = self.engine.simulate(
+            model=self.model, contig=self.contig,
+            samples=self.model.get_samples(*sample_sizes), seed=4)
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+
+    def test_bad_sample_sizes(self):
+        for bad_sizes in [None, [], [[2, -1]]]:
+            with self.assertRaises(ValueError):
+                self.engine.simulate_nested(
+                    model=self.model, contig=self.contig, sample_sizes=bad_sizes)
+
+
+class TestPrepare(unittest.TestCase):
+    """
+    Tests for preparing simulations to run repeatedly.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_default_engine()
+        species = stdpopsim.get_species("homsap")
+        self.contig = species.get_contig("chr22", length_multiplier=0.001)
+        self.model = species.get_model("ooa_3")
+        self.samples = self.model.get_samples(4, 2, 2)
+
+    def assertTreeSequencesEqual(self, ts1, ts2):
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+        self.assertEqual(ts1.tables.sites, ts2.tables.sites)
+        self.assertEqual(ts1.tables.mutations, ts2.tables.mutations)
+
+    def test_matches_simulate(self):
+        prepared = self.engine.prepare(
+            model=self.model, contig=self.contig, samples=self.samples,
+            msprime_model="smc")
+        self.assertIsInstance(prepared, stdpopsim.PreparedSimulation)
+        for seed in [1, 2, 3]:
+            ts1 = prepared.run(seed)
+            ts2 = self.engine.simulate(
+                model=self.model, contig=self.contig, samples=self.samples,
+                msprime_model="smc", seed=seed)
+            self.assertTreeSequencesEqual(ts1, ts2)
+
+    def test_setup_not_repeated(self):
+        with mock.patch(
+                "msprime.Demography.from_old_style",
+                wraps=msprime.Demography.from_old_style) as from_old_style, \
+                mock.patch(
+                    "msprime.sim_ancestry", wraps=msprime.sim_ancestry) as sim_ancestry:
+            prepared = self.engine.prepare(
+                model=self.model, contig=self.contig, samples=self.samples)
+            for seed in [1, 2, 3]:
+                prepared.run(seed)
+        from_old_style.assert_called_once()
+        self.assertEqual(sim_ancestry.call_count, 3)
+        calls = sim_ancestry.call_args_list
+        demographies = {id(call[1]["demography"]) for call in calls}
+        rate_maps = {id(call[1]["recombination_rate"]) for call in calls}
+        self.assertEqual(len(demographies), 1)
+        self.assertEqual(len(rate_maps), 1)
+
+    def test_samples(self):
+        samples = self.model.get_samples(2, 0, 3)
+        ts = self.engine.prepare(
+            model=self.model, contig=self.contig, samples=samples).run(1)
+        self.assertEqual(
+            list(ts.tables.nodes.population[ts.samples()]), [0, 0, 2, 2, 2])
+
+    def test_samples_copied(self):
+        samples = list(self.samples)
+        prepared = self.engine.prepare(
+            model=self.model, contig=self.contig, samples=samples)
+        ts1 = prepared.run(5)
+        samples.clear()
+        ts2 = prepared.run(5)
+        self.assertTreeSequencesEqual(ts1, ts2)
+
+    def test_run_replicates(self):
+        prepared = self.engine.prepare(
+            model=self.model, contig=self.contig, samples=self.samples)
+        replicates = list(prepared.run_replicates(3, seed=6))
+        self.assertEqual(len(replicates), 3)
+        for ts in replicates:
+            self.assertEqual(ts.num_samples, len(self.samples))
+        self.assertNotEqual(replicates[0].tables.edges, replicates[1].tables.edges)
+        again = list(prepared.run_replicates(3, seed=6))
+        for ts1, ts2 in zip(replicates, again):
+            self.assertTreeSequencesEqual(ts1, ts2)
+
+    def test_bad_model(self):
+        with self.assertRaises(ValueError):
+            self.engine.prepare(
+                model=self.model, contig=self.contig, samples=self.samples,
+                msprime_model="XXX")
+        with self.assertRaises(ValueError):
+            self.engine.prepare(
+                model=self.model, contig=self.contig, samples=self.samples,
+                msprime_change_model=[(-1, "hudson")])
+
+    def test_observer(self):
+        observer = mock.Mock(spec=stdpopsim.SimulationObserver)
+        observer.progress_interval = None
+        prepared = self.engine.prepare(
+            model=self.model, contig=self.contig, samples=self.samples)
+        prepared.run(7, observer=observer)
+        observer.phase_started.assert_called_once_with(stdpopsim.PHASE_SIMULATE)
+
+    def test_default_prepare(self):
+        calls = []
+
+        class MyEngine(stdpopsim.Engine):
+            id = "test-prepare"
+            name = "test"
+            citations = []
+
+            def simulate(self, **kwargs):
+                calls.append(kwargs)
+                return kwargs["seed"]
+
+        prepared = MyEngine().prepare(
+            model=self.model, contig=self.contig, samples=self.samples,
+            option=1)
+        self.assertEqual(prepared.run(10), 10)
+        self.assertEqual(prepared.run(11), 11)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0]["model"], self.model)
+        self.assertEqual(calls[0]["option"], 1)
+        self.assertIsNone(calls[0]["observer"])
+
+
+# A stub external simulator, which records its input script and then writes
+# a known tree sequence to the output file (or stdout). The random seed in
+# the input script is used to select other behaviours.
+_STUB_SIMULATOR = """#!{python}
+import json
+import shutil
+import sys
+import time
+
+if sys.argv[1] == "--version":
+    print("stub 1.0")
+    sys.exit(0)
+with open(sys.argv[1]) as f:
+    script = json.load(f)
+with open("{script_copy}", "w") as f:
+    json.dump(script, f)
+if script["seed"] == 1:
+    print("Something went wrong", file=sys.stderr)
+    sys.exit(1)
+if script["seed"] == 2:
+    time.sleep(60)
+with open("{trees_file}", "rb") as source:
+    if script["seed"] == 3:
+        # Write part of the output, and then hang.
+        output = open(sys.argv[2], "wb") if len(sys.argv) > 2 else sys.stdout.buffer
+        output.write(source.read(100))
+        output.flush()
+        time.sleep(60)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "wb") as dest:
+            shutil.copyfileobj(source, dest)
+    else:
+        shutil.copyfileobj(source, sys.stdout.buffer)
+"""
+
+
+class TestExternalEngine(unittest.TestCase):
+    """
+    Tests for running simulations with an external program.
+    """
+    stream_output = False
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmpdir = pathlib.Path(self.tmpdir.name)
+        self.expected_ts = msprime.simulate(8, mutation_rate=1, random_seed=5)
+        trees_file = tmpdir / "expected.trees"
+        self.expected_ts.dump(str(trees_file))
+        self.script_copy = tmpdir / "script.json"
+        executable = tmpdir / "stub_simulator"
+        with open(executable, "w") as f:
+            f.write(_STUB_SIMULATOR.format(
+                python=sys.executable, script_copy=self.script_copy,
+                trees_file=trees_file))
+        os.chmod(executable, 0o755)
+
+        class StubEngine(stdpopsim.ExternalEngine):
+            id = "stub"
+            name = "stub"
+            citations = []
+            poll_interval = 0.01
+
+        StubEngine.executable = str(executable)
+        StubEngine.stream_output = self.stream_output
+        self.engine = StubEngine()
+        species = stdpopsim.get_species("homsap")
+        self.contig = species.get_contig("chr22")
+        self.model = stdpopsim.PiecewiseConstantSize(species.population_size)
+        self.samples = self.model.get_samples(4)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def simulate(self, seed=10, **kwargs):
+        return self.engine.simulate(
+            model=self.model, contig=self.contig, samples=self.samples,
+            seed=seed, **kwargs)
+
+    def test_output(self):
+        ts = self.simulate()
+        self.assertEqual(ts.tables, self.expected_ts.tables)
+
+    def test_script(self):
+        self.simulate(seed=1234)
+        with open(self.script_copy) as f:
+            script = json.load(f)
+        self.assertEqual(script["seed"], 1234)
+        self.assertEqual(script["mutation_rate"], self.contig.mutation_rate)
+        self.assertEqual(
+            script["recombination_map"]["positions"][-1],
+            self.contig.recombination_map.get_length())
+        self.assertEqual(
+            script["population_configurations"],
+            [{"initial_size": self.model.population_configurations[0].initial_size,
+              "growth_rate": 0}])
+        self.assertEqual(script["migration_matrix"], [[0]])
+        self.assertEqual(len(script["samples"]), 4)
+
+    def test_version(self):
+        self.assertEqual(self.engine.get_version(), "stub 1.0")
+
+    def test_error(self):
+        with self.assertRaises(stdpopsim.SimulationError) as cm:
+            self.simulate(seed=1)
+        self.assertIn("Something went wrong", str(cm.exception))
+
+    def test_timeout(self):
+        with self.assertRaises(stdpopsim.SimulationTimeoutError):
+            self.simulate(seed=2, timeout=0.5)
+
+    def test_cancel(self):
+        cancel_event = threading.Event()
+        timer = threading.Timer(0.5, cancel_event.set)
+        timer.start()
+        with self.assertRaises(stdpopsim.SimulationCancelledError):
+            self.simulate(seed=2, cancel_event=cancel_event)
+        timer.join()
+
+    def test_timeout_while_writing(self):
+        before = time.perf_counter()
+        with self.assertRaises(stdpopsim.SimulationTimeoutError):
+            self.simulate(seed=3, timeout=0.5)
+        self.assertLess(time.perf_counter() - before, 30)
+
+    def test_cancel_while_writing(self):
+        cancel_event = threading.Event()
+        timer = threading.Timer(0.5, cancel_event.set)
+        timer.start()
+        with self.assertRaises(stdpopsim.SimulationCancelledError):
+            self.simulate(seed=3, cancel_event=cancel_event)
+        timer.join()
+
+    def test_timeout_not_reached(self):
+        ts = self.simulate(timeout=60, cancel_event=threading.Event())
+        self.assertEqual(ts.tables, self.expected_ts.tables)
+
+
+class TestExternalEngineStreaming(TestExternalEngine):
+    """
+    Tests for running an external program writing to stdout.
+    """
+    stream_output = True
+
+
+@unittest.skipIf(sys.platform == "win32", "Resource limits not supported on Windows")
+class TestResourceLimits(unittest.TestCase):
+    """
+    Tests for running simulations with time and memory limits.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_default_engine()
+        self.species = stdpopsim.get_species("homsap")
+        self.model = stdpopsim.PiecewiseConstantSize(self.species.population_size)
+
+    def simulate(self, length_multiplier=0.001, num_samples=10, **kwargs):
+        contig = self.species.get_contig("chr1", length_multiplier=length_multiplier)
+        return self.engine.simulate(
+            model=self.model, contig=contig,
+            samples=self.model.get_samples(num_samples), seed=1, **kwargs)
+
+    def test_within_limits(self):
+        ts1 = self.simulate()
+        ts2 = self.simulate(max_time=600, max_memory=2**40)
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+        self.assertEqual(ts1.tables.sites, ts2.tables.sites)
+
+    def test_time_limit(self):
+        with self.assertRaises(stdpopsim.ResourceLimitError) as cm:
+            self.simulate(length_multiplier=1, num_samples=1000, max_time=0.5)
+        e = cm.exception
+        self.assertEqual(e.resource, "time")
+        self.assertEqual(e.limit, 0.5)
+        self.assertGreater(e.elapsed_time, 0.5)
+        self.assertIn("time limit", str(e))
+        if sys.platform == "linux":
+            self.assertGreater(e.peak_rss, 0)
+
+    def test_memory_limit(self):
+        max_memory = 50 * 2**20
+        with self.assertRaises(stdpopsim.ResourceLimitError) as cm:
+            self.simulate(
+                length_multiplier=1, num_samples=1000, max_memory=max_memory,
+                max_time=120)
+        e = cm.exception
+        self.assertEqual(e.resource, "memory")
+        self.assertEqual(e.limit, max_memory)
+        self.assertGreater(e.elapsed_time, 0)
+        self.assertIn("memory limit", str(e))
+
+    def test_errors_propagated(self):
+        with self.assertRaises(ValueError):
+            self.simulate(max_time=600, msprime_model="XXX")
+
+    def test_bad_limits(self):
+        for kwargs in [{"max_time": 0}, {"max_time": -1}, {"max_memory": 0}]:
+            with self.assertRaises(ValueError):
+                self.simulate(**kwargs)
+
+
+class _Tracker(object):
+    """
+    Records the maximum number of concurrently running simulations, and
+    whether any simulation was cancelled.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = threading.Event()
+
+
+def _sleeping_engine(tracker):
+    """
+    Returns an engine which sleeps until cancelled or the specified duration
+    has elapsed, reporting to the specified tracker.
+    """
+    class SleepingEngine(stdpopsim.Engine):
+        id = "sleeping"
+        name = "sleeping"
+        citations = []
+
+        def simulate(self, duration=0.1, cancel_event=None, **kwargs):
+            with tracker.lock:
+                tracker.running += 1
+                tracker.max_running = max(tracker.max_running, tracker.running)
+            try:
+                if cancel_event.wait(duration):
+                    tracker.cancelled.set()
+                    raise stdpopsim.SimulationCancelledError()
+            finally:
+                with tracker.lock:
+                    tracker.running -= 1
+            return duration
+
+    return SleepingEngine()
+
+
+class TestSimulateAsync(unittest.TestCase):
+    """
+    Tests for the asyncio simulation API.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.engine = stdpopsim.get_default_engine()
+        species = stdpopsim.get_species("homsap")
+        self.contig = species.get_contig("chr22", length_multiplier=0.001)
+        self.model = species.get_model("ooa_3")
+        self.samples = self.model.get_samples(5, 5)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def verify_simulate(self, executor=None):
+        ts1 = self.loop.run_until_complete(self.engine.simulate_async(
+            executor=executor, model=self.model, contig=self.contig,
+            samples=self.samples, seed=5))
+        ts2 = self.engine.simulate(
+            model=self.model, contig=self.contig, samples=self.samples, seed=5)
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+        self.assertEqual(ts1.tables.edges, ts2.tables.edges)
+
+    def test_default_executor(self):
+        self.verify_simulate()
+
+    def test_thread_pool(self):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            self.verify_simulate(executor)
+
+    def test_process_pool(self):
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            self.verify_simulate(executor)
+
+    def test_concurrent(self):
+        async def run():
+            return await asyncio.gather(*[
+                self.engine.simulate_async(
+                    model=self.model, contig=self.contig, samples=self.samples,
+                    seed=seed)
+                for seed in range(1, 5)])
+        ts_list = self.loop.run_until_complete(run())
+        self.assertEqual(len(ts_list), 4)
+        for ts in ts_list:
+            self.assertEqual(ts.num_samples, 10)
+
+    def test_semaphore(self):
+        tracker = _Tracker()
+        engine = _sleeping_engine(tracker)
+
+        async def run():
+            semaphore = asyncio.Semaphore(2)
+            return await asyncio.gather(*[
+                engine.simulate_async(semaphore=semaphore, duration=0.05)
+                for _ in range(6)])
+        with concurrent.futures.ThreadPoolExecutor(6) as executor:
+            self.loop.set_default_executor(executor)
+            results = self.loop.run_until_complete(run())
+        self.assertEqual(results, [0.05] * 6)
+        self.assertEqual(tracker.max_running, 2)
+
+    def test_cancel(self):
+        tracker = _Tracker()
+        engine = _sleeping_engine(tracker)
+
+        async def run():
+            task = asyncio.ensure_future(engine.simulate_async(duration=60))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await task
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(run())
+        self.assertTrue(tracker.cancelled.wait(10))
+
+    def test_cancel_with_limits(self):
+        cancel_event = threading.Event()
+        timer = threading.Timer(0.5, cancel_event.set)
+        timer.start()
+        species = stdpopsim.get_species("homsap")
+        contig = species.get_contig("chr1")
+        before = time.perf_counter()
+        with self.assertRaises(stdpopsim.SimulationCancelledError):
+            self.engine.simulate(
+                model=self.model, contig=contig,
+                samples=self.model.get_samples(1000), seed=1,
+                max_time=600, cancel_event=cancel_event)
+        self.assertLess(time.perf_counter() - before, 60)
+        timer.join()
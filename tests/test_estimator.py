@@ -0,0 +1,200 @@
+"""
+Tests for the runtime and memory estimator.
+"""
+import unittest
+import json
+import pathlib
+import tempfile
+
+import numpy as np
+
+import stdpopsim
+from stdpopsim import estimator
+import tests
+
+
+class TestFeatures(unittest.TestCase):
+    """
+    Tests for the simulation features used by the estimator.
+    """
+    def test_constant_size(self):
+        species = stdpopsim.get_species("homsap")
+        model = stdpopsim.PiecewiseConstantSize(1000)
+        contig = species.get_contig("chr22", length_multiplier=0.1)
+        features = estimator.get_features(model, contig, model.get_samples(10))
+        self.assertEqual(features["num_samples"], 10)
+        self.assertEqual(features["population_size"], 1000)
+        self.assertEqual(features["num_epochs"], 1)
+        self.assertAlmostEqual(
+            features["genetic_length"],
+            contig.recombination_map.get_total_recombination_rate())
+
+    def test_multiple_epochs(self):
+        model = stdpopsim.PiecewiseConstantSize(1000, (10, 100), (20, 10))
+        species = stdpopsim.get_species("homsap")
+        contig = species.get_contig("chr22", length_multiplier=0.1)
+        features = estimator.get_features(model, contig, model.get_samples(5))
+        self.assertEqual(features["num_epochs"], 3)
+
+    def test_multiple_populations(self):
+        species = stdpopsim.get_species("homsap")
+        model = species.get_model("ooa_3")
+        contig = species.get_contig("chr22", length_multiplier=0.1)
+        features = estimator.get_features(model, contig, model.get_samples(5, 5, 5))
+        self.assertEqual(features["num_samples"], 15)
+        sizes = [c.initial_size for c in model.population_configurations]
+        self.assertAlmostEqual(features["population_size"], np.mean(sizes))
+
+
+def synthetic_measurements(time_coefficients, memory_coefficients):
+    measurements = []
+    for n in [10, 100, 1000]:
+        for genetic_length in [0.01, 0.1, 1]:
+            for num_epochs in [1, 5]:
+                features = {
+                    "num_samples": n, "genetic_length": genetic_length,
+                    "population_size": 10000, "num_epochs": num_epochs}
+                x = estimator._design_matrix([features])[0]
+                features["wall_time"] = np.exp(x @ time_coefficients)
+                features["memory"] = np.exp(x @ memory_coefficients)
+                measurements.append(features)
+    return measurements
+
+
+class TestResourceEstimator(unittest.TestCase):
+    """
+    Tests for fitting and using the estimator.
+    """
+    time_coefficients = [-12, 1.4, 0.2, -0.5]
+    memory_coefficients = [14, 0.4, 0.1, -0.2]
+
+    def setUp(self):
+        species = stdpopsim.get_species("homsap")
+        self.model = species.get_model("ooa_3")
+        self.contig = species.get_contig("chr22", length_multiplier=0.1)
+        self.samples = self.model.get_samples(10, 10, 10)
+
+    def test_fit(self):
+        measurements = synthetic_measurements(
+            self.time_coefficients, self.memory_coefficients)
+        e = estimator.ResourceEstimator.fit(measurements)
+        self.assertEqual(e.engine, "msprime")
+        self.assertTrue(np.allclose(e.time_coefficients, self.time_coefficients))
+        self.assertTrue(np.allclose(e.memory_coefficients, self.memory_coefficients))
+        self.assertAlmostEqual(e.time_residual_sd, 0)
+        self.assertEqual(len(e.measurements), len(measurements))
+
+    def test_estimate(self):
+        e = estimator.ResourceEstimator(
+            engine="msprime", time_coefficients=self.time_coefficients,
+            memory_coefficients=self.memory_coefficients, time_residual_sd=0.5,
+            memory_residual_sd=0.5)
+        estimate = e.estimate(self.model, self.contig, self.samples, base_memory=100)
+        x = estimator._design_matrix(
+            [estimator.get_features(self.model, self.contig, self.samples)])[0]
+        self.assertAlmostEqual(estimate.runtime, np.exp(x @ self.time_coefficients))
+        self.assertAlmostEqual(
+            estimate.runtime_upper, np.exp(x @ self.time_coefficients + 1))
+        self.assertEqual(
+            estimate.peak_memory, int(100 + np.exp(x @ self.memory_coefficients)))
+        self.assertGreater(estimate.peak_memory_upper, estimate.peak_memory)
+        # By default, the memory used by the current process is added.
+        estimate = e.estimate(self.model, self.contig, self.samples)
+        self.assertGreater(estimate.peak_memory, 2**20)
+
+    def test_too_few_measurements(self):
+        measurements = synthetic_measurements(
+            self.time_coefficients, self.memory_coefficients)
+        for num_measurements in [0, 1, 4]:
+            with self.assertRaises(ValueError):
+                estimator.ResourceEstimator.fit(measurements[:num_measurements])
+
+    def test_dump_load(self):
+        measurements = synthetic_measurements(
+            self.time_coefficients, self.memory_coefficients)
+        e1 = estimator.ResourceEstimator.fit(measurements, engine_version="1.0")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "calibration.json"
+            e1.dump(path)
+            e2 = estimator.ResourceEstimator.load(path)
+        self.assertEqual(e1, e2)
+
+    def test_bad_version(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "calibration.json"
+            with open(path, "w") as f:
+                json.dump({"version": -1, "engine": "msprime"}, f)
+            with self.assertRaises(ValueError):
+                estimator.ResourceEstimator.load(path)
+
+    def test_shipped_calibration(self):
+        e = estimator.ResourceEstimator.load(estimator.DEFAULT_CALIBRATION_FILE)
+        self.assertEqual(e.engine, "msprime")
+        self.assertEqual(
+            len(e.measurements), len(estimator.get_calibration_simulations()))
+        small = e.estimate(self.model, self.contig, self.samples)
+        species = stdpopsim.get_species("homsap")
+        contig = species.get_contig("chr22")
+        large = e.estimate(self.model, contig, self.model.get_samples(100, 100, 100))
+        self.assertGreater(large.runtime, small.runtime)
+        self.assertGreater(large.peak_memory, small.peak_memory)
+        self.assertGreater(small.runtime_upper, small.runtime)
+
+
+class TestDefaultEstimator(tests.CacheWritingTest):
+    """
+    Tests for choosing between the shipped and user calibrations.
+    """
+    def test_shipped(self):
+        e = estimator.get_default_estimator()
+        shipped = estimator.ResourceEstimator.load(estimator.DEFAULT_CALIBRATION_FILE)
+        self.assertEqual(e, shipped)
+
+    def test_user(self):
+        path = estimator.get_user_calibration_path()
+        self.assertEqual(path.parent, stdpopsim.get_cache_dir())
+        e1 = estimator.ResourceEstimator.fit(
+            synthetic_measurements([-10, 1, 0, 0], [10, 1, 0, 0]))
+        e1.dump(path)
+        e2 = estimator.get_default_estimator()
+        self.assertEqual(e1, e2)
+
+
+class TestCalibrate(unittest.TestCase):
+    """
+    Tests for running the calibration benchmarks.
+    """
+    def test_simulations(self):
+        full = estimator.get_calibration_simulations()
+        quick = estimator.get_calibration_simulations(quick=True)
+        self.assertGreater(len(full), len(quick))
+        self.assertTrue(set(quick) <= set(full))
+
+    def test_measure(self):
+        species = stdpopsim.get_species("homsap")
+        model = stdpopsim.PiecewiseConstantSize(species.population_size)
+        contig = species.get_contig("chr22", length_multiplier=0.01)
+        samples = model.get_samples(10)
+        engine = stdpopsim.get_default_engine()
+        measurement = estimator.measure(engine, model, contig, samples)
+        self.assertEqual(measurement["num_samples"], 10)
+        self.assertGreater(measurement["wall_time"], 0)
+        self.assertGreaterEqual(measurement["memory"], 0)
+
+    def test_calibrate(self):
+        simulations = [
+            ("homsap", model_id, "chr22", length_multiplier, num_samples)
+            for model_id in [None, "ooa_3"]
+            for length_multiplier in [0.001, 0.002]
+            for num_samples in [5, 10]]
+        calls = []
+        e = estimator.calibrate(
+            simulations=simulations,
+            callback=lambda simulation, m: calls.append(simulation))
+        self.assertEqual(calls, simulations)
+        self.assertEqual(len(e.measurements), len(simulations))
+        self.assertEqual(e.engine, "msprime")
+        self.assertEqual(len(e.time_coefficients), 4)
+        for simulation, measurement in zip(simulations, e.measurements):
+            self.assertEqual(measurement["simulation"], list(simulation))
+            self.assertEqual(measurement["num_samples"], simulation[-1])
@@ -0,0 +1,258 @@
+"""
+Tests for the simulation observer infrastructure.
+"""
+import unittest
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import stdpopsim
+from stdpopsim import observers
+
+
+class RecordingObserver(stdpopsim.SimulationObserver):
+    """
+    Observer that records all events.
+    """
+    def __init__(self, progress_interval=None):
+        self.progress_interval = progress_interval
+        self.events = []
+
+    def phase_started(self, phase):
+        self.events.append(("phase_started", phase))
+
+    def phase_finished(self, phase, wall_time, cpu_time):
+        self.events.append(("phase_finished", phase, wall_time, cpu_time))
+
+    def progress(self, phase, elapsed_time, **kwargs):
+        self.events.append(("progress", phase, elapsed_time, kwargs))
+
+    def finished_phases(self):
+        return [event[1] for event in self.events if event[0] == "phase_finished"]
+
+
+class TestObservePhase(unittest.TestCase):
+    """
+    Tests for the observe_phase context manager.
+    """
+    def test_no_observer(self):
+        with observers.observe_phase(None, "x"):
+            pass
+
+    def test_base_class(self):
+        observer = stdpopsim.SimulationObserver()
+        with observers.observe_phase(observer, "x"):
+            pass
+
+    def test_phase(self):
+        observer = RecordingObserver()
+        with observers.observe_phase(observer, "x"):
+            time.sleep(0.01)
+        self.assertEqual(len(observer.events), 2)
+        self.assertEqual(observer.events[0], ("phase_started", "x"))
+        event, phase, wall_time, cpu_time = observer.events[1]
+        self.assertEqual(event, "phase_finished")
+        self.assertEqual(phase, "x")
+        self.assertGreaterEqual(wall_time, 0.01)
+        self.assertGreaterEqual(cpu_time, 0)
+
+    def test_exception(self):
+        observer = RecordingObserver()
+        with self.assertRaises(ValueError):
+            with observers.observe_phase(observer, "x"):
+                raise ValueError()
+        self.assertEqual(observer.finished_phases(), ["x"])
+
+    def test_progress(self):
+        observer = RecordingObserver(progress_interval=0.01)
+        with observers.observe_phase(observer, "x", lambda: {"y": 1}):
+            time.sleep(0.2)
+        progress = [event for event in observer.events if event[0] == "progress"]
+        self.assertGreater(len(progress), 0)
+        for _, phase, elapsed_time, info in progress:
+            self.assertEqual(phase, "x")
+            self.assertGreater(elapsed_time, 0)
+            self.assertEqual(info, {"y": 1})
+        self.assertEqual(observer.events[-1][0], "phase_finished")
+
+
+class TestJsonObserver(unittest.TestCase):
+    """
+    Tests for the JSON observer.
+    """
+    def test_events(self):
+        output = io.StringIO()
+        observer = stdpopsim.JsonObserver(output, progress_interval=0.01)
+        with observers.observe_phase(observer, "x", lambda: {"peak_rss": 10}):
+            time.sleep(0.1)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(records[0]["event"], "phase_started")
+        self.assertEqual(records[-1]["event"], "phase_finished")
+        self.assertIn("wall_time", records[-1])
+        self.assertIn("cpu_time", records[-1])
+        for record in records:
+            self.assertEqual(record["phase"], "x")
+            self.assertIn("timestamp", record)
+        progress = [record for record in records if record["event"] == "progress"]
+        self.assertGreater(len(progress), 0)
+        for record in progress:
+            self.assertEqual(record["peak_rss"], 10)
+            self.assertIn("elapsed_time", record)
+
+
+class TestEngineObserver(unittest.TestCase):
+    """
+    Tests that engines report phases to the observer.
+    """
+    def setUp(self):
+        self.engine = stdpopsim.get_default_engine()
+        species = stdpopsim.get_species("homsap")
+        self.contig = species.get_contig("chr22", length_multiplier=0.001)
+        self.model = stdpopsim.PiecewiseConstantSize(species.population_size)
+
+    def test_simulate(self):
+        observer = RecordingObserver()
+        self.engine.simulate(
+            model=self.model, contig=self.contig,
+            samples=self.model.get_samples(10), observer=observer)
+        self.assertEqual(observer.finished_phases(), [observers.PHASE_SIMULATE])
+
+    def test_simulate_progress(self):
+        observer = RecordingObserver(progress_interval=0.001)
+        species = stdpopsim.get_species("homsap")
+        contig = species.get_contig("chr22", length_multiplier=0.1)
+        self.engine.simulate(
+            model=self.model, contig=contig,
+            samples=self.model.get_samples(100), observer=observer)
+        progress = [event for event in observer.events if event[0] == "progress"]
+        self.assertGreater(len(progress), 0)
+        for event in progress:
+            self.assertEqual(event[1], observers.PHASE_SIMULATE)
+            self.assertIn("peak_rss", event[3])
+
+    @unittest.skipIf(sys.platform != "linux", "Peak RSS of children only on Linux")
+    def test_simulate_with_limits_progress(self):
+        # The final peak RSS of the simulation is reported even if it
+        # finishes before the first periodic report.
+        observer = RecordingObserver(progress_interval=1000)
+        self.engine.simulate(
+            model=self.model, contig=self.contig,
+            samples=self.model.get_samples(10), observer=observer, max_time=600)
+        progress = [event for event in observer.events if event[0] == "progress"]
+        self.assertEqual(len(progress), 1)
+        self.assertEqual(progress[0][1], observers.PHASE_SIMULATE)
+        self.assertGreater(progress[0][3]["peak_rss"], 0)
+        self.assertEqual(
+            observer.finished_phases(),
+            [observers.PHASE_SIMULATE, observers.PHASE_LOAD])
+
+    def test_simulate_nested(self):
+        observer = RecordingObserver()
+        self.engine.simulate_nested(
+            model=self.model, contig=self.contig, sample_sizes=[[10], [5]],
+            observer=observer)
+        self.assertEqual(
+            observer.finished_phases(),
+            [observers.PHASE_SIMULATE, observers.PHASE_SUBSAMPLE])
+
+    def test_simulate_with_limits(self):
+        observer = RecordingObserver()
+        self.engine.simulate(
+            model=self.model, contig=self.contig,
+            samples=self.model.get_samples(10), observer=observer, max_time=600)
+        self.assertEqual(
+            observer.finished_phases(),
+            [observers.PHASE_SIMULATE, observers.PHASE_LOAD])
+
+
+class TestObserverGroup(unittest.TestCase):
+    """
+    Tests for passing events on to several observers.
+    """
+    def test_events(self):
+        group = observers.ObserverGroup([RecordingObserver(), RecordingObserver()])
+        self.assertIsNone(group.progress_interval)
+        with observers.observe_phase(group, "x"):
+            pass
+        for observer in group.observers:
+            self.assertEqual(observer.finished_phases(), ["x"])
+
+    def test_progress(self):
+        group = observers.ObserverGroup([
+            RecordingObserver(), RecordingObserver(progress_interval=0.01),
+            RecordingObserver(progress_interval=1)])
+        self.assertEqual(group.progress_interval, 0.01)
+        with observers.observe_phase(group, "x"):
+            time.sleep(0.1)
+        num_progress = [
+            len([event for event in observer.events if event[0] == "progress"])
+            for observer in group.observers]
+        self.assertEqual(num_progress[0], 0)
+        self.assertGreater(num_progress[1], 0)
+        self.assertEqual(num_progress[1], num_progress[2])
+
+
+class TestProfilingObserver(unittest.TestCase):
+    """
+    Tests for profiling the phases of a run.
+    """
+    def run_phases(self, profiler):
+        profiler.start()
+        with observers.observe_phase(profiler, "x"):
+            data = [list(range(1000)) for _ in range(100)]
+            with observers.observe_phase(profiler, "y"):
+                time.sleep(0.05)
+        with observers.observe_phase(profiler, "y"):
+            pass
+        profiler.stop()
+        return data
+
+    def get_report(self, profiler):
+        output = io.StringIO()
+        profiler.write_report(output)
+        return output.getvalue()
+
+    def test_cpu(self):
+        profiler = observers.ProfilingObserver(cpu=True, memory=False, limit=5)
+        self.run_phases(profiler)
+        self.assertEqual(list(profiler.phases.keys()), ["other", "x", "y"])
+        self.assertEqual(profiler.phases["x"]["count"], 1)
+        self.assertEqual(profiler.phases["y"]["count"], 2)
+        # Nested phases are excluded.
+        self.assertLess(profiler.phases["x"]["wall_time"], 0.05)
+        self.assertGreaterEqual(profiler.phases["y"]["wall_time"], 0.05)
+        report = self.get_report(profiler)
+        lines = report.splitlines()
+        self.assertEqual(lines[0].split(), ["phase", "count", "wall_time", "cpu_time"])
+        self.assertEqual(lines[1].split()[:2], ["other", "1"])
+        self.assertEqual(lines[3].split()[:2], ["y", "2"])
+        for phase in ["other", "x", "y"]:
+            self.assertIn(f"# CPU profile: {phase}", report)
+        self.assertIn("time.sleep", report)
+        self.assertNotIn("Memory allocations", report)
+
+    def test_memory(self):
+        profiler = observers.ProfilingObserver(cpu=False, memory=True)
+        self.run_phases(profiler)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreater(profiler.phases["x"]["memory_peak"], 2**20)
+        self.assertGreater(profiler.phases["x"]["memory_net"], 2**20)
+        self.assertLess(profiler.phases["y"]["memory_net"], 2**20)
+        report = self.get_report(profiler)
+        self.assertEqual(report.splitlines()[0].split()[-2:], [
+            "memory_peak", "memory_net"])
+        self.assertNotIn("CPU profile", report)
+        self.assertIn("# Memory allocations: x", report)
+        self.assertNotIn("# Memory allocations: y", report)
+        self.assertIn(__file__, report)
+
+    def test_stop_running_phase(self):
+        profiler = observers.ProfilingObserver(cpu=True, memory=True)
+        profiler.start()
+        profiler.phase_started("x")
+        profiler.stop()
+        self.assertEqual(profiler.phases["x"]["count"], 1)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.get_report(profiler)
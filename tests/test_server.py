@@ -0,0 +1,310 @@
+"""
+Tests for the simulation server.
+"""
+import unittest
+import http.client
+import io
+import json
+import os
+import pathlib
+import socket
+import tempfile
+import threading
+from unittest import mock
+
+import stdpopsim
+from stdpopsim import server
+from stdpopsim import storage
+
+
+def get_request(**kwargs):
+    document = {
+        "species": "homsap", "chromosome": "chr22", "length_multiplier": 0.001,
+        "samples": [4], "seed": 1}
+    document.update(kwargs)
+    return server.parse_request(document, "msprime")
+
+
+class TestLruCache(unittest.TestCase):
+    """
+    Tests for the cache of contigs and prepared simulations.
+    """
+    def test_get(self):
+        cache = server.LruCache(2)
+        self.assertEqual(cache.get("a", lambda: 1), 1)
+        self.assertEqual(cache.get("a", lambda: 2), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict(self):
+        cache = server.LruCache(2)
+        cache.get("a", lambda: 1)
+        cache.get("b", lambda: 2)
+        cache.get("a", lambda: 1)
+        cache.get("c", lambda: 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a", lambda: 4), 1)
+        self.assertEqual(cache.get("b", lambda: 5), 5)
+
+
+class TestParseRequest(unittest.TestCase):
+    """
+    Tests for validating simulation requests.
+    """
+    def test_defaults(self):
+        request = server.parse_request({"species": "homsap", "samples": [2]}, "x")
+        self.assertEqual(set(request.keys()), set(server.REQUEST_DEFAULTS.keys()))
+        self.assertEqual(request["engine"], "x")
+        self.assertEqual(request["output"], "trees")
+        self.assertEqual(request["length_multiplier"], 1)
+
+    def test_errors(self):
+        for document in [
+                [], {"samples": [2]}, {"species": "homsap"},
+                {"species": "homsap", "samples": 2},
+                {"species": "homsap", "samples": [1]},
+                {"species": "homsap", "samples": [2, -1]},
+                {"species": "homsap", "samples": [2], "output": "vcf"},
+                {"species": "homsap", "samples": [2], "compression": "xyz"},
+                {"species": "homsap", "samples": [True, True]},
+                {"species": "homsap", "samples": [2], "seed": "1"},
+                {"species": "homsap", "samples": [2], "seed": True},
+                {"species": "homsap", "samples": [2], "length_multiplier": "1"},
+                {"species": "homsap", "samples": [2], "length_multiplier": True},
+                {"species": "homsap", "samples": [2], "xyz": 1}]:
+            with self.assertRaises(server.RequestError):
+                server.parse_request(document, "msprime")
+
+
+class TestSimulationService(unittest.TestCase):
+    """
+    Tests for running simulation requests.
+    """
+    def setUp(self):
+        self.service = server.SimulationService(num_workers=1, max_queue=1)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_trees(self):
+        content_type, body = self.service.run(get_request())
+        self.assertEqual(content_type, "application/octet-stream")
+        ts = storage.load(io.BytesIO(body))
+        self.assertEqual(ts.num_samples, 4)
+        provenance = json.loads(ts.provenance(ts.num_provenances - 1).record)
+        self.assertEqual(provenance["parameters"]["request"], get_request())
+
+    def test_compression(self):
+        _, body = self.service.run(get_request(compression="zlib"))
+        self.assertEqual(storage.load(io.BytesIO(body)).num_samples, 4)
+
+    def test_stats(self):
+        content_type, body = self.service.run(
+            get_request(model="ooa_3", samples=[2, 0, 3], output="stats"))
+        self.assertEqual(content_type, "application/json")
+        stats = json.loads(body)
+        self.assertEqual(stats["num_samples"], 5)
+        self.assertEqual(list(stats["populations"].keys()), ["YRI", "CHB"])
+        self.assertEqual(stats["populations"]["CHB"]["num_samples"], 3)
+        self.assertGreaterEqual(stats["diversity"], 0)
+
+    def test_same_seed(self):
+        _, body1 = self.service.run(get_request())
+        _, body2 = self.service.run(get_request())
+        ts1 = storage.load(io.BytesIO(body1))
+        ts2 = storage.load(io.BytesIO(body2))
+        self.assertEqual(ts1.tables.nodes, ts2.tables.nodes)
+
+    def test_cache(self):
+        for _ in range(3):
+            self.service.run(get_request(output="stats"))
+        self.service.run(get_request(samples=[2, 2], model="ooa_3", output="stats"))
+        status = self.service.status()
+        self.assertEqual(status["contigs"], {"size": 1, "hits": 3, "misses": 1})
+        self.assertEqual(status["prepared"], {"size": 2, "hits": 2, "misses": 2})
+
+    def test_default_chromosome(self):
+        request = get_request(length_multiplier=0.0001)
+        request["chromosome"] = None
+        self.service.run(request)
+        self.assertEqual(request["chromosome"], "chr1")
+
+    def test_bad_requests(self):
+        for kwargs in [
+                {"species": "xyz"}, {"model": "xyz"}, {"chromosome": "xyz"},
+                {"genetic_map": "xyz"}, {"engine": "xyz"},
+                {"model": "ooa_3", "samples": [1, 1, 1, 1]}]:
+            with self.assertRaises(server.RequestError):
+                self.service.run(get_request(**kwargs))
+
+    def test_bad_samples(self):
+        with mock.patch.object(
+                stdpopsim.Model, "get_samples",
+                side_effect=ValueError("xyz")):
+            with self.assertRaises(server.RequestError):
+                self.service.run(get_request())
+        self.assertEqual(len(self.service.prepared), 0)
+
+    def test_back_pressure(self):
+        event = threading.Event()
+        with mock.patch.object(
+                self.service, "run", side_effect=lambda request: event.wait()):
+            futures = [self.service.submit(get_request()) for _ in range(2)]
+            with self.assertRaises(server.ServerBusyError):
+                self.service.submit(get_request())
+            self.assertEqual(self.service.status()["pending"], 2)
+            self.assertEqual(self.service.status()["rejected"], 1)
+            event.set()
+            for future in futures:
+                future.result()
+            futures.append(self.service.submit(get_request()))
+            futures[-1].result()
+        status = self.service.status()
+        self.assertEqual(status["pending"], 0)
+        self.assertEqual(status["completed"], 3)
+
+    def test_failed(self):
+        future = self.service.submit(get_request(species="xyz"))
+        with self.assertRaises(server.RequestError):
+            future.result()
+        self.assertEqual(self.service.status()["failed"], 1)
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            server.SimulationService(num_workers=0)
+        with self.assertRaises(ValueError):
+            server.SimulationService(max_queue=-1)
+
+
+class TestSimulationServer(unittest.TestCase):
+    """
+    Tests for the HTTP server, listening on a free port of localhost.
+    """
+    def setUp(self):
+        self.service = server.SimulationService(num_workers=1, max_queue=0)
+        self.httpd = self.make_server()
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        self.service.shutdown()
+
+    def make_server(self):
+        return server.SimulationServer(("127.0.0.1", 0), self.service)
+
+    def get_connection(self):
+        return http.client.HTTPConnection(*self.httpd.server_address[:2])
+
+    def request(self, method, path, body=None, headers=None):
+        connection = self.get_connection()
+        try:
+            if body is not None and not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            connection.request(
+                method, path, body=body, headers={} if headers is None else headers)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def test_simulate(self):
+        document = {"species": "homsap", "length_multiplier": 0.0001, "samples": [3]}
+        status, headers, body = self.request("POST", "/simulate", document)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "application/octet-stream")
+        self.assertEqual(storage.load(io.BytesIO(body)).num_samples, 3)
+        document["output"] = "stats"
+        status, headers, body = self.request("POST", "/simulate", document)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["num_samples"], 3)
+
+    def test_status(self):
+        status, _, body = self.request("GET", "/status")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["workers"], 1)
+
+    def test_errors(self):
+        status, _, body = self.request("POST", "/simulate", b"{")
+        self.assertEqual(status, 400)
+        self.assertIn("Invalid JSON", json.loads(body)["error"])
+        status, _, body = self.request("POST", "/simulate", {"species": "homsap"})
+        self.assertEqual(status, 400)
+        self.assertIn("samples", json.loads(body)["error"])
+        status, _, _ = self.request(
+            "POST", "/simulate", {"species": "xyz", "samples": [2]})
+        self.assertEqual(status, 400)
+        status, _, _ = self.request("GET", "/xyz")
+        self.assertEqual(status, 404)
+        status, _, _ = self.request("POST", "/xyz", {})
+        self.assertEqual(status, 404)
+        status, _, _ = self.request(
+            "POST", "/simulate", None,
+            {"Content-Length": str(server.MAX_REQUEST_SIZE + 1)})
+        self.assertEqual(status, 413)
+        for length in ["-1", "xyz"]:
+            status, _, body = self.request(
+                "POST", "/simulate", None, {"Content-Length": length})
+            self.assertEqual(status, 400)
+            self.assertIn("Content-Length", json.loads(body)["error"])
+
+    def test_internal_error(self):
+        with mock.patch.object(self.service, "run", side_effect=RuntimeError("x")):
+            with mock.patch("stdpopsim.server.logger"):
+                status, _, body = self.request(
+                    "POST", "/simulate", {"species": "homsap", "samples": [2]})
+        self.assertEqual(status, 500)
+        self.assertEqual(json.loads(body)["error"], "RuntimeError: x")
+
+    def test_busy(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def run(request):
+            started.set()
+            finish.wait()
+            return "application/json", b"{}"
+
+        document = {"species": "homsap", "samples": [2]}
+        with mock.patch.object(self.service, "run", side_effect=run):
+            results = []
+            thread = threading.Thread(
+                target=lambda: results.append(
+                    self.request("POST", "/simulate", document)))
+            thread.start()
+            started.wait()
+            status, headers, _ = self.request("POST", "/simulate", document)
+            self.assertEqual(status, 503)
+            self.assertEqual(headers["Retry-After"], "1")
+            finish.set()
+            thread.join()
+        self.assertEqual(results[0][0], 200)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestUnixSimulationServer(TestSimulationServer):
+    """
+    Tests for the HTTP server, listening on a Unix domain socket.
+    """
+    def make_server(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = str(pathlib.Path(self.tmpdir.name) / "stdpopsim.sock")
+        return server.UnixSimulationServer(self.path, self.service)
+
+    def tearDown(self):
+        super().tearDown()
+        self.assertFalse(os.path.exists(self.path))
+        self.tmpdir.cleanup()
+
+    def get_connection(self):
+        return UnixHTTPConnection(self.path)
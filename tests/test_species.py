@@ -2,7 +2,11 @@
 Tests for the genetic species interface.
 """
 import unittest
+import importlib
 import math
+import pkgutil
+import subprocess
+import sys
 
 import msprime
 
@@ -32,6 +36,59 @@ class TestSpecies(unittest.TestCase):
             with self.assertRaises(ValueError):
                 stdpopsim.get_species(species_name)
 
+    def test_catalog_index(self):
+        species_ids = [species.id for species in stdpopsim.all_species()]
+        self.assertEqual(
+            species_ids[:len(stdpopsim.catalog_index)],
+            list(stdpopsim.catalog_index.keys()))
+        for species_id, (module_name, name) in stdpopsim.catalog_index.items():
+            module = getattr(stdpopsim, module_name)
+            self.assertEqual(module._species.id, species_id)
+            self.assertEqual(module._species.name, name)
+
+    def test_catalog_index_complete(self):
+        # Every module in the catalog must be listed in the index, as the
+        # species it defines cannot be found otherwise.
+        import stdpopsim.catalog
+        module_names = sorted(
+            module.name for module in pkgutil.iter_modules(stdpopsim.catalog.__path__))
+        self.assertEqual(
+            module_names, sorted(m for m, _ in stdpopsim.catalog_index.values()))
+        for module_name in module_names:
+            module = importlib.import_module(f"stdpopsim.catalog.{module_name}")
+            species_id = module._species.id
+            self.assertEqual(stdpopsim.catalog_index[species_id][0], module_name)
+
+    def test_all_species_names(self):
+        names = stdpopsim.all_species_names()
+        species_list = list(stdpopsim.all_species())
+        self.assertEqual(list(names.keys()), [species.id for species in species_list])
+        for species in species_list:
+            self.assertEqual(names[species.id], species.name)
+
+    def test_lazy_import(self):
+        # Use a new interpreter, as the catalog is already loaded here.
+        script = (
+            "import sys, stdpopsim\n"
+            "def loaded():\n"
+            "    return sorted(\n"
+            "        m for m, _ in stdpopsim.catalog_index.values()\n"
+            "        if f'stdpopsim.catalog.{m}' in sys.modules)\n"
+            "print(loaded())\n"
+            "stdpopsim.get_species('dromel')\n"
+            "print(loaded())\n"
+            "print([species.id for species in stdpopsim.all_species()])\n"
+            "print(loaded())\n")
+        result = subprocess.run(
+            [sys.executable, "-c", script], check=True, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        lines = result.stdout.splitlines()
+        self.assertEqual(lines[0], "[]")
+        self.assertEqual(lines[1], "['drosophila_melanogaster']")
+        self.assertEqual(lines[2], str(list(stdpopsim.catalog_index.keys())))
+        self.assertEqual(
+            lines[3], str(sorted(m for m, _ in stdpopsim.catalog_index.values())))
+
     def test_get_known_genetic_map(self):
         good = ["HapmapII_GRCh37", "Decode_2010_sex_averaged"]
         species = stdpopsim.get_species("homsap")
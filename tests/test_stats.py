@@ -0,0 +1,109 @@
+"""
+Tests for the windowed summary statistics.
+"""
+import unittest
+import io
+
+import msprime
+import numpy as np
+
+from stdpopsim import stats
+
+
+def get_example_ts():
+    return msprime.simulate(
+        population_configurations=[
+            msprime.PopulationConfiguration(5),
+            msprime.PopulationConfiguration(0),
+            msprime.PopulationConfiguration(4)],
+        migration_matrix=[[0, 1e-3, 1e-3], [1e-3, 0, 1e-3], [1e-3, 1e-3, 0]],
+        length=1e5, recombination_rate=1e-8, mutation_rate=1e-8, Ne=1e4,
+        random_seed=1)
+
+
+class TestGetWindows(unittest.TestCase):
+    """
+    Tests for the windows of equal length.
+    """
+    def test_windows(self):
+        self.assertEqual(list(stats.get_windows(10, 1)), [0, 10])
+        self.assertEqual(list(stats.get_windows(10, 4)), [0, 2.5, 5, 7.5, 10])
+
+    def test_bad_windows(self):
+        with self.assertRaises(ValueError):
+            stats.get_windows(10, 0)
+
+
+class TestGetWindowStats(unittest.TestCase):
+    """
+    Tests for computing the statistics in each window.
+    """
+    def test_columns(self):
+        ts = get_example_ts()
+        windows = stats.get_windows(ts.sequence_length, 3)
+        window_stats = stats.get_window_stats(ts, windows, ["A", "B", "C"])
+        self.assertEqual(
+            list(window_stats.keys()),
+            ["start", "end", "diversity_A", "diversity_C", "tajimas_d_A",
+             "tajimas_d_C", "fst_A_C"] + [f"sfs_A_{k}" for k in range(1, 5)] +
+            [f"sfs_C_{k}" for k in range(1, 4)])
+        for values in window_stats.values():
+            self.assertEqual(len(values), 3)
+        self.assertEqual(list(window_stats["start"]), list(windows[:-1]))
+        self.assertEqual(list(window_stats["end"]), list(windows[1:]))
+
+    def test_values(self):
+        ts = get_example_ts()
+        windows = stats.get_windows(ts.sequence_length, 4)
+        window_stats = stats.get_window_stats(ts, windows)
+        samples = ts.samples(population=0)
+        self.assertTrue(np.allclose(
+            window_stats["diversity_0"], ts.diversity(samples, windows=windows)))
+        self.assertTrue(np.allclose(
+            window_stats["fst_0_2"],
+            ts.Fst([samples, ts.samples(population=2)], windows=windows)))
+        afs = ts.allele_frequency_spectrum(
+            [samples], windows=windows, polarised=True, span_normalise=False)
+        self.assertTrue(np.array_equal(window_stats["sfs_0_1"], afs[:, 1]))
+        # Every site is segregating in the full sample, but not necessarily
+        # in each population.
+        num_sites = sum(
+            window_stats[f"sfs_0_{k}"].sum() for k in range(1, 5))
+        self.assertLessEqual(num_sites, ts.num_sites)
+
+    def test_threads(self):
+        ts = get_example_ts()
+        windows = stats.get_windows(ts.sequence_length, 5)
+        serial = stats.get_window_stats(ts, windows)
+        threaded = stats.get_window_stats(ts, windows, num_threads=4)
+        self.assertEqual(list(serial.keys()), list(threaded.keys()))
+        for key, values in serial.items():
+            self.assertTrue(np.array_equal(values, threaded[key], equal_nan=True))
+
+    def test_single_population(self):
+        ts = msprime.simulate(4, length=1e4, mutation_rate=1e-8, Ne=1e4, random_seed=1)
+        window_stats = stats.get_window_stats(ts, [0, ts.sequence_length])
+        self.assertNotIn("fst", " ".join(window_stats.keys()))
+
+    def test_errors(self):
+        ts = get_example_ts()
+        windows = [0, ts.sequence_length]
+        with self.assertRaises(ValueError):
+            stats.get_window_stats(ts, windows, num_threads=0)
+        with self.assertRaises(ValueError):
+            stats.get_window_stats(ts, windows, ["A"])
+
+
+class TestWriteWindowStats(unittest.TestCase):
+    """
+    Tests for writing the table of statistics.
+    """
+    def test_table(self):
+        window_stats = {
+            "start": np.array([0, 5.0]), "end": np.array([5.0, 10]),
+            "diversity_A": np.array([0.00012345678, np.nan])}
+        output = io.StringIO()
+        stats.write_window_stats(window_stats, output)
+        self.assertEqual(
+            output.getvalue().splitlines(),
+            ["start\tend\tdiversity_A", "0\t5\t0.000123457", "5\t10\tnan"])
@@ -0,0 +1,509 @@
+"""
+Tests for writing tree sequences with additional provenance.
+"""
+import unittest
+import gzip
+import io
+import itertools
+import json
+import pathlib
+import tempfile
+from unittest import mock
+
+import kastore
+import msprime
+import numpy as np
+import tskit
+
+from stdpopsim import storage
+
+
+def get_example_ts():
+    ts = msprime.simulate(
+        10, length=1e5, recombination_rate=1e-8, mutation_rate=1e-8, Ne=1e4,
+        random_seed=1)
+    tables = ts.dump_tables()
+    schema = tskit.MetadataSchema.permissive_json()
+    tables.metadata_schema = schema
+    tables.metadata = {"x": 1}
+    tables.populations.metadata_schema = schema
+    tables.populations.clear()
+    tables.populations.add_row(metadata={"name": "pop0"})
+    tables.individuals.add_row(location=[1, 2], parents=[-1, -1], metadata=b"abc")
+    return tables.tree_sequence()
+
+
+def parse_version(version):
+    parts = []
+    for part in version.split("."):
+        digits = "".join(itertools.takewhile(str.isdigit, part))
+        if len(digits) == 0:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+
+class TestKastoreVersion(unittest.TestCase):
+    """
+    Tests that the installed kastore is one that write_arrays supports.
+    """
+    def test_installed_version(self):
+        lower, upper = storage.KASTORE_VERSIONS
+        version = parse_version(kastore.__version__)
+        self.assertGreaterEqual(version, parse_version(lower))
+        self.assertLess(version, parse_version(upper))
+
+    def test_setup_requirement(self):
+        lower, upper = storage.KASTORE_VERSIONS
+        setup_py = pathlib.Path(__file__).parent.parent / "setup.py"
+        self.assertIn(f'"kastore>={lower},<{upper}"', setup_py.read_text())
+
+    def test_parse_version(self):
+        self.assertEqual(parse_version("0.3.6"), (0, 3, 6))
+        self.assertEqual(parse_version("0.4.0rc1"), (0, 4, 0))
+        self.assertEqual(parse_version("1.0.dev3"), (1, 0))
+        self.assertLess(parse_version("0.3.10"), parse_version("0.4"))
+
+
+class TestGetArrays(unittest.TestCase):
+    """
+    Tests for the arrays representing a tree sequence in the file format.
+    """
+    def test_same_as_dump(self):
+        ts = get_example_ts()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.trees"
+            ts.dump(path)
+            expected = dict(kastore.load(path, read_all=True))
+        arrays = storage.get_arrays(ts)
+        self.assertEqual(set(arrays.keys()), set(expected.keys()))
+        for key, array in arrays.items():
+            if key == "uuid":
+                continue
+            self.assertTrue(np.array_equal(array, expected[key]), key)
+
+    def test_columns_not_copied(self):
+        ts = get_example_ts()
+        arrays = storage.get_arrays(ts)
+        tables = ts.tables
+        self.assertTrue(np.shares_memory(arrays["nodes/time"], tables.nodes.time))
+        self.assertTrue(np.shares_memory(arrays["edges/left"], tables.edges.left))
+        self.assertTrue(np.shares_memory(
+            arrays["sites/ancestral_state"], tables.sites.ancestral_state))
+
+    def test_provenance(self):
+        ts = get_example_ts()
+        arrays = storage.get_arrays(ts, {"a": 1})
+        offset = arrays["provenances/record_offset"]
+        self.assertEqual(len(offset), ts.num_provenances + 2)
+        record = bytes(arrays["provenances/record"][offset[-2]:offset[-1]])
+        self.assertEqual(json.loads(record), {"a": 1})
+
+    def test_reference_sequence(self):
+        tables = get_example_ts().dump_tables()
+        tables.reference_sequence.data = "ACGT"
+        tables.reference_sequence.url = "https://example.com/ref.fa"
+        ts = tables.tree_sequence()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.trees"
+            ts.dump(path)
+            expected = dict(kastore.load(path, read_all=True))
+        arrays = storage.get_arrays(ts)
+        self.assertEqual(set(arrays.keys()), set(expected.keys()))
+        for key in ["reference_sequence/data", "reference_sequence/url"]:
+            self.assertTrue(np.array_equal(arrays[key], expected[key]), key)
+
+
+class TestWriteArrays(unittest.TestCase):
+    """
+    Tests for writing arrays in the kastore format.
+    """
+    def test_same_as_kastore(self):
+        arrays = {
+            "a": np.arange(10, dtype=np.int32),
+            "b/c": np.array([1.5, 2.5]),
+            "d": np.zeros(0, dtype=np.uint8),
+            "e": np.arange(7, dtype=np.int8)[::2],
+        }
+        output = io.BytesIO()
+        storage.write_arrays(arrays, output)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.kas"
+            kastore.dump(arrays, path)
+            with open(path, "rb") as f:
+                self.assertEqual(output.getvalue(), f.read())
+
+    def test_bad_arrays(self):
+        with self.assertRaises(ValueError):
+            storage.write_arrays({"a": np.zeros((2, 2))}, io.BytesIO())
+
+
+class TestCompressArrays(unittest.TestCase):
+    """
+    Tests for the columnar compression of arrays.
+    """
+    def verify(self, arrays, codec):
+        compressed = storage.compress_arrays(arrays, codec)
+        for array in compressed.values():
+            self.assertEqual(len(array.shape), 1)
+        decompressed = storage.decompress_arrays(compressed)
+        self.assertEqual(set(decompressed.keys()), set(arrays.keys()))
+        for key, array in arrays.items():
+            self.assertEqual(decompressed[key].dtype, array.dtype, key)
+            self.assertTrue(np.array_equal(decompressed[key], array), key)
+        return compressed
+
+    def test_tree_sequence(self):
+        arrays = storage.get_arrays(get_example_ts(), {"a": 1})
+        for codec in storage.COMPRESSION_CODECS:
+            self.verify(arrays, codec)
+
+    def test_filters(self):
+        arrays = {
+            "edges/parent": np.array([5, 5, 7, 2**31 - 1, -2**31, 0], dtype=np.int32),
+            "x_offset": np.array([0, 2**64 - 1, 1, 1], dtype=np.uint64),
+            "edges/left": np.array([0, 0.5, 0.5, 1]),
+            "nodes/time": np.array([0, 1.5, -np.inf, np.nan]),
+            "nodes/flags": np.array([1, 0, 1], dtype=np.uint32),
+            "sites/ancestral_state": np.array([65, 67, 255], dtype=np.uint8),
+            "empty": np.zeros(0, dtype=np.int64),
+        }
+        compressed = self.verify(
+            {k: v for k, v in arrays.items() if k != "nodes/time"}, "zlib")
+        header = json.loads(bytes(compressed["compression/header"]))
+        self.assertEqual(header["columns"]["edges/parent"]["filter"], "delta")
+        self.assertEqual(header["columns"]["x_offset"]["filter"], "delta")
+        self.assertEqual(header["columns"]["edges/left"]["filter"], None)
+        self.assertEqual(header["columns"]["nodes/flags"]["filter"], "shuffle")
+        time = storage.decompress_arrays(
+            storage.compress_arrays({"nodes/time": arrays["nodes/time"]}))
+        self.assertTrue(np.array_equal(
+            time["nodes/time"], arrays["nodes/time"], equal_nan=True))
+
+    def test_smaller(self):
+        ts = msprime.simulate(
+            50, length=1e6, recombination_rate=1e-8, mutation_rate=1e-8, Ne=1e4,
+            random_seed=2)
+        arrays = storage.get_arrays(ts)
+        size = sum(array.nbytes for array in arrays.values())
+        for codec in storage.COMPRESSION_CODECS:
+            compressed = storage.compress_arrays(arrays, codec)
+            compressed_size = sum(array.nbytes for array in compressed.values())
+            self.assertLess(compressed_size, size / 2)
+
+    def test_bad_codec(self):
+        with self.assertRaises(ValueError):
+            storage.compress_arrays({"a": np.zeros(2)}, "xyz")
+
+    def test_bad_arrays(self):
+        with self.assertRaises(ValueError):
+            storage.compress_arrays({"a": np.zeros((2, 2))})
+
+    def test_bad_version(self):
+        compressed = storage.compress_arrays({"a": np.zeros(2)})
+        compressed["format/version"] = np.array([2, 0], dtype=np.uint32)
+        with self.assertRaises(ValueError):
+            storage.decompress_arrays(compressed)
+
+
+class TestDump(unittest.TestCase):
+    """
+    Tests for dumping tree sequences with additional provenance.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "out.trees"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def verify(self, ts, provenance, written=None):
+        if written is None:
+            written = tskit.load(self.path)
+        tables = written.dump_tables()
+        if provenance is None:
+            self.assertEqual(written.num_provenances, ts.num_provenances)
+        else:
+            self.assertEqual(written.num_provenances, ts.num_provenances + 1)
+            record = written.provenance(ts.num_provenances).record
+            if not isinstance(provenance, str):
+                provenance = json.dumps(provenance)
+            self.assertEqual(record, provenance)
+            tables.provenances.truncate(ts.num_provenances)
+        self.assertEqual(tables, ts.tables)
+
+    def test_path(self):
+        ts = get_example_ts()
+        for provenance in [None, {"a": [1, 2]}, "string record"]:
+            storage.dump(ts, self.path, provenance)
+            self.verify(ts, provenance)
+            storage.dump(ts, str(self.path), provenance)
+            self.verify(ts, provenance)
+
+    def test_file(self):
+        ts = get_example_ts()
+        with open(self.path, "wb") as f:
+            storage.dump(ts, f, {"a": 1})
+        self.verify(ts, {"a": 1})
+
+    def test_empty(self):
+        ts = tskit.TableCollection(1).tree_sequence()
+        storage.dump(ts, self.path, {"a": 1})
+        self.verify(ts, {"a": 1})
+
+    def test_reference_sequence(self):
+        tables = get_example_ts().dump_tables()
+        tables.reference_sequence.data = "ACGT"
+        ts = tables.tree_sequence()
+        storage.dump(ts, self.path, {"a": 1})
+        written = tskit.load(self.path)
+        self.assertEqual(written.reference_sequence.data, "ACGT")
+        self.verify(ts, {"a": 1})
+
+    def test_compressed(self):
+        ts = get_example_ts()
+        for codec in storage.COMPRESSION_CODECS:
+            for provenance in [None, {"a": 1}]:
+                storage.dump(ts, self.path, provenance, compression=codec)
+                with self.assertRaises(tskit.FileFormatError):
+                    tskit.load(self.path)
+                self.verify(ts, provenance, storage.load(self.path))
+
+    def test_compressed_file(self):
+        ts = get_example_ts()
+        output = io.BytesIO()
+        storage.dump(ts, output, {"a": 1}, compression="zlib")
+        output.seek(0)
+        self.verify(ts, {"a": 1}, storage.load(output))
+
+    def test_compressed_reference_sequence(self):
+        tables = get_example_ts().dump_tables()
+        tables.reference_sequence.data = "ACGT"
+        tables.reference_sequence.metadata_schema = (
+            tskit.MetadataSchema.permissive_json())
+        tables.reference_sequence.metadata = {"b": 2}
+        ts = tables.tree_sequence()
+        storage.dump(ts, self.path, {"a": 1}, compression="zlib")
+        self.verify(ts, {"a": 1}, storage.load(self.path))
+
+
+class TestLoad(unittest.TestCase):
+    """
+    Tests for loading tree sequences from files.
+    """
+    def test_uncompressed(self):
+        ts = get_example_ts()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.trees"
+            ts.dump(path)
+            loaded = storage.load(path)
+            with open(path, "rb") as f:
+                loaded_file = storage.load(f)
+        self.assertEqual(loaded.tables, ts.tables)
+        self.assertEqual(loaded_file.tables, ts.tables)
+
+    def test_empty(self):
+        ts = tskit.TableCollection(1).tree_sequence()
+        for codec in [None, "zlib"]:
+            output = io.BytesIO()
+            storage.dump(ts, output, compression=codec)
+            output.seek(0)
+            self.assertEqual(storage.load(output).tables, ts.tables)
+
+    def test_not_tree_sequence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.kas"
+            kastore.dump({"a": np.zeros(2)}, path)
+            with self.assertRaises(ValueError):
+                storage.load(path)
+
+
+class TestBgzfWriter(unittest.TestCase):
+    """
+    Tests for writing files in the BGZF format.
+    """
+    def get_blocks(self, data):
+        # Returns the blocks of a BGZF file, using the block sizes in the
+        # gzip headers.
+        blocks = []
+        offset = 0
+        while offset < len(data):
+            self.assertEqual(data[offset:offset + 4], b"\x1f\x8b\x08\x04")
+            self.assertEqual(data[offset + 12:offset + 16], b"BC\x02\x00")
+            size = int.from_bytes(data[offset + 16:offset + 18], "little") + 1
+            blocks.append(data[offset:offset + size])
+            offset += size
+        self.assertEqual(offset, len(data))
+        return blocks
+
+    def test_round_trip(self):
+        data = bytes(np.random.RandomState(1).randint(0, 4, size=200000, dtype=np.uint8))
+        output = io.BytesIO()
+        with storage.BgzfWriter(output) as writer:
+            for j in range(0, len(data), 1000):
+                writer.write(data[j:j + 1000])
+        self.assertFalse(output.closed)
+        written = output.getvalue()
+        self.assertEqual(gzip.decompress(written), data)
+        blocks = self.get_blocks(written)
+        self.assertEqual(blocks[-1], storage.BGZF_EOF)
+        self.assertEqual(len(blocks), 5)
+        for block in blocks[:3]:
+            self.assertEqual(len(gzip.decompress(block)), storage.BGZF_BLOCK_SIZE)
+
+    def test_empty(self):
+        output = io.BytesIO()
+        storage.BgzfWriter(output).close()
+        self.assertEqual(output.getvalue(), storage.BGZF_EOF)
+        self.assertEqual(gzip.decompress(output.getvalue()), b"")
+
+
+class TestWriteVcf(unittest.TestCase):
+    """
+    Tests for streaming variants in VCF format.
+    """
+    def get_ts(self):
+        return msprime.simulate(
+            10, length=1e5, recombination_rate=1e-8, mutation_rate=1e-8, Ne=1e4,
+            random_seed=1)
+
+    def get_vcf(self, ts, contig_id="1"):
+        output = io.StringIO()
+        ts.write_vcf(output, contig_id=contig_id)
+        return output.getvalue()
+
+    def test_file(self):
+        ts = self.get_ts()
+        self.assertGreater(ts.num_sites, 0)
+        output = io.BytesIO()
+        storage.write_vcf(ts, output, contig_id="chr1")
+        self.assertEqual(output.getvalue().decode(), self.get_vcf(ts, "chr1"))
+
+    def test_path(self):
+        ts = self.get_ts()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.vcf"
+            storage.write_vcf(ts, path)
+            self.assertEqual(path.read_text(), self.get_vcf(ts))
+
+    def test_bgzip(self):
+        ts = self.get_ts()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.vcf.gz"
+            storage.write_vcf(ts, path, "bgzip")
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(f.read(), self.get_vcf(ts))
+            self.assertTrue(path.read_bytes().endswith(storage.BGZF_EOF))
+
+    def test_position_zero(self):
+        tables = self.get_ts().dump_tables()
+        tables.sites.add_row(0.25, "0")
+        tables.sort()
+        ts = tables.tree_sequence()
+        output = io.BytesIO()
+        storage.write_vcf(ts, output)
+        lines = output.getvalue().decode().splitlines()
+        first = [line for line in lines if not line.startswith("#")][0]
+        self.assertEqual(first.split("\t")[1], "1")
+
+    def test_write_error(self):
+        output = mock.Mock(write=mock.Mock(side_effect=OSError("full")))
+        with self.assertRaises(OSError):
+            storage.write_vcf(self.get_ts(), output)
+
+    def test_bad_compression(self):
+        with self.assertRaises(ValueError):
+            storage.write_vcf(self.get_ts(), io.BytesIO(), "zlib")
+
+
+class UnseekableFile(io.RawIOBase):
+    """
+    A binary file object that cannot seek or tell, like a pipe.
+    """
+    def __init__(self):
+        self.data = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.data.write(data)
+
+
+class TestWriteGenotypes(unittest.TestCase):
+    """
+    Tests for writing chunked genotype matrices.
+    """
+    def get_ts(self):
+        return msprime.simulate(
+            population_configurations=[
+                msprime.PopulationConfiguration(4),
+                msprime.PopulationConfiguration(3)],
+            migration_matrix=[[0, 1e-3], [1e-3, 0]], length=1e5,
+            recombination_rate=1e-8, mutation_rate=1e-8, Ne=1e4, random_seed=1)
+
+    def verify(self, ts, data, chunk_size):
+        self.assertTrue(np.array_equal(data["positions"], ts.tables.sites.position))
+        self.assertTrue(np.array_equal(
+            data["sample_populations"], ts.tables.nodes.population[ts.samples()]))
+        num_chunks = len([key for key in data.keys() if key.startswith("genotypes")])
+        self.assertEqual(num_chunks, -(-ts.num_sites // chunk_size))
+        chunks = [data[f"genotypes_{j}"] for j in range(num_chunks)]
+        for chunk in chunks[:-1]:
+            self.assertEqual(chunk.shape, (chunk_size, ts.num_samples))
+        self.assertTrue(np.array_equal(np.concatenate(chunks), ts.genotype_matrix()))
+
+    def test_file(self):
+        ts = self.get_ts()
+        self.assertGreater(ts.num_sites, 10)
+        for chunk_size in [1, 7, ts.num_sites, ts.num_sites + 1]:
+            output = io.BytesIO()
+            storage.write_genotypes(ts, output, chunk_size=chunk_size)
+            output.seek(0)
+            data = np.load(output)
+            self.verify(ts, data, chunk_size)
+            self.assertEqual(data["genotypes_0"].dtype, np.int8)
+            self.assertEqual(list(data["population_names"]), ["pop_0", "pop_1"])
+
+    def test_path(self):
+        ts = self.get_ts()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "out.npz"
+            storage.write_genotypes(
+                ts, path, chunk_size=10, population_names=["A", "B"])
+            with np.load(path) as data:
+                self.verify(ts, data, 10)
+                self.assertEqual(list(data["population_names"]), ["A", "B"])
+
+    def test_compressed(self):
+        ts = self.get_ts()
+        output = io.BytesIO()
+        storage.write_genotypes(ts, output, "zlib", chunk_size=10)
+        uncompressed = io.BytesIO()
+        storage.write_genotypes(ts, uncompressed, chunk_size=10)
+        self.assertLess(len(output.getvalue()), len(uncompressed.getvalue()))
+        output.seek(0)
+        self.verify(ts, np.load(output), 10)
+
+    def test_unseekable(self):
+        ts = self.get_ts()
+        output = UnseekableFile()
+        storage.write_genotypes(ts, output, chunk_size=10)
+        self.verify(ts, np.load(io.BytesIO(output.data.getvalue())), 10)
+
+    def test_no_sites(self):
+        ts = msprime.simulate(5, random_seed=1)
+        output = io.BytesIO()
+        storage.write_genotypes(ts, output)
+        output.seek(0)
+        data = np.load(output)
+        self.assertEqual(data["positions"].shape, (0,))
+        self.assertNotIn("genotypes_0", data.keys())
+
+    def test_errors(self):
+        ts = self.get_ts()
+        for kwargs in [
+                {"compression": "lzma"}, {"chunk_size": 0},
+                {"population_names": ["A"]}]:
+            with self.assertRaises(ValueError):
+                storage.write_genotypes(ts, io.BytesIO(), **kwargs)